@@ -6,6 +6,19 @@ class Interpreter(InterpreterBase):
     def __init__(self, console_output=True, inp=None, trace_output=False):
         super().__init__(console_output, inp)
         self.variables = {}
+        # node type -> method that runs/evaluates that kind of node
+        self.statement_handlers = {
+            '=': self.do_assignment,
+            'fcall': self.do_function_call_statement,
+        }
+        self.expression_handlers = {
+            '+': self.evaluate_arithmetic,
+            '-': self.evaluate_arithmetic,
+            'fcall': self.do_function_call_expression,
+            'var': self.evaluate_variable,
+            'int': self.evaluate_constant,
+            'string': self.evaluate_constant,
+        }
 
     def run(self, program):
         ast = parse_program(program)
@@ -14,8 +27,8 @@ class Interpreter(InterpreterBase):
         self.run_func(main_function)
 
     def get_main_function(self, ast):
-        for function in ast.dict['functions']:
-            if function.dict['name'] == 'main':
+        for function in ast.functions:
+            if function.name == 'main':
                 return function
         
         super().error(
@@ -24,81 +37,78 @@ class Interpreter(InterpreterBase):
         )
 
     def run_func(self, function):
-        for statement in function.dict['statements']:
+        for statement in function.statements:
             self.run_statement(statement)
 
     def run_statement(self, statement):
-        if statement.elem_type == '=':
-            self.do_assignment(statement)
-        elif statement.elem_type == 'fcall':
-            self.do_function_call_statement(statement)
+        handler = self.statement_handlers.get(statement.elem_type)
+        if handler is not None:
+            handler(statement)
     
     def do_assignment(self, statement):
         
-        expression = statement.dict['expression']
+        expression = statement.expression
         result = self.evaluate_expression(expression)
-        self.variables[statement.dict['name']] = result
+        self.variables[statement.name] = result
 
     def evaluate_expression(self, expression):
-        
-        if expression.elem_type == '+' or expression.elem_type == '-':
-            op1, op2 = self.evaluate_expression(expression.dict['op1']), self.evaluate_expression(expression.dict['op2'])
+        handler = self.expression_handlers.get(expression.elem_type)
+        if handler is not None:
+            return handler(expression)
 
-            try:
-                if expression.elem_type == '+':
-                    return op1 + op2
-                elif expression.elem_type == '-':
-                    return op1 - op2
-            except:
-                super().error(
-                    ErrorType.TYPE_ERROR,
-                    "Incompatible types for arithmetic operation",
-                )
-        
-        elif expression.elem_type == 'fcall':
-            return self.do_function_call_expression(expression)
-        
-        elif expression.elem_type == 'var':
-            try:
-                return self.variables[expression.dict['name']]
-            except:
-                super().error(
-                    ErrorType.NAME_ERROR,
-                    f"Variable {expression.dict['name']} has not been defined",
-                )
-        elif expression.elem_type == 'int':
-            return expression.dict['val']
-        
-        elif expression.elem_type == 'string':
-            return expression.dict['val']
+    def evaluate_arithmetic(self, expression):
+        op1, op2 = self.evaluate_expression(expression.op1), self.evaluate_expression(expression.op2)
+
+        try:
+            if expression.elem_type == '+':
+                return op1 + op2
+            elif expression.elem_type == '-':
+                return op1 - op2
+        except:
+            super().error(
+                ErrorType.TYPE_ERROR,
+                "Incompatible types for arithmetic operation",
+            )
+
+    def evaluate_variable(self, expression):
+        try:
+            return self.variables[expression.name]
+        except:
+            super().error(
+                ErrorType.NAME_ERROR,
+                f"Variable {expression.name} has not been defined",
+            )
+
+    def evaluate_constant(self, expression):
+        return expression.val
             
     def do_function_call_expression(self, expression):
         
-        if expression.dict['name'] == 'inputi':
-            if len(expression.dict['args']) > 1:
+        if expression.name == 'inputi':
+            if len(expression.args) > 1:
                 super().error(
                     ErrorType.NAME_ERROR,
                     f"No inputi() function found that takes > 1 parameter",
                 )
-            prompt = str(self.evaluate_expression(expression.dict['args'][0])) if len(expression.dict['args']) == 1 else ""
+            prompt = str(self.evaluate_expression(expression.args[0])) if len(expression.args) == 1 else ""
             if prompt:
                 super().output(prompt)
             user_input = super().get_input()
             return int(user_input)
         else:
             super().error(ErrorType.NAME_ERROR,
-                f"Unknown function reference {expression.dict['name']}")
+                f"Unknown function reference {expression.name}")
         
     def do_function_call_statement(self, statement):
         
-        if statement.dict['name'] == 'print':
+        if statement.name == 'print':
             res = ""
-            for expression in statement.dict['args']:
+            for expression in statement.args:
                 res += str(self.evaluate_expression(expression))
             super().output(res)
         else:
             super().error(ErrorType.NAME_ERROR,
-                f"Unknown function reference {statement.dict['name']}")
+                f"Unknown function reference {statement.name}")
 
 
 
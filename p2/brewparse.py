@@ -1,4 +1,21 @@
-from element import Element
+from element import (
+    Arg,
+    Assign,
+    BinOp,
+    Call,
+    Func,
+    If,
+    Lambda,
+    Literal,
+    MethodCall,
+    NewObject,
+    Nil,
+    Program,
+    Return,
+    UnaryOp,
+    Var,
+    While,
+)
 from brewlex import *
 from intbase import InterpreterBase
 from ply import yacc
@@ -25,7 +42,7 @@ def collapse_items(p, group_index, singleton_index):
 
 def p_program(p):
     "program : funcs"
-    p[0] = Element(InterpreterBase.PROGRAM_DEF, functions=p[1])
+    p[0] = Program(p[1])
 
 
 def p_funcs(p):
@@ -38,18 +55,18 @@ def p_func(p):
     """func : FUNC NAME LPAREN formal_args RPAREN LBRACE statements RBRACE
     | FUNC NAME LPAREN RPAREN LBRACE statements RBRACE"""
     if len(p) == 9:  # handle with 1+ formal args
-        p[0] = Element(InterpreterBase.FUNC_DEF, name=p[2], args=p[4], statements=p[7])
+        p[0] = Func(p[2], p[4], p[7])
     else:  # handle no formal args
-        p[0] = Element(InterpreterBase.FUNC_DEF, name=p[2], args=[], statements=p[6])
+        p[0] = Func(p[2], [], p[6])
 
 
 def p_lambda(p):
     """lambda : LAMBDA LPAREN formal_args RPAREN LBRACE statements RBRACE
     | LAMBDA LPAREN RPAREN LBRACE statements RBRACE"""
     if len(p) == 8:  # handle with 1+ formal args
-        p[0] = Element(InterpreterBase.LAMBDA_DEF, args=p[3], statements=p[6])
+        p[0] = Lambda(p[3], p[6])
     else:  # handle no formal args
-        p[0] = Element(InterpreterBase.LAMBDA_DEF, args=[], statements=p[5])
+        p[0] = Lambda([], p[5])
 
 
 def p_formal_args(p):
@@ -60,12 +77,12 @@ def p_formal_args(p):
 
 def p_formal_arg(p):
     "formal_arg : NAME"
-    p[0] = Element(InterpreterBase.ARG_DEF, name=p[1])
+    p[0] = Arg(InterpreterBase.ARG_DEF, p[1])
 
 
 def p_formal_ref_arg(p):
     "formal_arg : REF NAME"
-    p[0] = Element(InterpreterBase.REFARG_DEF, name=p[2])
+    p[0] = Arg(InterpreterBase.REFARG_DEF, p[2])
 
 
 def p_statements(p):
@@ -76,7 +93,7 @@ def p_statements(p):
 
 def p_statement___assign(p):
     "statement : variable ASSIGN expression SEMI"
-    p[0] = Element("=", name=p[1], expression=p[3])
+    p[0] = Assign(p[1], p[3])
 
 
 def p_variable(p):
@@ -93,24 +110,14 @@ def p_statement_if(p):
     | IF LPAREN expression RPAREN LBRACE statements RBRACE ELSE LBRACE statements RBRACE
     """
     if len(p) == 8:
-        p[0] = Element(
-            InterpreterBase.IF_DEF,
-            condition=p[3],
-            statements=p[6],
-            else_statements=None,
-        )
+        p[0] = If(p[3], p[6], None)
     else:
-        p[0] = Element(
-            InterpreterBase.IF_DEF,
-            condition=p[3],
-            statements=p[6],
-            else_statements=p[10],
-        )
+        p[0] = If(p[3], p[6], p[10])
 
 
 def p_statement_while(p):
     "statement : WHILE LPAREN expression RPAREN LBRACE statements RBRACE"
-    p[0] = Element(InterpreterBase.WHILE_DEF, condition=p[3], statements=p[6])
+    p[0] = While(p[3], p[6])
 
 
 def p_statement_expr(p):
@@ -125,17 +132,17 @@ def p_statement_return(p):
         expr = p[2]
     else:
         expr = None
-    p[0] = Element(InterpreterBase.RETURN_DEF, expression=expr)
+    p[0] = Return(expr)
 
 
 def p_expression_not(p):
     "expression : NOT expression"
-    p[0] = Element(InterpreterBase.NOT_DEF, op1=p[2])
+    p[0] = UnaryOp(InterpreterBase.NOT_DEF, p[2])
 
 
 def p_expression_uminus(p):
     "expression : MINUS expression %prec UMINUS"
-    p[0] = Element(InterpreterBase.NEG_DEF, op1=p[2])
+    p[0] = UnaryOp(InterpreterBase.NEG_DEF, p[2])
 
 
 def p_arith_expression_binop(p):
@@ -149,7 +156,7 @@ def p_arith_expression_binop(p):
     | expression MINUS expression
     | expression MULTIPLY expression
     | expression DIVIDE expression"""
-    p[0] = Element(p[2], op1=p[1], op2=p[3])
+    p[0] = BinOp(p[2], p[1], p[3])
 
 
 def p_expression_group(p):
@@ -160,12 +167,12 @@ def p_expression_group(p):
 def p_expression_and_or(p):
     """expression : expression OR expression
     | expression AND expression"""
-    p[0] = Element(p[2], op1=p[1], op2=p[3])
+    p[0] = BinOp(p[2], p[1], p[3])
 
 
 def p_expression_number(p):
     "expression : NUMBER"
-    p[0] = Element(InterpreterBase.INT_DEF, val=p[1])
+    p[0] = Literal(InterpreterBase.INT_DEF, p[1])
 
 
 def p_expression_lambda(p):
@@ -177,47 +184,47 @@ def p_expression_bool(p):
     """expression : TRUE
     | FALSE"""
     bool_val = p[1] == InterpreterBase.TRUE_DEF
-    p[0] = Element(InterpreterBase.BOOL_DEF, val=bool_val)
+    p[0] = Literal(InterpreterBase.BOOL_DEF, bool_val)
 
 
 def p_expression_nil(p):
     "expression : NIL"
-    p[0] = Element(InterpreterBase.NIL_DEF)
+    p[0] = Nil()
 
 
 def p_expression_obj(
     p,
 ):  # e.g. a = @;   ### creates a new dictionary/object and stores in a
     "expression : AT"
-    p[0] = Element(InterpreterBase.OBJ_DEF)
+    p[0] = NewObject()
 
 
 def p_expression_string(p):
     "expression : STRING"
-    p[0] = Element(InterpreterBase.STRING_DEF, val=p[1])
+    p[0] = Literal(InterpreterBase.STRING_DEF, p[1])
 
 
 def p_expression_variable(p):
     "expression : variable"
-    p[0] = Element(InterpreterBase.VAR_DEF, name=p[1])
+    p[0] = Var(p[1])
 
 
 def p_func_call(p):
     """expression : NAME LPAREN args RPAREN
     | NAME LPAREN RPAREN"""
     if len(p) == 5:
-        p[0] = Element(InterpreterBase.FCALL_DEF, name=p[1], args=p[3])
+        p[0] = Call(p[1], p[3])
     else:
-        p[0] = Element(InterpreterBase.FCALL_DEF, name=p[1], args=[])
+        p[0] = Call(p[1], [])
 
 
 def p_method_call(p):
     """expression : NAME DOT NAME LPAREN args RPAREN
     | NAME DOT NAME LPAREN RPAREN"""
     if len(p) == 7:
-        p[0] = Element(InterpreterBase.MCALL_DEF, objref=p[1], name=p[3], args=p[5])
+        p[0] = MethodCall(p[1], p[3], p[5])
     else:
-        p[0] = Element(InterpreterBase.MCALL_DEF, objref=p[1], name=p[3], args=[])
+        p[0] = MethodCall(p[1], p[3], [])
 
 
 def p_expression_args(p):
@@ -51,4 +51,86 @@ class EnvironmentManager:
         self.ref_environment.append({})
     
     def ref_pop(self):
-        self.ref_environment.pop()
\ No newline at end of file
+        self.ref_environment.pop()
+
+
+# An EnvironmentManager that keeps a single dict mapping each symbol to the
+# stack of Values bound to it, innermost last, instead of one dict per
+# environment.  get() is a single lookup however many environments were pushed,
+# and each environment records the symbols it bound, so pop() only touches
+# those.  References are kept as in EnvironmentManager.
+# Every method that uses self.environment is overridden.
+class StackEnvironmentManager(EnvironmentManager):
+    def __init__(self):
+        super().__init__()
+        self.bindings = {}  # symbol -> Values bound to it, innermost last
+        self.scopes = [set()]  # symbols bound in each environment, innermost last
+
+    def get(self, symbol):
+        stack = self.bindings.get(symbol)
+        if stack is None:
+            return None
+        return stack[-1]
+
+    def set(self, symbol, value):
+        stack = self.bindings.get(symbol)
+        if stack is None:
+            self.bindings[symbol] = [value]
+            self.scopes[-1].add(symbol)
+        else:
+            stack[-1] = value
+
+    # like EnvironmentManager.ref_set, sets the referenced symbol in the
+    # environment three levels up
+    def ref_set(self, local, value):
+        if local in self.ref_environment[-1]:
+            self.__set_in(len(self.scopes) - 3, self.get_ref(local), value)
+
+    def __set_in(self, index, symbol, value):
+        scope = self.scopes[index]
+        # a symbol's Values are in the order of the environments binding it,
+        # so its position is found from the few environments above this one
+        above = sum(symbol in inner for inner in self.scopes[index + 1 :])
+        stack = self.bindings.setdefault(symbol, [])
+        position = len(stack) - above
+        if symbol in scope:
+            stack[position - 1] = value
+        else:
+            stack.insert(position, value)
+            scope.add(symbol)
+
+    def create(self, symbol, value):
+        scope = self.scopes[-1]
+        stack = self.bindings.get(symbol)
+        if stack is None:
+            self.bindings[symbol] = [value]
+            scope.add(symbol)
+        elif symbol in scope:
+            stack[-1] = value
+        else:
+            stack.append(value)
+            scope.add(symbol)
+
+    def push(self):
+        self.scopes.append(set())
+
+    def pop(self):
+        bindings = self.bindings
+        for symbol in self.scopes.pop():
+            stack = bindings[symbol]
+            if len(stack) == 1:
+                del bindings[symbol]
+            else:
+                stack.pop()
+
+
+# the kinds of EnvironmentManager the interpreter can use (see its environment
+# argument)
+FRAMES = "frames"  # EnvironmentManager, a dict per environment
+STACKS = "stacks"  # StackEnvironmentManager
+
+ENVIRONMENTS = {FRAMES: EnvironmentManager, STACKS: StackEnvironmentManager}
+
+
+def new_environment(kind=FRAMES):
+    return ENVIRONMENTS[kind]()
@@ -1,17 +1,11 @@
 import copy
-from enum import Enum
 
 from brewparse import parse_program
-from env_v3 import EnvironmentManager
+from env_v3 import FRAMES, STACKS, new_environment
 from intbase import InterpreterBase, ErrorType
 from type_valuev3 import Type, Value, create_value, get_printable
 
 
-class ExecStatus(Enum):
-    CONTINUE = 1
-    RETURN = 2
-
-
 # Main interpreter class
 class Interpreter(InterpreterBase):
     # constants
@@ -19,28 +13,36 @@ class Interpreter(InterpreterBase):
     TRUE_VALUE = create_value(InterpreterBase.TRUE_DEF)
     BIN_OPS = {"+", "-", "*", "/", "==", "!=", ">", ">=", "<", "<=", "||", "&&"}
 
+    # environments
+    FRAMES_ENV = FRAMES  # env_v3.EnvironmentManager, a dict per scope
+    STACKS_ENV = STACKS  # env_v3.StackEnvironmentManager, a stack per name
+
     # methods
-    def __init__(self, console_output=True, inp=None, trace_output=False):
+    def __init__(
+        self, console_output=True, inp=None, trace_output=False, environment=FRAMES_ENV
+    ):
         super().__init__(console_output, inp)
         self.trace_output = trace_output
+        self.environment = environment
         self.__setup_ops()
+        self.__setup_handlers()
 
     # run a program that's provided in a string
     # usese the provided Parser found in brewparse.py to parse the program
     # into an abstract syntax tree (ast)
     def run(self, program):
         ast = parse_program(program)
-        self.env = EnvironmentManager()
+        self.env = new_environment(self.environment)
         self.__set_up_function_table(ast)
         main_func = self.__get_func_by_name("main", 0)
         self.__run_statements(main_func.get("statements"))
 
     def __set_up_function_table(self, ast):
         self.func_name_to_ast = {}
-        for func_def in ast.get("functions"):
+        for func_def in ast.functions:
             dup = False
-            func_name = func_def.get("name")
-            num_params = len(func_def.get("args"))
+            func_name = func_def.name
+            num_params = len(func_def.args)
             if func_name not in self.func_name_to_ast:
                 self.func_name_to_ast[func_name] = {}
             else:
@@ -76,33 +78,25 @@ class Interpreter(InterpreterBase):
             )
         return candidate_funcs[num_params]
 
+    # returns None when the statements run to completion and the returned
+    # Value object when a return statement was executed
     def __run_statements(self, statements):
         self.env.push()
+        statement_handlers = self.statement_handlers
         for statement in statements:
             if self.trace_output:
                 print(statement)
-            status = ExecStatus.CONTINUE
-            if statement.elem_type == InterpreterBase.FCALL_DEF:
-                self.__call_func(statement)
-            elif statement.elem_type == "=":
-                self.__assign(statement)
-            elif statement.elem_type == InterpreterBase.RETURN_DEF:
-                status, return_val = self.__do_return(statement)
-            elif statement.elem_type == Interpreter.IF_DEF:
-                status, return_val = self.__do_if(statement)
-            elif statement.elem_type == Interpreter.WHILE_DEF:
-                status, return_val = self.__do_while(statement)
-
-            if status == ExecStatus.RETURN:
+            return_val = statement_handlers[statement.elem_type](statement)
+            if return_val is not None:
                 self.env.pop()
-                return (status, return_val)
+                return return_val
 
         self.env.pop()
-        return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
+        return None
 
     def __call_func(self, call_node):
 
-        func_name = call_node.get("name")
+        func_name = call_node.name
         if func_name == "print":
             return self.__call_print(call_node)
         if func_name == "inputi":
@@ -110,7 +104,7 @@ class Interpreter(InterpreterBase):
         if func_name == "inputs":
             return self.__call_input(call_node)
         try:
-            actual_args = call_node.get("args")
+            actual_args = call_node.args
             func_ast = self.__get_func_by_name(func_name, len(actual_args))
             formal_args = func_ast.get("args")
         except:
@@ -124,28 +118,30 @@ class Interpreter(InterpreterBase):
         self.env.push()
         self.env.ref_push()
         for formal_ast, actual_ast in zip(formal_args, actual_args):
-            result = copy.deepcopy(self.__eval_expr(actual_ast))
-            arg_name = formal_ast.get("name")
+            result = Interpreter.__copy(self.__eval_expr(actual_ast))
+            arg_name = formal_ast.name
             if formal_ast.elem_type == InterpreterBase.REFARG_DEF:
                 self.env.create(arg_name, result)
                 self.env.ref_create(arg_name, actual_ast.get("name"))
             else:
                 self.env.create(arg_name, result)
-        _, return_val = self.__run_statements(func_ast.get("statements"))
+        return_val = self.__run_statements(func_ast.get("statements"))
         self.env.ref_pop()
         self.env.pop()
+        if return_val is None:
+            return Interpreter.NIL_VALUE
         return return_val
 
     def __call_print(self, call_ast):
         output = ""
-        for arg in call_ast.get("args"):
+        for arg in call_ast.args:
             result = self.__eval_expr(arg)  # result is a Value object
             output = output + get_printable(result)
         super().output(output)
         return Interpreter.NIL_VALUE
 
     def __call_input(self, call_ast):
-        args = call_ast.get("args")
+        args = call_ast.args
         if args is not None and len(args) == 1:
             result = self.__eval_expr(args[0])
             super().output(get_printable(result))
@@ -154,53 +150,77 @@ class Interpreter(InterpreterBase):
                 ErrorType.NAME_ERROR, "No inputi() function that takes > 1 parameter"
             )
         inp = super().get_input()
-        if call_ast.get("name") == "inputi":
+        if call_ast.name == "inputi":
             return Value(Type.INT, int(inp))
-        if call_ast.get("name") == "inputs":
+        if call_ast.name == "inputs":
             return Value(Type.STRING, inp)
 
     def __assign(self, assign_ast):
-        var_name = assign_ast.get("name")
-        value_obj = self.__eval_expr(assign_ast.get("expression"))
+        var_name = assign_ast.name
+        value_obj = self.__eval_expr(assign_ast.expression)
         self.env.set(var_name, value_obj)
         if self.env.get_ref(var_name) is not None:
             self.env.ref_set(var_name, value_obj)
 
+    # statement_handlers maps each kind of statement to the method running it,
+    # which returns what __run_statements does; expr_handlers maps each kind
+    # of expression to the method evaluating it
+    def __setup_handlers(self):
+        self.statement_handlers = {
+            InterpreterBase.FCALL_DEF: self.__run_call,
+            "=": self.__run_assign,
+            InterpreterBase.RETURN_DEF: self.__do_return,
+            Interpreter.IF_DEF: self.__do_if,
+            Interpreter.WHILE_DEF: self.__do_while,
+        }
+        self.expr_handlers = {
+            InterpreterBase.NIL_DEF: lambda expr_ast: Interpreter.NIL_VALUE,
+            InterpreterBase.INT_DEF: lambda expr_ast: Value(Type.INT, expr_ast.val),
+            InterpreterBase.STRING_DEF: lambda expr_ast: Value(Type.STRING, expr_ast.val),
+            InterpreterBase.BOOL_DEF: lambda expr_ast: Value(Type.BOOL, expr_ast.val),
+            InterpreterBase.LAMBDA_DEF: lambda expr_ast: Value(Type.FUNC, expr_ast),
+            InterpreterBase.VAR_DEF: self.__eval_var,
+            InterpreterBase.FCALL_DEF: self.__call_func,
+            Interpreter.NEG_DEF: lambda expr_ast: self.__eval_unary(
+                expr_ast, [Type.INT], lambda x: -1 * x
+            ),
+            Interpreter.NOT_DEF: lambda expr_ast: self.__eval_unary(
+                expr_ast, [Type.BOOL, Type.INT], lambda x: not x
+            ),
+        }
+        for oper in Interpreter.BIN_OPS:
+            self.expr_handlers[oper] = self.__eval_op
+        # other expressions used as statements aren't evaluated; anything else
+        # isn't a statement, and fails with a KeyError
+        for expr_type in self.expr_handlers:
+            self.statement_handlers.setdefault(expr_type, self.__skip)
+
+    def __run_call(self, call_ast):
+        self.__call_func(call_ast)
+
+    def __skip(self, expr_ast):
+        return None
+
+    def __run_assign(self, assign_ast):
+        self.__assign(assign_ast)
+
     def __eval_expr(self, expr_ast):
-        # print("here expr")
-        # print("type: " + str(expr_ast.elem_type))
-        if expr_ast.elem_type == InterpreterBase.NIL_DEF:
-            # print("getting as nil")
-            return Interpreter.NIL_VALUE
-        if expr_ast.elem_type == InterpreterBase.INT_DEF:
-            return Value(Type.INT, expr_ast.get("val"))
-        if expr_ast.elem_type == InterpreterBase.STRING_DEF:
-            # print("getting as str")
-            return Value(Type.STRING, expr_ast.get("val"))
-        if expr_ast.elem_type == InterpreterBase.BOOL_DEF:
-            return Value(Type.BOOL, expr_ast.get("val"))
-        if expr_ast.elem_type == InterpreterBase.LAMBDA_DEF:
-            return Value(Type.FUNC, expr_ast)
-        if expr_ast.elem_type == InterpreterBase.VAR_DEF:
-            var_name = expr_ast.get("name")
-            val = self.env.get(var_name)
-            if val is None:
-                super().error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
-            return val
-        if expr_ast.elem_type == InterpreterBase.FCALL_DEF:
-            return self.__call_func(expr_ast)
-        if expr_ast.elem_type in Interpreter.BIN_OPS:
-            return self.__eval_op(expr_ast)
-        if expr_ast.elem_type == Interpreter.NEG_DEF:
-            return self.__eval_unary(expr_ast, [Type.INT], lambda x: -1 * x)
-        if expr_ast.elem_type == Interpreter.NOT_DEF:
-            return self.__eval_unary(expr_ast, [Type.BOOL, Type.INT], lambda x: not x)
+        handler = self.expr_handlers.get(expr_ast.elem_type)
+        if handler is not None:
+            return handler(expr_ast)
+
+    def __eval_var(self, var_ast):
+        var_name = var_ast.name
+        val = self.env.get(var_name)
+        if val is None:
+            super().error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
+        return val
 
 
 
     def __eval_op(self, arith_ast):
-        left_value_obj = self.__eval_expr(arith_ast.get("op1"))
-        right_value_obj = self.__eval_expr(arith_ast.get("op2"))
+        left_value_obj = self.__eval_expr(arith_ast.op1)
+        right_value_obj = self.__eval_expr(arith_ast.op2)
         if not self.__compatible_types(
             arith_ast.elem_type, left_value_obj, right_value_obj
         ):
@@ -240,7 +260,7 @@ class Interpreter(InterpreterBase):
         return obj1.type() == obj2.type()
 
     def __eval_unary(self, arith_ast, t, f):
-        value_obj = self.__eval_expr(arith_ast.get("op1"))
+        value_obj = self.__eval_expr(arith_ast.op1)
         if value_obj.type() not in t:
             super().error(
                 ErrorType.TYPE_ERROR,
@@ -372,7 +392,7 @@ class Interpreter(InterpreterBase):
         )
 
     def __do_if(self, if_ast):
-        cond_ast = if_ast.get("condition")
+        cond_ast = if_ast.condition
         result = self.__eval_expr(cond_ast)
         if result.type() == Type.INT:
             result = Value(Type.BOOL, result.value() != 0)
@@ -382,43 +402,45 @@ class Interpreter(InterpreterBase):
                 "Incompatible type for if condition",
             )
         if result.value():
-            statements = if_ast.get("statements")
-            status, return_val = self.__run_statements(statements)
-            return (status, return_val)
-        else:
-            else_statements = if_ast.get("else_statements")
-            if else_statements is not None:
-                status, return_val = self.__run_statements(else_statements)
-                return (status, return_val)
-
-        return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
+            return self.__run_statements(if_ast.statements)
+        else_statements = if_ast.else_statements
+        if else_statements is not None:
+            return self.__run_statements(else_statements)
+        return None
 
     def __do_while(self, while_ast):
-        cond_ast = while_ast.get("condition")
-        run_while = Interpreter.TRUE_VALUE
-        while run_while.value():
+        cond_ast = while_ast.condition
+        statements = while_ast.statements
+        while True:
             run_while = self.__eval_expr(cond_ast)
             if run_while.type() == Type.INT:
-                run_while = Value(Type.BOOL, run_while.value() != 0)
+                if run_while.value() == 0:
+                    return None
             elif run_while.type() != Type.BOOL:
                 super().error(
                     ErrorType.TYPE_ERROR,
                     "Incompatible type for while condition",
                 )
-            if run_while.value():
-                statements = while_ast.get("statements")
-                status, return_val = self.__run_statements(statements)
-                if status == ExecStatus.RETURN:
-                    return status, return_val
-
-        return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
+            elif not run_while.value():
+                return None
+            return_val = self.__run_statements(statements)
+            if return_val is not None:
+                return return_val
 
     def __do_return(self, return_ast):
-        expr_ast = return_ast.get("expression")
+        expr_ast = return_ast.expression
         if expr_ast is None:
-            return (ExecStatus.RETURN, Interpreter.NIL_VALUE)
-        value_obj = copy.deepcopy(self.__eval_expr(expr_ast))
-        return (ExecStatus.RETURN, value_obj)
+            return Interpreter.NIL_VALUE
+        return Interpreter.__copy(self.__eval_expr(expr_ast))
+
+    # Values are never modified (assignments bind a new one), so only
+    # functions, which == compares by identity, are copied when they're passed
+    # or returned
+    @staticmethod
+    def __copy(value_obj):
+        if isinstance(value_obj, Value) and value_obj.type() != Type.FUNC:
+            return value_obj
+        return copy.deepcopy(value_obj)
 
 def main():
     program = 'func foo(ref x, delta) { /* x passed by reference, delta passed by value */\
@@ -1,5 +1,13 @@
+import os
+
 from ply import lex
 
+# with BREWIN_FAST_STARTUP=1 the lexer and parser are loaded straight from the
+# prebuilt lextab.py/parsetab.py: the token and grammar rules aren't inspected
+# or validated, and the tables aren't checked against them, so the tables have
+# to be regenerated (see brewparse.write_tables) whenever the rules change
+FAST_STARTUP = os.environ.get("BREWIN_FAST_STARTUP") == "1"
+
 reserved = (
     "FUNC",
     "IF",
@@ -127,4 +135,11 @@ def t_error(t):
 
 
 # Build the lexer
-lex.lex()
+if FAST_STARTUP:
+    import lextab
+
+    lexer = lex.Lexer()
+    lexer.lexoptimize = True
+    lexer.readtab(lextab, globals())
+else:
+    lexer = lex.lex()
@@ -1,7 +1,30 @@
-from element import Element
+import copy
+import os
+import sys
+import threading
+
+from element import (
+    Arg,
+    Assign,
+    BinOp,
+    Call,
+    Func,
+    If,
+    Lambda,
+    Literal,
+    MethodCall,
+    NewObject,
+    Nil,
+    Program,
+    Return,
+    UnaryOp,
+    Var,
+    While,
+)
+import brewlex
 from brewlex import *
 from intbase import InterpreterBase
-from ply import yacc
+from ply import lex, yacc
 
 # Parsing rules
 
@@ -25,7 +48,7 @@ def collapse_items(p, group_index, singleton_index):
 
 def p_program(p):
     "program : funcs"
-    p[0] = Element(InterpreterBase.PROGRAM_DEF, functions=p[1])
+    p[0] = Program(p[1])
 
 
 def p_funcs(p):
@@ -38,18 +61,18 @@ def p_func(p):
     """func : FUNC NAME LPAREN formal_args RPAREN LBRACE statements RBRACE
     | FUNC NAME LPAREN RPAREN LBRACE statements RBRACE"""
     if len(p) == 9:  # handle with 1+ formal args
-        p[0] = Element(InterpreterBase.FUNC_DEF, name=p[2], args=p[4], statements=p[7])
+        p[0] = Func(p[2], p[4], p[7])
     else:  # handle no formal args
-        p[0] = Element(InterpreterBase.FUNC_DEF, name=p[2], args=[], statements=p[6])
+        p[0] = Func(p[2], [], p[6])
 
 
 def p_lambda(p):
     """lambda : LAMBDA LPAREN formal_args RPAREN LBRACE statements RBRACE
     | LAMBDA LPAREN RPAREN LBRACE statements RBRACE"""
     if len(p) == 8:  # handle with 1+ formal args
-        p[0] = Element(InterpreterBase.LAMBDA_DEF, args=p[3], statements=p[6])
+        p[0] = Lambda(p[3], p[6])
     else:  # handle no formal args
-        p[0] = Element(InterpreterBase.LAMBDA_DEF, args=[], statements=p[5])
+        p[0] = Lambda([], p[5])
 
 
 def p_formal_args(p):
@@ -60,12 +83,12 @@ def p_formal_args(p):
 
 def p_formal_arg(p):
     "formal_arg : NAME"
-    p[0] = Element(InterpreterBase.ARG_DEF, name=p[1])
+    p[0] = Arg(InterpreterBase.ARG_DEF, p[1])
 
 
 def p_formal_ref_arg(p):
     "formal_arg : REF NAME"
-    p[0] = Element(InterpreterBase.REFARG_DEF, name=p[2])
+    p[0] = Arg(InterpreterBase.REFARG_DEF, p[2])
 
 
 def p_statements(p):
@@ -76,16 +99,16 @@ def p_statements(p):
 
 def p_statement___assign(p):
     "statement : variable ASSIGN expression SEMI"
-    p[0] = Element("=", name=p[1], expression=p[3])
+    p[0] = Assign(p[1].name, p[3], p[1].field)
 
 
 def p_variable(p):
     """variable : NAME DOT NAME
     | NAME"""
     if len(p) == 4:
-        p[0] = p[1] + "." + p[3]
+        p[0] = Var(p[1], p[3])
     else:
-        p[0] = p[1]
+        p[0] = Var(p[1])
 
 
 def p_statement_if(p):
@@ -93,24 +116,14 @@ def p_statement_if(p):
     | IF LPAREN expression RPAREN LBRACE statements RBRACE ELSE LBRACE statements RBRACE
     """
     if len(p) == 8:
-        p[0] = Element(
-            InterpreterBase.IF_DEF,
-            condition=p[3],
-            statements=p[6],
-            else_statements=None,
-        )
+        p[0] = If(p[3], p[6], None)
     else:
-        p[0] = Element(
-            InterpreterBase.IF_DEF,
-            condition=p[3],
-            statements=p[6],
-            else_statements=p[10],
-        )
+        p[0] = If(p[3], p[6], p[10])
 
 
 def p_statement_while(p):
     "statement : WHILE LPAREN expression RPAREN LBRACE statements RBRACE"
-    p[0] = Element(InterpreterBase.WHILE_DEF, condition=p[3], statements=p[6])
+    p[0] = While(p[3], p[6])
 
 
 def p_statement_expr(p):
@@ -125,17 +138,17 @@ def p_statement_return(p):
         expr = p[2]
     else:
         expr = None
-    p[0] = Element(InterpreterBase.RETURN_DEF, expression=expr)
+    p[0] = Return(expr)
 
 
 def p_expression_not(p):
     "expression : NOT expression"
-    p[0] = Element(InterpreterBase.NOT_DEF, op1=p[2])
+    p[0] = UnaryOp(InterpreterBase.NOT_DEF, p[2])
 
 
 def p_expression_uminus(p):
     "expression : MINUS expression %prec UMINUS"
-    p[0] = Element(InterpreterBase.NEG_DEF, op1=p[2])
+    p[0] = UnaryOp(InterpreterBase.NEG_DEF, p[2])
 
 
 def p_arith_expression_binop(p):
@@ -149,7 +162,7 @@ def p_arith_expression_binop(p):
     | expression MINUS expression
     | expression MULTIPLY expression
     | expression DIVIDE expression"""
-    p[0] = Element(p[2], op1=p[1], op2=p[3])
+    p[0] = BinOp(p[2], p[1], p[3])
 
 
 def p_expression_group(p):
@@ -160,12 +173,12 @@ def p_expression_group(p):
 def p_expression_and_or(p):
     """expression : expression OR expression
     | expression AND expression"""
-    p[0] = Element(p[2], op1=p[1], op2=p[3])
+    p[0] = BinOp(p[2], p[1], p[3])
 
 
 def p_expression_number(p):
     "expression : NUMBER"
-    p[0] = Element(InterpreterBase.INT_DEF, val=p[1])
+    p[0] = Literal(InterpreterBase.INT_DEF, p[1])
 
 
 def p_expression_lambda(p):
@@ -177,47 +190,47 @@ def p_expression_bool(p):
     """expression : TRUE
     | FALSE"""
     bool_val = p[1] == InterpreterBase.TRUE_DEF
-    p[0] = Element(InterpreterBase.BOOL_DEF, val=bool_val)
+    p[0] = Literal(InterpreterBase.BOOL_DEF, bool_val)
 
 
 def p_expression_nil(p):
     "expression : NIL"
-    p[0] = Element(InterpreterBase.NIL_DEF)
+    p[0] = Nil()
 
 
 def p_expression_obj(
     p,
 ):  # e.g. a = @;   ### creates a new dictionary/object and stores in a
     "expression : AT"
-    p[0] = Element(InterpreterBase.OBJ_DEF)
+    p[0] = NewObject()
 
 
 def p_expression_string(p):
     "expression : STRING"
-    p[0] = Element(InterpreterBase.STRING_DEF, val=p[1])
+    p[0] = Literal(InterpreterBase.STRING_DEF, p[1])
 
 
 def p_expression_variable(p):
     "expression : variable"
-    p[0] = Element(InterpreterBase.VAR_DEF, name=p[1])
+    p[0] = p[1]
 
 
 def p_func_call(p):
     """expression : NAME LPAREN args RPAREN
     | NAME LPAREN RPAREN"""
     if len(p) == 5:
-        p[0] = Element(InterpreterBase.FCALL_DEF, name=p[1], args=p[3])
+        p[0] = Call(p[1], p[3])
     else:
-        p[0] = Element(InterpreterBase.FCALL_DEF, name=p[1], args=[])
+        p[0] = Call(p[1], [])
 
 
 def p_method_call(p):
     """expression : NAME DOT NAME LPAREN args RPAREN
     | NAME DOT NAME LPAREN RPAREN"""
     if len(p) == 7:
-        p[0] = Element(InterpreterBase.MCALL_DEF, objref=p[1], name=p[3], args=p[5])
+        p[0] = MethodCall(p[1], p[3], p[5])
     else:
-        p[0] = Element(InterpreterBase.MCALL_DEF, objref=p[1], name=p[3], args=[])
+        p[0] = MethodCall(p[1], p[3], [])
 
 
 def p_expression_args(p):
@@ -227,19 +240,137 @@ def p_expression_args(p):
 
 
 def p_error(p):
+    _thread_parsers.syntax_errors += 1
     if p:
         print(f"Syntax error at '{p.value}'")
     else:
         print("Syntax error at EOF")
 
 
+# A Parser owns its own lexer and LR parser state, so separate Parser objects
+# can be used from different threads at the same time.  The LR tables are
+# built once and shared by every Parser; clone() is cheap, so a thread pool
+# can give each thread its own copy.
+class Parser:
+    def __init__(self, lexer, lr_parser):
+        self.lexer = lexer
+        self.lr_parser = lr_parser
+
+    def clone(self):
+        return Parser(self.lexer.clone(), copy.copy(self.lr_parser))
+
+    def parse(self, program):
+        _thread_parsers.syntax_errors = 0
+        self.lexer.lineno = 1
+        ast = self.lr_parser.parse(program, lexer=self.lexer)
+        if ast is None:
+            raise SyntaxError("Syntax error")
+        return ast
+
+
+class ConformanceError(Exception):
+    pass
+
+
+# BREWIN_PARSER selects the parser used by parse_program:
+#   ply          the LR parser generated from the rules above (the default)
+#   rd           the hand-written parser in rdparse.py
+#   conformance  both; the PLY result is returned, but ConformanceError is
+#                raised if the hand-written parser disagrees with it
+# rdparse is only imported once one of the last two needs it, which keeps it
+# out of the import time of the default configuration
+PARSER = os.environ.get("BREWIN_PARSER", "ply")
+
+
 # exported function
 def parse_program(program):
-    ast = yacc.parse(program)
-    if ast is None:
+    if PARSER == "rd":
+        import rdparse
+
+        return rdparse.parse_program(program)
+    if PARSER == "conformance":
+        return check_conformance(program)
+    return _ply_parse(program)
+
+
+# each thread parses with its own clone of the default parser
+def _ply_parse(program):
+    parser = getattr(_thread_parsers, "parser", None)
+    if parser is None:
+        parser = _default_parser.clone()
+        _thread_parsers.parser = parser
+    return parser.parse(program)
+
+
+def _ignore(message):
+    pass
+
+
+# PLY recovers from some syntax errors by skipping tokens, while the
+# hand-written parser always gives up, so both only have to agree on programs
+# that PLY parsed without reporting any error
+def check_conformance(program):
+    import rdparse
+
+    try:
+        expected = _ply_parse(program)
+    except SyntaxError:
+        expected = None
+    ply_errors = _thread_parsers.syntax_errors
+    try:
+        actual = rdparse.parse_program(program, report=_ignore)
+    except SyntaxError:
+        actual = None
+
+    if ply_errors > 0:
+        if actual is not None:
+            raise ConformanceError("rdparse accepted a program PLY rejected")
+    elif actual is None:
+        raise ConformanceError("rdparse rejected a program PLY accepted")
+    elif not rdparse.same_ast(expected, actual):
+        raise ConformanceError("rdparse and PLY built different asts")
+
+    if expected is None:
         raise SyntaxError("Syntax error")
-    return ast
+    return expected
+
+
+# regenerates the prebuilt lextab.py and parsetab.py next to this file; run
+# this module directly after changing the tokens or the grammar
+def write_tables():
+    outputdir = os.path.dirname(os.path.abspath(__file__))
+    for module_name in ("lextab", "parsetab"):
+        sys.modules.pop(module_name, None)
+        path = os.path.join(outputdir, module_name + ".py")
+        if os.path.exists(path):
+            os.remove(path)
+    lex.lex(module=brewlex, optimize=True, lextab="lextab", outputdir=outputdir)
+    yacc.yacc(debug=False, outputdir=outputdir)
+
+
+# builds the LR parser from parsetab.py without yacc(), which would reflect on
+# and validate the grammar rules above first
+def _load_prebuilt_parser():
+    import parsetab
+
+    lr_table = yacc.LRTable()
+    lr_table.read_table(parsetab)
+    lr_table.bind_callables(globals())
+    return yacc.LRParser(lr_table, p_error)
 
 
 # generate our parser
-yacc.yacc()
+# by default the prebuilt tables in parsetab.py are used as long as they match
+# the grammar, instead of generating them, and nothing is ever written next to
+# the sources (see write_tables); with BREWIN_FAST_STARTUP=1 they are loaded
+# without looking at the grammar at all
+if FAST_STARTUP:
+    _lr_parser = _load_prebuilt_parser()
+else:
+    _lr_parser = yacc.yacc(debug=False, write_tables=False)
+_default_parser = Parser(lexer, _lr_parser)
+_thread_parsers = threading.local()
+
+
+if __name__ == "__main__":
+    write_tables()
@@ -0,0 +1,337 @@
+import marshal
+from array import array
+
+from intbase import InterpreterBase, ErrorType
+from resolverv4 import CaptureAnalysis, resolve
+
+
+# Instructions are stored as (opcode, operand) pairs of ints in an array.
+# The meaning of the operand depends on the opcode: an index into the
+# code object's consts/names/functions tables, a jump target, an argument
+# count, or the number of block scopes a return has to discard.
+class Opcode:
+    LOAD_NIL = 0
+    LOAD_INT = 1  # consts index
+    LOAD_STRING = 2  # consts index
+    LOAD_BOOL = 3  # 0 or 1
+    LOAD_NAME = 4  # names index
+    STORE_NAME = 5  # names index
+    LOAD_OBJECT = 6  # names index, pushes the object a field is read from/written to
+    GET_FIELD = 7  # names index
+    STORE_FIELD = 8  # names index
+    BINARY_OP = 9  # index into OPERATORS
+    NEG = 10
+    NOT = 11
+    MAKE_CLOSURE = 12  # functions index
+    NEW_OBJECT = 13
+    RESOLVE_FUNC = 14  # consts index of (name, # of args)
+    RESOLVE_METHOD = 15  # consts index of (objref, method name, # of args)
+    PASS_ARG = 16  # position of the argument on top of the stack
+    CALL = 17  # number of args
+    PRINT_BEGIN = 18
+    PRINT_ARG = 19
+    PRINT_END = 20
+    INPUTI = 21  # number of args (0 or 1)
+    POP = 22
+    JUMP = 23  # target
+    JUMP_IF_FALSE = 24  # target, for if conditions
+    LOOP_IF_FALSE = 25  # target, for while conditions
+    PUSH_BLOCK = 26
+    POP_BLOCK = 27
+    RETURN_VALUE = 28  # number of open blocks
+    RETURN_NIL = 29  # number of open blocks
+    ERROR = 30  # consts index of (ErrorType value, description)
+    GET_FIELD_REF = 31  # names index, GET_FIELD for a field passed as an argument
+    PASS_RESULT_ARG = 32  # PASS_ARG for an argument that isn't a variable or field
+    RETURN_VARIABLE = 33  # number of open blocks, RETURN_VALUE for a variable or field
+
+
+OPERATORS = ("+", "-", "*", "/", "<", "<=", ">", ">=", "==", "!=", "&&", "||")
+
+
+# The compiled form of a single func or lambda
+class CodeObject:
+    def __init__(self, name, args, code, consts, names, functions, captures=None):
+        self.name = name  # None for lambdas
+        self.args = args  # tuple of (arg name, passed by reference) pairs
+        self.code = code
+        self.consts = consts
+        self.names = names
+        self.functions = functions  # code objects of nested lambdas
+        # for lambdas, the names closures have to capture (None for all)
+        self.captures = captures
+
+    # code objects are never modified, so closures that get copied can share them
+    def __deepcopy__(self, memo):
+        return self
+
+    def to_tuple(self):
+        return (
+            self.name,
+            self.args,
+            self.code.tobytes(),
+            tuple(self.consts),
+            tuple(self.names),
+            tuple(f.to_tuple() for f in self.functions),
+            self.captures,
+        )
+
+    @staticmethod
+    def from_tuple(t):
+        name, args, code_bytes, consts, names, functions, captures = t
+        code = array("i")
+        code.frombytes(code_bytes)
+        return CodeObject(
+            name,
+            tuple(tuple(arg) for arg in args),
+            code,
+            list(consts),
+            list(names),
+            [CodeObject.from_tuple(f) for f in functions],
+            captures,
+        )
+
+
+# A compiled brewin program: one code object per top-level function.
+# dumps()/loads() use marshal, so a program compiled by one worker can be
+# cached or handed to another worker running the same python version.
+class BytecodeProgram:
+    MAGIC = "brewin-bytecode"
+    FORMAT_VERSION = 6
+
+    def __init__(self, functions):
+        self.functions = functions
+
+    def dumps(self):
+        return marshal.dumps(
+            (
+                BytecodeProgram.MAGIC,
+                BytecodeProgram.FORMAT_VERSION,
+                tuple(f.to_tuple() for f in self.functions),
+            )
+        )
+
+    @staticmethod
+    def loads(data):
+        magic, version, functions = marshal.loads(data)
+        if magic != BytecodeProgram.MAGIC or version != BytecodeProgram.FORMAT_VERSION:
+            raise ValueError("Unsupported bytecode format")
+        return BytecodeProgram([CodeObject.from_tuple(f) for f in functions])
+
+
+# exported function
+def compile_program(ast):
+    captures = CaptureAnalysis(ast.functions)
+    return BytecodeProgram(
+        [_FunctionCompiler(func_def, captures).compile() for func_def in ast.functions]
+    )
+
+
+# Lowers one func/lambda Element (and, recursively, the lambdas inside it)
+# into a CodeObject
+class _FunctionCompiler:
+    def __init__(self, func_ast, captures):
+        self.func_ast = func_ast
+        self.captures = captures
+        self.code = array("i")
+        self.consts = []
+        self.const_index = {}
+        self.names = []
+        self.name_index = {}
+        self.functions = []
+        self.block_depth = 0  # blocks with a scope of their own
+        # blocks that can't create a variable run without a scope, like they
+        # do on the tree walker (see resolve)
+        _, self.unscoped = resolve(func_ast)
+
+    def compile(self):
+        args = tuple(
+            (arg.get("name"), arg.elem_type == InterpreterBase.REFARG_DEF)
+            for arg in self.func_ast.get("args")
+        )
+        self.__block(self.func_ast.get("statements"))
+        self.__emit(Opcode.RETURN_NIL, 0)
+        captures = None
+        if self.func_ast.elem_type == InterpreterBase.LAMBDA_DEF:
+            captures = self.captures.names(self.func_ast)
+            if captures is not None:
+                captures = tuple(sorted(captures))
+        return CodeObject(
+            self.func_ast.get("name"),
+            args,
+            self.code,
+            self.consts,
+            self.names,
+            self.functions,
+            captures,
+        )
+
+    def __emit(self, op, arg=0):
+        self.code.append(op)
+        self.code.append(arg)
+        return len(self.code) - 1  # position of the operand, for patching jumps
+
+    def __patch(self, operand_pos):
+        self.code[operand_pos] = len(self.code)
+
+    def __const(self, value):
+        key = (type(value), value)
+        if key not in self.const_index:
+            self.const_index[key] = len(self.consts)
+            self.consts.append(value)
+        return self.const_index[key]
+
+    def __name(self, name):
+        if name not in self.name_index:
+            self.name_index[name] = len(self.names)
+            self.names.append(name)
+        return self.name_index[name]
+
+    def __block(self, statements):
+        if id(statements) in self.unscoped:
+            for statement in statements:
+                self.__statement(statement)
+            return
+        self.__emit(Opcode.PUSH_BLOCK)
+        self.block_depth += 1
+        for statement in statements:
+            self.__statement(statement)
+        self.block_depth -= 1
+        self.__emit(Opcode.POP_BLOCK)
+
+    def __statement(self, statement):
+        elem_type = statement.elem_type
+        if elem_type == InterpreterBase.FCALL_DEF or elem_type == InterpreterBase.MCALL_DEF:
+            self.__expr(statement)
+            self.__emit(Opcode.POP)
+        elif elem_type == "=":
+            self.__assign(statement)
+        elif elem_type == InterpreterBase.RETURN_DEF:
+            expr_ast = statement.get("expression")
+            if expr_ast is None:
+                self.__emit(Opcode.RETURN_NIL, self.block_depth)
+            else:
+                self.__expr(expr_ast)
+                if expr_ast.elem_type == InterpreterBase.VAR_DEF:
+                    self.__emit(Opcode.RETURN_VARIABLE, self.block_depth)
+                else:
+                    self.__emit(Opcode.RETURN_VALUE, self.block_depth)
+        elif elem_type == InterpreterBase.IF_DEF:
+            self.__if(statement)
+        elif elem_type == InterpreterBase.WHILE_DEF:
+            self.__while(statement)
+        # other expression statements are never evaluated
+
+    def __assign(self, assign_ast):
+        var_name = assign_ast.get("name")
+        field = assign_ast.get("field")
+        if field is not None:
+            # the object is looked up before the expression is evaluated
+            self.__emit(Opcode.LOAD_OBJECT, self.__name(var_name))
+            self.__expr(assign_ast.get("expression"))
+            self.__emit(Opcode.STORE_FIELD, self.__name(field))
+        else:
+            self.__expr(assign_ast.get("expression"))
+            self.__emit(Opcode.STORE_NAME, self.__name(var_name))
+
+    def __if(self, if_ast):
+        self.__expr(if_ast.get("condition"))
+        to_else = self.__emit(Opcode.JUMP_IF_FALSE)
+        self.__block(if_ast.get("statements"))
+        else_statements = if_ast.get("else_statements")
+        if else_statements is None:
+            self.__patch(to_else)
+            return
+        to_end = self.__emit(Opcode.JUMP)
+        self.__patch(to_else)
+        self.__block(else_statements)
+        self.__patch(to_end)
+
+    def __while(self, while_ast):
+        loop_start = len(self.code)
+        self.__expr(while_ast.get("condition"))
+        to_end = self.__emit(Opcode.LOOP_IF_FALSE)
+        self.__block(while_ast.get("statements"))
+        self.__emit(Opcode.JUMP, loop_start)
+        self.__patch(to_end)
+
+    def __expr(self, expr_ast):
+        elem_type = expr_ast.elem_type
+        if elem_type == InterpreterBase.NIL_DEF:
+            self.__emit(Opcode.LOAD_NIL)
+        elif elem_type == InterpreterBase.INT_DEF:
+            self.__emit(Opcode.LOAD_INT, self.__const(expr_ast.get("val")))
+        elif elem_type == InterpreterBase.STRING_DEF:
+            self.__emit(Opcode.LOAD_STRING, self.__const(expr_ast.get("val")))
+        elif elem_type == InterpreterBase.BOOL_DEF:
+            self.__emit(Opcode.LOAD_BOOL, 1 if expr_ast.get("val") else 0)
+        elif elem_type == InterpreterBase.VAR_DEF:
+            field = expr_ast.get("field")
+            if field is not None:
+                self.__emit(Opcode.LOAD_OBJECT, self.__name(expr_ast.get("name")))
+                self.__emit(Opcode.GET_FIELD, self.__name(field))
+            else:
+                self.__emit(Opcode.LOAD_NAME, self.__name(expr_ast.get("name")))
+        elif elem_type == InterpreterBase.FCALL_DEF:
+            self.__call(expr_ast)
+        elif elem_type == InterpreterBase.MCALL_DEF:
+            args = expr_ast.get("args")
+            key = (expr_ast.get("objref"), expr_ast.get("name"), len(args))
+            self.__emit(Opcode.RESOLVE_METHOD, self.__const(key))
+            self.__args(args)
+        elif elem_type in OPERATORS:
+            self.__expr(expr_ast.get("op1"))
+            self.__expr(expr_ast.get("op2"))
+            self.__emit(Opcode.BINARY_OP, OPERATORS.index(elem_type))
+        elif elem_type == InterpreterBase.NEG_DEF:
+            self.__expr(expr_ast.get("op1"))
+            self.__emit(Opcode.NEG)
+        elif elem_type == InterpreterBase.NOT_DEF:
+            self.__expr(expr_ast.get("op1"))
+            self.__emit(Opcode.NOT)
+        elif elem_type == InterpreterBase.LAMBDA_DEF:
+            self.functions.append(_FunctionCompiler(expr_ast, self.captures).compile())
+            self.__emit(Opcode.MAKE_CLOSURE, len(self.functions) - 1)
+        elif elem_type == InterpreterBase.OBJ_DEF:
+            self.__emit(Opcode.NEW_OBJECT)
+
+    def __call(self, call_ast):
+        func_name = call_ast.get("name")
+        args = call_ast.get("args")
+        if func_name == "print":
+            self.__emit(Opcode.PRINT_BEGIN)
+            for arg in args:
+                self.__expr(arg)
+                self.__emit(Opcode.PRINT_ARG)
+            self.__emit(Opcode.PRINT_END)
+        elif func_name == "inputi":
+            if len(args) > 1:
+                description = "No inputi() function that takes > 1 parameter"
+                self.__emit(
+                    Opcode.ERROR,
+                    self.__const((ErrorType.NAME_ERROR.value, description)),
+                )
+                return
+            for arg in args:
+                self.__expr(arg)
+            self.__emit(Opcode.INPUTI, len(args))
+        else:
+            self.__emit(Opcode.RESOLVE_FUNC, self.__const((func_name, len(args))))
+            self.__args(args)
+
+    # the callee is resolved before its arguments are evaluated, so each
+    # argument can be copied (or not, for ref args) as soon as it is computed.
+    # Fields are read with GET_FIELD_REF, since they may be bound to a ref arg
+    def __args(self, args):
+        for i, arg in enumerate(args):
+            if arg.elem_type != InterpreterBase.VAR_DEF:
+                self.__expr(arg)
+                self.__emit(Opcode.PASS_RESULT_ARG, i)
+                continue
+            if arg.get("field") is not None:
+                self.__emit(Opcode.LOAD_OBJECT, self.__name(arg.get("name")))
+                self.__emit(Opcode.GET_FIELD_REF, self.__name(arg.get("field")))
+            else:
+                self.__expr(arg)
+            self.__emit(Opcode.PASS_ARG, i)
+        self.__emit(Opcode.CALL, len(args))
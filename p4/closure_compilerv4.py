@@ -0,0 +1,504 @@
+from intbase import InterpreterBase, ErrorType
+from type_valuev4 import (
+    Closure,
+    FieldCache,
+    Object,
+    Type,
+    Value,
+    copy_value,
+    get_printable,
+)
+
+
+# The ClosureCompiler turns each function body into a tree of pre-bound python
+# closures the first time the function is called.  Every closure already knows
+# which kind of node it implements, so running a program no longer re-dispatches
+# on elem_type strings or reads fields off the ast nodes.
+# The compiled code shares the interpreter's environment, function table and
+# error reporting, so programs produce the same output and errors as the
+# tree-walking interpreter.
+class ClosureCompiler:
+    INT_OPS = {
+        "+": lambda x, y: Value(Type.INT, x + y),
+        "-": lambda x, y: Value(Type.INT, x - y),
+        "*": lambda x, y: Value(Type.INT, x * y),
+        "/": lambda x, y: Value(Type.INT, x // y),
+        "<": lambda x, y: Value(Type.BOOL, x < y),
+        "<=": lambda x, y: Value(Type.BOOL, x <= y),
+        ">": lambda x, y: Value(Type.BOOL, x > y),
+        ">=": lambda x, y: Value(Type.BOOL, x >= y),
+        "==": lambda x, y: Value(Type.BOOL, x == y),
+        "!=": lambda x, y: Value(Type.BOOL, x != y),
+    }
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.env = interpreter.env
+        self.func_name_to_ast = interpreter.func_name_to_ast
+        # maps a func/lambda Element to its (formal args, compiled body) pair
+        self.compiled_funcs = {}
+
+    # run the statements of main() in the interpreter's current environment
+    def run(self, main_func):
+        self.__compile_block(main_func.func_ast.get("statements"))()
+
+    def __error(self, error_type, description):
+        self.interpreter.error(error_type, description)
+
+    def __get_compiled_func(self, func_ast):
+        compiled = self.compiled_funcs.get(func_ast)
+        if compiled is None:
+            formal_args = [
+                (arg.get("name"), arg.elem_type == InterpreterBase.REFARG_DEF)
+                for arg in func_ast.get("args")
+            ]
+            body = self.__compile_block(func_ast.get("statements"))
+            compiled = (formal_args, body)
+            self.compiled_funcs[func_ast] = compiled
+        return compiled
+
+    # blocks return None when they run to completion and the returned Value
+    # object when a return statement was executed
+    def __compile_block(self, statements):
+        compiled = tuple(self.__compile_statement(s) for s in statements)
+        push = self.env.push
+        pop = self.env.pop
+
+        def run_block():
+            push()
+            for statement in compiled:
+                return_val = statement()
+                if return_val is not None:
+                    pop()
+                    return return_val
+            pop()
+            return None
+
+        return run_block
+
+    def __compile_statement(self, statement):
+        elem_type = statement.elem_type
+        if elem_type == InterpreterBase.FCALL_DEF or elem_type == InterpreterBase.MCALL_DEF:
+            call = self.__compile_expr(statement)
+
+            def run_statement():
+                call()
+
+        elif elem_type == "=":
+            run_statement = self.__compile_assign(statement)
+        elif elem_type == InterpreterBase.RETURN_DEF:
+            run_statement = self.__compile_return(statement)
+        elif elem_type == InterpreterBase.IF_DEF:
+            run_statement = self.__compile_if(statement)
+        elif elem_type == InterpreterBase.WHILE_DEF:
+            run_statement = self.__compile_while(statement)
+        else:
+            # other expression statements are never evaluated
+
+            def run_statement():
+                return None
+
+        if self.interpreter.trace_output:
+            untraced = run_statement
+
+            def run_statement():
+                print(statement)
+                return untraced()
+
+        return run_statement
+
+    def __compile_assign(self, assign_ast):
+        var_name = assign_ast.get("name")
+        expr = self.__compile_expr(assign_ast.get("expression"))
+        env_get = self.env.get
+        error = self.__error
+
+        field = assign_ast.get("field")
+        if field is not None:
+            set_field = FieldCache(field).set
+
+            def assign_field():
+                target_value_obj = env_get(var_name)
+                if target_value_obj is None:
+                    error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
+                if target_value_obj.t is not Type.OBJECT:
+                    error(ErrorType.TYPE_ERROR, f"Variable {var_name} is not an object")
+                src_value_obj = expr()
+                set_field(target_value_obj.v, Value(src_value_obj.t, src_value_obj.v))
+
+            return assign_field
+
+        env_set = self.env.set
+
+        def assign():
+            src_value_obj = expr()
+            target_value_obj = env_get(var_name)
+            if target_value_obj is None:
+                env_set(var_name, Value(src_value_obj.t, src_value_obj.v))
+                return
+            # a closure changed to another type can no longer be called
+            if target_value_obj.t is Type.CLOSURE and src_value_obj.t is not Type.CLOSURE:
+                target_value_obj.v.retype(src_value_obj.t)
+            target_value_obj.t = src_value_obj.t
+            target_value_obj.v = src_value_obj.v
+
+        return assign
+
+    def __compile_return(self, return_ast):
+        expr_ast = return_ast.get("expression")
+        if expr_ast is None:
+            nil_value = self.interpreter.NIL_VALUE
+
+            def return_nil():
+                return nil_value
+
+            return return_nil
+
+        expr = self.__compile_expr(expr_ast)
+
+        # a variable's Value is updated in place by later assignments, so the
+        # caller gets its own copy of it
+        if expr_ast.elem_type == InterpreterBase.VAR_DEF:
+
+            def return_variable():
+                return copy_value(expr())
+
+            return return_variable
+
+        def return_value():
+            value_obj = expr()
+            if value_obj.t is Type.CLOSURE or value_obj.t is Type.OBJECT:
+                return copy_value(value_obj)
+            return value_obj
+
+        return return_value
+
+    def __compile_condition(self, cond_ast, description):
+        cond = self.__compile_expr(cond_ast)
+        error = self.__error
+
+        def eval_condition():
+            result = cond()
+            if result.t is Type.BOOL:
+                return result.v
+            if result.t is Type.INT:
+                return result.v != 0
+            error(ErrorType.TYPE_ERROR, description)
+
+        return eval_condition
+
+    def __compile_if(self, if_ast):
+        cond = self.__compile_condition(
+            if_ast.get("condition"), "Incompatible type for if condition"
+        )
+        statements = self.__compile_block(if_ast.get("statements"))
+        else_ast = if_ast.get("else_statements")
+        if else_ast is None:
+
+            def run_if():
+                if cond():
+                    return statements()
+                return None
+
+            return run_if
+
+        else_statements = self.__compile_block(else_ast)
+
+        def run_if_else():
+            if cond():
+                return statements()
+            return else_statements()
+
+        return run_if_else
+
+    def __compile_while(self, while_ast):
+        cond = self.__compile_condition(
+            while_ast.get("condition"), "Incompatible type for while condition"
+        )
+        statements = self.__compile_block(while_ast.get("statements"))
+
+        def run_while():
+            while cond():
+                return_val = statements()
+                if return_val is not None:
+                    return return_val
+            return None
+
+        return run_while
+
+    def __compile_expr(self, expr_ast):
+        elem_type = expr_ast.elem_type
+        if elem_type == InterpreterBase.NIL_DEF:
+            nil_value = self.interpreter.NIL_VALUE
+            return lambda: nil_value
+        if elem_type == InterpreterBase.INT_DEF:
+            return self.__compile_const(Type.INT, expr_ast.get("val"))
+        if elem_type == InterpreterBase.STRING_DEF:
+            return self.__compile_const(Type.STRING, expr_ast.get("val"))
+        if elem_type == InterpreterBase.BOOL_DEF:
+            return self.__compile_const(Type.BOOL, expr_ast.get("val"))
+        if elem_type == InterpreterBase.VAR_DEF:
+            return self.__compile_name(expr_ast)
+        if elem_type == InterpreterBase.FCALL_DEF:
+            return self.__compile_call(expr_ast)
+        if elem_type == InterpreterBase.MCALL_DEF:
+            return self.__compile_method_call(expr_ast)
+        if elem_type in self.interpreter.BIN_OPS:
+            return self.__compile_op(expr_ast)
+        if elem_type == InterpreterBase.NEG_DEF:
+            return self.__compile_neg(expr_ast)
+        if elem_type == InterpreterBase.NOT_DEF:
+            return self.__compile_not(expr_ast)
+        if elem_type == InterpreterBase.LAMBDA_DEF:
+            env = self.env
+            captures = self.interpreter.captures.names(expr_ast)
+            return lambda: Value(Type.CLOSURE, Closure(expr_ast, env, captures))
+        if elem_type == InterpreterBase.OBJ_DEF:
+            return lambda: Value(Type.OBJECT, Object())
+        return lambda: None
+
+    # constants are never bound to a variable as they are, so each one can
+    # always produce the same Value
+    @staticmethod
+    def __compile_const(t, val):
+        value_obj = Value(t, val)
+        return lambda: value_obj
+
+    # ref is set for names passed as arguments, which may be bound to ref
+    # parameters
+    def __compile_name(self, name_ast, ref=False):
+        var_name = name_ast.get("name")
+        env_get = self.env.get
+        error = self.__error
+
+        field = name_ast.get("field")
+        if field is not None:
+            get_field = FieldCache(field).get
+
+            def eval_field():
+                target_value_obj = env_get(var_name)
+                if target_value_obj is None:
+                    error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
+                if target_value_obj.t is not Type.OBJECT:
+                    error(ErrorType.TYPE_ERROR, f"Variable {var_name} is not an object")
+                obj = target_value_obj.v
+                val = obj.get_field_ref(field) if ref else get_field(obj)
+                if val is None:
+                    error(ErrorType.NAME_ERROR, "field not found")
+                return val
+
+            return eval_field
+
+        # the function table never changes while a program runs, so the
+        # fallback for names that aren't variables is resolved up front
+        candidate_funcs = self.func_name_to_ast.get(var_name)
+
+        def eval_name():
+            val = env_get(var_name)
+            if val is not None:
+                return val
+            if candidate_funcs is None:
+                error(ErrorType.NAME_ERROR, f"Variable/function {var_name} not found")
+            if len(candidate_funcs) > 1:
+                error(
+                    ErrorType.NAME_ERROR,
+                    f"Function {var_name} has multiple overloaded versions",
+                )
+            return Value(Type.CLOSURE, next(iter(candidate_funcs.values())))
+
+        return eval_name
+
+    def __compile_op(self, arith_ast):
+        oper = arith_ast.elem_type
+        left = self.__compile_expr(arith_ast.get("op1"))
+        right = self.__compile_expr(arith_ast.get("op2"))
+        bin_ops = self.interpreter.bin_ops
+        int_op = ClosureCompiler.INT_OPS.get(oper)
+
+        if int_op is None:  # && and ||
+
+            def eval_logic():
+                left_value_obj = left()
+                right_value_obj = right()
+                f = bin_ops[(oper, left_value_obj.t, right_value_obj.t)]
+                return f(left_value_obj, right_value_obj)
+
+            return eval_logic
+
+        def eval_op():
+            left_value_obj = left()
+            right_value_obj = right()
+            if left_value_obj.t is Type.INT and right_value_obj.t is Type.INT:
+                return int_op(left_value_obj.v, right_value_obj.v)
+            f = bin_ops[(oper, left_value_obj.t, right_value_obj.t)]
+            return f(left_value_obj, right_value_obj)
+
+        return eval_op
+
+    def __compile_neg(self, arith_ast):
+        operand = self.__compile_expr(arith_ast.get("op1"))
+        error = self.__error
+
+        def eval_neg():
+            value_obj = operand()
+            if value_obj.t is not Type.INT:
+                error(ErrorType.TYPE_ERROR, "Incompatible type for neg operation")
+            return Value(Type.INT, -1 * value_obj.v)
+
+        return eval_neg
+
+    def __compile_not(self, arith_ast):
+        operand = self.__compile_expr(arith_ast.get("op1"))
+        error = self.__error
+
+        def eval_not():
+            value_obj = operand()
+            if value_obj.t is Type.INT:
+                return Value(Type.BOOL, value_obj.v == 0)
+            if value_obj.t is not Type.BOOL:
+                error(ErrorType.TYPE_ERROR, "Incompatible type for ! operation")
+            return Value(Type.BOOL, not value_obj.v)
+
+        return eval_not
+
+    def __compile_call(self, call_ast):
+        func_name = call_ast.get("name")
+        if func_name == "print":
+            return self.__compile_print(call_ast)
+        if func_name == "inputi":
+            return self.__compile_input(call_ast)
+
+        args = self.__compile_args(call_ast)
+        num_args = len(args)
+        env_get = self.env.get
+        error = self.__error
+        invoke = self.__invoke
+        candidate_funcs = self.func_name_to_ast.get(func_name)
+
+        if candidate_funcs is not None:
+            # named functions can't be reassigned, so the overload is picked now
+            target_closure = candidate_funcs.get(num_args)
+
+            def call_func():
+                if target_closure is None:
+                    error(
+                        ErrorType.NAME_ERROR,
+                        f"Function {func_name} taking {num_args} params not found",
+                    )
+                if target_closure.type is not Type.CLOSURE:
+                    error(
+                        ErrorType.TYPE_ERROR,
+                        f"Function {func_name} is changed to non-function type.",
+                    )
+                return invoke(target_closure, args, {})
+
+            return call_func
+
+        def call_lambda():
+            closure_val_obj = env_get(func_name)
+            if closure_val_obj is None:
+                error(ErrorType.NAME_ERROR, f"Function {func_name} not found")
+            if closure_val_obj.t is not Type.CLOSURE:
+                error(ErrorType.TYPE_ERROR, "Trying to call function with non-closure")
+            target_closure = closure_val_obj.v
+            if len(target_closure.func_ast.get("args")) != num_args:
+                error(ErrorType.TYPE_ERROR, "Invalid # of args to lambda")
+            if target_closure.type is not Type.CLOSURE:
+                error(
+                    ErrorType.TYPE_ERROR,
+                    f"Function {func_name} is changed to non-function type.",
+                )
+            return invoke(target_closure, args, {})
+
+        return call_lambda
+
+    def __compile_method_call(self, call_ast):
+        objref = call_ast.get("objref")
+        method_name = call_ast.get("name")
+        args = self.__compile_args(call_ast)
+        env_get = self.env.get
+        error = self.__error
+        invoke = self.__invoke
+        get_method = FieldCache(method_name).get
+
+        def call_method():
+            var_obj = env_get(objref)
+            if var_obj is None:
+                error(ErrorType.NAME_ERROR, "Variable not found")
+            elif var_obj.t is not Type.OBJECT:
+                error(ErrorType.TYPE_ERROR, "Variable is not an object")
+            method_obj = get_method(var_obj.v)
+            if method_obj is None:
+                error(ErrorType.NAME_ERROR, "Method not found")
+            if method_obj.t is not Type.CLOSURE:
+                error(ErrorType.TYPE_ERROR, "Method is changed to non-function type.")
+            target_closure = method_obj.v
+            if target_closure.type is not Type.CLOSURE:
+                error(ErrorType.TYPE_ERROR, "Function is changed to non-function type.")
+            return invoke(target_closure, args, {"this": var_obj})
+
+        return call_method
+
+    # returns (compiled arg, whether it is a variable or field) pairs
+    def __compile_args(self, call_ast):
+        return tuple(
+            (self.__compile_name(arg, ref=True), True)
+            if arg.elem_type == InterpreterBase.VAR_DEF
+            else (self.__compile_expr(arg), False)
+            for arg in call_ast.get("args")
+        )
+
+    # runs the closure with new_env (already holding "this" for method calls)
+    # as its top-level scope, and returns the Value the call evaluates to
+    def __invoke(self, target_closure, args, new_env):
+        target_ast = target_closure.func_ast
+        formal_args, body = self.__get_compiled_func(target_ast)
+        new_env.update(target_closure.captured_vars)
+        if len(args) != len(formal_args):
+            self.__error(
+                ErrorType.NAME_ERROR,
+                f"Function {target_ast.get('name')} with {len(args)} args not found",
+            )
+        for (arg_name, is_ref), (arg, is_name) in zip(formal_args, args):
+            if not is_ref:
+                new_env[arg_name] = copy_value(arg())
+            elif is_name:
+                new_env[arg_name] = arg()
+            else:
+                # the parameter is the only variable holding the result
+                value_obj = arg()
+                new_env[arg_name] = Value(value_obj.t, value_obj.v)
+        self.env.push(new_env)
+        return_val = body()
+        self.env.pop()
+        if return_val is None:
+            return self.interpreter.NIL_VALUE
+        return return_val
+
+    def __compile_print(self, call_ast):
+        args = tuple(self.__compile_expr(arg) for arg in call_ast.get("args"))
+        interpreter = self.interpreter
+        nil_value = interpreter.NIL_VALUE
+
+        def call_print():
+            output = ""
+            for arg in args:
+                output = output + get_printable(arg())
+            interpreter.output(output)
+            return nil_value
+
+        return call_print
+
+    def __compile_input(self, call_ast):
+        args = tuple(self.__compile_expr(arg) for arg in call_ast.get("args"))
+        interpreter = self.interpreter
+        error = self.__error
+
+        def call_input():
+            if len(args) == 1:
+                interpreter.output(get_printable(args[0]()))
+            elif len(args) > 1:
+                error(ErrorType.NAME_ERROR, "No inputi() function that takes > 1 parameter")
+            return Value(Type.INT, int(interpreter.get_input()))
+
+        return call_input
@@ -1,14 +1,24 @@
+from intbase import InterpreterBase
+
+
+# Base class of all ast nodes.  Each kind of node is its own class with
+# __slots__, so nodes are small and fields are plain attributes; get() and
+# the dict property keep the original Element interface working.
 class Element:
-    def __init__(self, elem_type, **kwargs):
-        self.elem_type = elem_type
-        self.dict = {}
-        for key, value in kwargs.items():
-            self.dict[key] = value
+    __slots__ = ()
+    fields = ()  # names of the node's fields, in order
 
     def get(self, key):
-        if key not in self.dict:
-            return None
-        return self.dict[key]
+        return getattr(self, key, None)
+
+    @property
+    def dict(self):
+        return {key: getattr(self, key) for key in self.fields}
+
+    # ast nodes are never modified, so copies of values that hold on to
+    # them (e.g. closures) can share the same nodes
+    def __deepcopy__(self, memo):
+        return self
 
     def __str__(self):
         s = f"{self.elem_type}: "
@@ -27,3 +37,174 @@ class Element:
                 return "[" + s[0:-2] + "]"
             return "[" + s + "]"
         return str(v)
+
+
+class Program(Element):
+    __slots__ = ("functions",)
+    fields = __slots__
+    elem_type = InterpreterBase.PROGRAM_DEF
+
+    def __init__(self, functions):
+        self.functions = functions
+
+
+class Func(Element):
+    __slots__ = ("name", "args", "statements")
+    fields = __slots__
+    elem_type = InterpreterBase.FUNC_DEF
+
+    def __init__(self, name, args, statements):
+        self.name = name
+        self.args = args
+        self.statements = statements
+
+
+class Lambda(Element):
+    __slots__ = ("args", "statements")
+    fields = __slots__
+    elem_type = InterpreterBase.LAMBDA_DEF
+
+    def __init__(self, args, statements):
+        self.args = args
+        self.statements = statements
+
+
+# a formal argument; elem_type is arg or refarg
+class Arg(Element):
+    __slots__ = ("elem_type", "name")
+    fields = ("name",)
+
+    def __init__(self, elem_type, name):
+        self.elem_type = elem_type
+        self.name = name
+
+
+# assigns to the variable name, or to a field of it (name.field) if field is
+# set
+class Assign(Element):
+    __slots__ = ("name", "field", "expression")
+    fields = __slots__
+    elem_type = "="
+
+    def __init__(self, name, expression, field=None):
+        self.name = name
+        self.field = field
+        self.expression = expression
+
+    @property
+    def dict(self):
+        return {"name": dotted_name(self), "expression": self.expression}
+
+
+class If(Element):
+    __slots__ = ("condition", "statements", "else_statements")
+    fields = __slots__
+    elem_type = InterpreterBase.IF_DEF
+
+    def __init__(self, condition, statements, else_statements):
+        self.condition = condition
+        self.statements = statements
+        self.else_statements = else_statements
+
+
+class While(Element):
+    __slots__ = ("condition", "statements")
+    fields = __slots__
+    elem_type = InterpreterBase.WHILE_DEF
+
+    def __init__(self, condition, statements):
+        self.condition = condition
+        self.statements = statements
+
+
+class Return(Element):
+    __slots__ = ("expression",)
+    fields = __slots__
+    elem_type = InterpreterBase.RETURN_DEF
+
+    def __init__(self, expression):
+        self.expression = expression
+
+
+# elem_type is the operator, e.g. + or &&
+class BinOp(Element):
+    __slots__ = ("elem_type", "op1", "op2")
+    fields = ("op1", "op2")
+
+    def __init__(self, elem_type, op1, op2):
+        self.elem_type = elem_type
+        self.op1 = op1
+        self.op2 = op2
+
+
+# elem_type is neg or !
+class UnaryOp(Element):
+    __slots__ = ("elem_type", "op1")
+    fields = ("op1",)
+
+    def __init__(self, elem_type, op1):
+        self.elem_type = elem_type
+        self.op1 = op1
+
+
+# an int, bool or string constant
+class Literal(Element):
+    __slots__ = ("elem_type", "val")
+    fields = ("val",)
+
+    def __init__(self, elem_type, val):
+        self.elem_type = elem_type
+        self.val = val
+
+
+class Nil(Element):
+    __slots__ = ()
+    elem_type = InterpreterBase.NIL_DEF
+
+
+class NewObject(Element):
+    __slots__ = ()
+    elem_type = InterpreterBase.OBJ_DEF
+
+
+# the variable name, or a field of it (name.field) if field is set
+class Var(Element):
+    __slots__ = ("name", "field")
+    fields = __slots__
+    elem_type = InterpreterBase.VAR_DEF
+
+    def __init__(self, name, field=None):
+        self.name = name
+        self.field = field
+
+    @property
+    def dict(self):
+        return {"name": dotted_name(self)}
+
+
+class Call(Element):
+    __slots__ = ("name", "args")
+    fields = __slots__
+    elem_type = InterpreterBase.FCALL_DEF
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+
+class MethodCall(Element):
+    __slots__ = ("objref", "name", "args")
+    fields = __slots__
+    elem_type = InterpreterBase.MCALL_DEF
+
+    def __init__(self, objref, name, args):
+        self.objref = objref
+        self.name = name
+        self.args = args
+
+
+# the name a var or assign node was written with, e.g. a.b
+def dotted_name(node):
+    if node.field is None:
+        return node.name
+    return node.name + "." + node.field
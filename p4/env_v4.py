@@ -41,6 +41,19 @@ class EnvironmentManager:
     def pop(self):
         self.environment.pop()
 
+    # the number of environments pushed (plus the bottom one)
+    def depth(self):
+        return len(self.environment)
+
+    # pops environments until there are only depth of them left
+    def truncate(self, depth):
+        del self.environment[depth:]
+
+    # returns the Value of a symbol that is known to be in the environment
+    # depth levels below the top one (see resolverv4.resolve)
+    def get_at(self, depth, symbol):
+        return self.environment[-1 - depth][symbol]
+
     def __enumerate(self):
         captured_so_far = set()
         for captured in reversed(self.environment):
@@ -52,3 +65,99 @@ class EnvironmentManager:
 
     def __iter__(self):
         return self.__enumerate()
+
+
+# An EnvironmentManager that keeps a single dict mapping each symbol to the
+# stack of Values bound to it, innermost last, instead of one dict per
+# environment.  get() is a single lookup however many environments were pushed,
+# which matters for deep recursion, where the other EnvironmentManager has to
+# search every frame for names bound by the callers.  Each environment records
+# the symbols it bound, so pop() only touches those.
+# Every method that uses self.environment is overridden.
+class StackEnvironmentManager(EnvironmentManager):
+    def __init__(self):
+        super().__init__()
+        self.bindings = {}  # symbol -> Values bound to it, innermost last
+        self.scopes = [set()]  # symbols bound in each environment, innermost last
+
+    def get(self, symbol):
+        stack = self.bindings.get(symbol)
+        if stack is None:
+            return None
+        return stack[-1]
+
+    def set(self, symbol, value, force_new_var_creation=False):
+        if force_new_var_creation:
+            self.create(symbol, value)
+            return
+        stack = self.bindings.get(symbol)
+        if stack is None:
+            self.bindings[symbol] = [value]
+            self.scopes[-1].add(symbol)
+        else:
+            stack[-1] = value
+
+    def create(self, symbol, value):
+        scope = self.scopes[-1]
+        stack = self.bindings.get(symbol)
+        if stack is None:
+            self.bindings[symbol] = [value]
+            scope.add(symbol)
+        elif symbol in scope:
+            stack[-1] = value
+        else:
+            stack.append(value)
+            scope.add(symbol)
+
+    # env (a symbol -> Value dict) holds the symbols bound in the new
+    # environment; it isn't used after that
+    def push(self, env=None):
+        if env is None:
+            self.scopes.append(set())
+            return
+        bindings = self.bindings
+        for symbol, value in env.items():
+            stack = bindings.get(symbol)
+            if stack is None:
+                bindings[symbol] = [value]
+            else:
+                stack.append(value)
+        self.scopes.append(set(env))
+
+    def pop(self):
+        bindings = self.bindings
+        for symbol in self.scopes.pop():
+            stack = bindings[symbol]
+            if len(stack) == 1:
+                del bindings[symbol]
+            else:
+                stack.pop()
+
+    def depth(self):
+        return len(self.scopes)
+
+    def truncate(self, depth):
+        while len(self.scopes) > depth:
+            self.pop()
+
+    # the resolver only gives depths for symbols that the environment depth
+    # levels below the top one binds and no environment above it does, so
+    # the symbol's innermost Value is the one in that environment (see
+    # tests/test_modes.py, which checks that)
+    def get_at(self, depth, symbol):
+        return self.bindings[symbol][-1]
+
+    def __iter__(self):
+        return ((symbol, stack[-1]) for symbol, stack in self.bindings.items())
+
+
+# the kinds of EnvironmentManager the interpreter can use (see its environment
+# argument)
+FRAMES = "frames"  # EnvironmentManager, a dict per environment
+STACKS = "stacks"  # StackEnvironmentManager
+
+ENVIRONMENTS = {FRAMES: EnvironmentManager, STACKS: StackEnvironmentManager}
+
+
+def new_environment(kind=FRAMES):
+    return ENVIRONMENTS[kind]()
@@ -1,15 +1,32 @@
-import copy
-from enum import Enum
-
 from brewparse import parse_program
-from env_v4 import EnvironmentManager
+from bytecodev4 import compile_program
+from closure_compilerv4 import ClosureCompiler
+from env_v4 import FRAMES, STACKS, new_environment
 from intbase import InterpreterBase, ErrorType
-from type_valuev4 import Closure, Type, Value, create_value, get_printable
-
-
-class ExecStatus(Enum):
-    CONTINUE = 1
-    RETURN = 2
+from native_compilerv4 import NativeCompiler
+from resolverv4 import CREATE, CaptureAnalysis, resolve
+from stack_evaluatorv4 import StackEvaluator
+from type_valuev4 import (
+    Closure,
+    FieldCache,
+    Object,
+    Type,
+    Value,
+    copy_value,
+    create_value,
+    get_printable,
+)
+from unboxed_compilerv4 import UnboxedCompiler
+from vmv4 import VirtualMachine
+
+
+# What a call in tail position (return f(...)) returns instead of running the
+# function: __run_function makes the call once the function containing it has
+# returned, so tail calls don't use up the python stack.
+class TailCall:
+    def __init__(self, func_ast, new_env):
+        self.func_ast = func_ast
+        self.new_env = new_env
 
 
 # Main interpreter class
@@ -19,30 +36,109 @@ class Interpreter(InterpreterBase):
     TRUE_VALUE = create_value(InterpreterBase.TRUE_DEF)
     BIN_OPS = {"+", "-", "*", "/", "==", "!=", ">", ">=", "<", "<=", "||", "&&"}
 
+    # execution modes
+    TREE_MODE = "tree"  # walk the ast directly
+    CLOSURE_MODE = "closure"  # compile each function into python closures first
+    BYTECODE_MODE = "bytecode"  # compile to bytecode and run it on a stack vm
+    NATIVE_MODE = "native"  # translate simple functions to python, walk the rest
+    UNBOXED_MODE = "unboxed"  # like closure, but primitives are plain python values
+    STACK_MODE = "stack"  # walk the ast with explicit stacks instead of recursion
+
+    # environments
+    FRAMES_ENV = FRAMES  # env_v4.EnvironmentManager, a dict per scope
+    STACKS_ENV = STACKS  # env_v4.StackEnvironmentManager, a stack per name
+
     # methods
-    def __init__(self, console_output=True, inp=None, trace_output=False):
+    def __init__(
+        self,
+        console_output=True,
+        inp=None,
+        trace_output=False,
+        mode=TREE_MODE,
+        parse_cache=None,
+        environment=FRAMES_ENV,
+    ):
         super().__init__(console_output, inp)
         self.trace_output = trace_output
+        self.mode = mode
+        self.environment = environment
+        self.parse_cache = parse_cache  # optional parse_cache.ParseCache
         self.__setup_ops()
+        self.__setup_handlers()
 
     # run a program that's provided in a string
     # usese the provided Parser found in brewparse.py to parse the program
-    # into an abstract syntax tree (ast)
+    # into an abstract syntax tree (ast), or reuses the ast from the parse
+    # cache if the same program was parsed before
     def run(self, program):
-        ast = parse_program(program)
+        ast = self.__parse(program)
+        if self.mode == Interpreter.BYTECODE_MODE:
+            self.run_bytecode(compile_program(ast))
+            return
+        main_func = self.__set_up(ast)
+        if self.mode == Interpreter.CLOSURE_MODE:
+            ClosureCompiler(self).run(main_func)
+        elif self.mode == Interpreter.UNBOXED_MODE:
+            UnboxedCompiler(self).run(main_func)
+        elif self.mode == Interpreter.STACK_MODE:
+            StackEvaluator(self).run(main_func)
+        else:
+            # only the tree walker (which native mode falls back to) uses the
+            # addresses; resolve recurses in python, so the stack evaluator
+            # must not depend on it
+            self.addresses, self.unscoped = resolve(main_func.func_ast, entry=True)
+            if self.mode == Interpreter.NATIVE_MODE and not self.trace_output:
+                self.native = NativeCompiler(self)
+                if self.native.call(main_func.func_ast, {}) is not None:
+                    return
+            return_val = self.__run_statements(main_func.func_ast.get("statements"))
+            if return_val.__class__ is TailCall:
+                self.__run_function(return_val.func_ast, return_val.new_env)
+
+    # sets up running a program a slice at a time, whatever the mode, and
+    # returns the StackEvaluator running it: its resume(max_steps) runs the
+    # program for at most max_steps steps and returns whether it finished
+    def start(self, program):
+        main_func = self.__set_up(self.__parse(program))
+        evaluator = StackEvaluator(self)
+        evaluator.start(main_func)
+        return evaluator
+
+    def __parse(self, program):
+        if self.parse_cache is not None:
+            return self.parse_cache.parse(program)
+        return parse_program(program)
+
+    # sets up the state for running the program's ast and returns main's
+    # closure
+    def __set_up(self, ast):
         self.__set_up_function_table(ast)
-        self.env = EnvironmentManager()
+        self.captures = CaptureAnalysis(ast.functions)
+        self.env = new_environment(self.environment)
         main_func = self.__get_func_by_name("main", 0)
         if main_func is None:
             super().error(ErrorType.NAME_ERROR, f"Function not found")
-        self.__run_statements(main_func.func_ast.get("statements"))
+        self.native = None
+        self.resolved = {}  # func/lambda ast -> addresses from resolverv4.resolve
+        self.quickened = {}  # expression ast -> specialized version, see __eval_expr
+        self.field_caches = {}  # method call or field assignment ast -> FieldCache
+        self.tail_call = None  # call ast being evaluated by a return, if any
+        self.addresses = {}  # set by run() for the tree walker, see resolve
+        self.unscoped = set()
+        return main_func
+
+    # run a program that was already compiled with bytecodev4.compile_program,
+    # e.g. one that was loaded from a cache with BytecodeProgram.loads
+    def run_bytecode(self, bytecode_program):
+        self.env = new_environment(self.environment)
+        VirtualMachine(self).run(bytecode_program)
 
     def __set_up_function_table(self, ast):
         self.func_name_to_ast = {}
-        empty_env = EnvironmentManager()
-        for func_def in ast.get("functions"):
-            func_name = func_def.get("name")
-            num_params = len(func_def.get("args"))
+        empty_env = new_environment()
+        for func_def in ast.functions:
+            func_name = func_def.name
+            num_params = len(func_def.args)
             if func_name not in self.func_name_to_ast:
                 self.func_name_to_ast[func_name] = {}
             self.func_name_to_ast[func_name][num_params] = Closure(func_def, empty_env)
@@ -84,95 +180,201 @@ class Interpreter(InterpreterBase):
             )
         return candidate_funcs[num_params]
 
+    # returns None when the statements run to completion and the returned
+    # Value object (or TailCall) when a return statement was executed
     def __run_statements(self, statements):
-        self.env.push()
+        # blocks that can't create a variable don't need a frame (see resolve)
+        scoped = id(statements) not in self.unscoped
+        if scoped:
+            self.env.push()
+        statement_handlers = self.statement_handlers
         for statement in statements:
             if self.trace_output:
                 print(statement)
-            status = ExecStatus.CONTINUE
-            if statement.elem_type == InterpreterBase.FCALL_DEF:
-                self.__call_func(statement)
-            elif statement.elem_type == "=":
-                self.__assign(statement)
-            elif statement.elem_type == InterpreterBase.MCALL_DEF:
-                self.__call_method(statement)
-            elif statement.elem_type == InterpreterBase.RETURN_DEF:
-                status, return_val = self.__do_return(statement)
-            elif statement.elem_type == Interpreter.IF_DEF:
-                status, return_val = self.__do_if(statement)
-            elif statement.elem_type == Interpreter.WHILE_DEF:
-                status, return_val = self.__do_while(statement)
-
-            if status == ExecStatus.RETURN:
-                self.env.pop()
-                return (status, return_val)
-
-        self.env.pop()
-        return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
-
+            return_val = statement_handlers[statement.elem_type](statement)
+            if return_val is not None:
+                # a tail call still sees the variables of the blocks returning
+                # it, __run_function pops them
+                if scoped and return_val.__class__ is not TailCall:
+                    self.env.pop()
+                return return_val
+
+        if scoped:
+            self.env.pop()
+        return None
+
+    # statement_handlers maps each kind of statement to the method running it,
+    # which returns what __run_statements does; expr_handlers maps each kind
+    # of expression to the method evaluating it the first time (see
+    # __eval_expr)
+    def __setup_handlers(self):
+        self.statement_handlers = {
+            InterpreterBase.FCALL_DEF: self.__run_expr,
+            "=": self.__assign,
+            InterpreterBase.MCALL_DEF: self.__run_expr,
+            InterpreterBase.RETURN_DEF: self.__do_return,
+            Interpreter.IF_DEF: self.__do_if,
+            Interpreter.WHILE_DEF: self.__do_while,
+        }
+        self.expr_handlers = {
+            InterpreterBase.NIL_DEF: lambda expr_ast: self.__quicken_constant(
+                expr_ast, Interpreter.NIL_VALUE
+            ),
+            InterpreterBase.INT_DEF: lambda expr_ast: self.__quicken_constant(
+                expr_ast, Value(Type.INT, expr_ast.val)
+            ),
+            InterpreterBase.STRING_DEF: lambda expr_ast: self.__quicken_constant(
+                expr_ast, Value(Type.STRING, expr_ast.val)
+            ),
+            InterpreterBase.BOOL_DEF: lambda expr_ast: self.__quicken_constant(
+                expr_ast, Value(Type.BOOL, expr_ast.val)
+            ),
+            InterpreterBase.VAR_DEF: self.__eval_var,
+            InterpreterBase.FCALL_DEF: self.__call_func,
+            InterpreterBase.MCALL_DEF: self.__call_method,
+            Interpreter.NEG_DEF: lambda expr_ast: self.__eval_unary(
+                expr_ast, Type.INT, lambda x: -1 * x
+            ),
+            Interpreter.NOT_DEF: lambda expr_ast: self.__eval_unary(
+                expr_ast, Type.BOOL, lambda x: not x
+            ),
+            Interpreter.LAMBDA_DEF: self.__eval_lambda,
+            Interpreter.OBJ_DEF: lambda expr_ast: Value(Type.OBJECT, Object()),
+        }
+        for oper in Interpreter.BIN_OPS:
+            self.expr_handlers[oper] = self.__eval_op
+        # other expressions used as statements aren't evaluated; anything else
+        # isn't a statement, and fails with a KeyError
+        for expr_type in self.expr_handlers:
+            self.statement_handlers.setdefault(expr_type, self.__skip)
+
+    # calls whose result isn't used
+    def __run_expr(self, call_ast):
+        eval_call = self.quickened.get(call_ast) or self.expr_handlers[call_ast.elem_type]
+        eval_call(call_ast)
+
+    def __skip(self, expr_ast):
+        return None
 
     def __call_func(self, call_ast):
-        func_name = call_ast.get("name")
+        func_name = call_ast.name
         if func_name == "print":
             return self.__call_print(call_ast)
         if func_name == "inputi":
             return self.__call_input(call_ast)
 
-        actual_args = call_ast.get("args")
+        actual_args = call_ast.args
         target_closure = self.__get_func_by_name(func_name, len(actual_args))
         if target_closure == None:
             super().error(ErrorType.NAME_ERROR, f"Function {func_name} not found")
         if target_closure.type != Type.CLOSURE:
             super().error(ErrorType.TYPE_ERROR, f"Function {func_name} is changed to non-function type.")
-        target_ast = target_closure.func_ast
-
-        new_env = {}
-        self.__prepare_env_with_closed_variables(target_closure, new_env)
-        self.__prepare_params(target_ast,call_ast, new_env)
-        self.env.push(new_env)
-        _, return_val = self.__run_statements(target_ast.get("statements"))
-        self.env.pop()
-        return return_val
+        if func_name not in self.func_name_to_ast:
+            self.quickened[call_ast] = self.__quicken_closure_call(target_closure)
+        elif call_ast not in self.quickened:
+            self.quickened[call_ast] = self.__quicken_call(target_closure)
+
+        new_env = dict(target_closure.captured_vars)
+        return self.__run_function(target_closure.func_ast, new_env, call_ast)
+
+    # a call of a function from the function table always reaches the same
+    # closure, unless a variable it was assigned to changed its type since
+    def __quicken_call(self, target_closure):
+        func_ast = target_closure.func_ast
+
+        def call_func(call_ast):
+            if target_closure.type is not Type.CLOSURE:
+                return self.__call_func(call_ast)
+            new_env = dict(target_closure.captured_vars)
+            return self.__run_function(func_ast, new_env, call_ast)
+        return call_func
+
+    # a call through a variable caches the closure the variable held; as long
+    # as the variable still holds it, the name and the number of arguments
+    # don't have to be checked again.  If it holds something else (it was
+    # assigned, or a different variable with the name is found), the call is
+    # resolved again and the new closure is cached.
+    def __quicken_closure_call(self, target_closure):
+        func_ast = target_closure.func_ast
+
+        def call_closure(call_ast):
+            closure_value_obj = self.__lookup(call_ast, call_ast.name)
+            if (
+                closure_value_obj is None
+                or closure_value_obj.v is not target_closure
+                or target_closure.type is not Type.CLOSURE
+            ):
+                return self.__call_func(call_ast)
+            new_env = dict(target_closure.captured_vars)
+            return self.__run_function(func_ast, new_env, call_ast)
+        return call_closure
 
     def __call_method(self, call_ast):
-        var_obj = self.env.get(call_ast.get("objref"))
+        var_obj = self.__lookup(call_ast, call_ast.objref)
         if var_obj is None:
             super().error(ErrorType.NAME_ERROR, f"Variable not found")
         elif var_obj.type() != Type.OBJECT:
             super().error(ErrorType.TYPE_ERROR, f"Variable is not an object")
-        method_name = call_ast.get("name")
-        try:
-            method_obj = var_obj.v[method_name]
-        except KeyError:
+        method_obj = self.__field_cache(call_ast, call_ast.name).get(var_obj.v)
+        if method_obj is None:
             super().error(ErrorType.NAME_ERROR, f"Method not found")
 
         if method_obj.t != Type.CLOSURE:
             super().error(ErrorType.TYPE_ERROR, f"Method is changed to non-function type.")
-        actual_args = call_ast.get("args")
+        actual_args = call_ast.args
         target_closure = method_obj.v
         if target_closure == None:
             super().error(ErrorType.NAME_ERROR, f"Function not found")
         if target_closure.type != Type.CLOSURE:
             super().error(ErrorType.TYPE_ERROR, f"Function is changed to non-function type.")
-        target_ast = target_closure.func_ast
         new_env = {"this" : var_obj}
-        self.__prepare_env_with_closed_variables(target_closure, new_env)
-        self.__prepare_params(target_ast,call_ast, new_env)
-        self.env.push(new_env)
-        _, return_val = self.__run_statements(target_ast.get("statements"))
-        self.env.pop()
+        new_env.update(target_closure.captured_vars)
+        return self.__run_function(target_closure.func_ast, new_env, call_ast)
+
+    # runs the function called by call_ast: its parameters are added to
+    # new_env, which already holds its captured variables (and this, for a
+    # method), then the call is returned as a TailCall if it is in tail
+    # position, or run otherwise.  call_ast is None when new_env already holds
+    # the parameters.
+    # Once the function returns, the function it tail calls is run, if any,
+    # and so on.  Each of them runs on top of the frames of the one that
+    # called it, as usual, so the frames are only popped at the end.
+    # Calls that aren't in tail position still recurse in python, so all of
+    # this is done in one frame (see also __eval_expr).
+    def __run_function(self, func_ast, new_env, call_ast=None):
+        if call_ast is not None:
+            tail_call = self.tail_call is call_ast
+            self.tail_call = None
+            self.__prepare_params(func_ast, call_ast, new_env)
+            if tail_call:
+                return TailCall(func_ast, new_env)
+        caller_addresses = self.addresses
+        depth = self.env.depth()
+        while True:
+            if self.native is not None:
+                return_val = self.native.call(func_ast, new_env)
+                if return_val is not None:
+                    break
+            addresses = self.resolved.get(func_ast)
+            if addresses is None:
+                addresses, unscoped = resolve(func_ast)
+                self.resolved[func_ast] = addresses
+                self.unscoped |= unscoped
+            self.addresses = addresses
+            self.env.push(new_env)
+            return_val = self.__run_statements(func_ast.get("statements"))
+            if return_val is None:
+                return_val = Interpreter.NIL_VALUE
+                break
+            if return_val.__class__ is not TailCall:
+                break
+            func_ast, new_env = return_val.func_ast, return_val.new_env
+        self.env.truncate(depth)
+        self.addresses = caller_addresses
         return return_val
 
-
-    def __prepare_env_with_closed_variables(self, target_closure, temp_env):
-        for var_name, value in target_closure.captured_env:
-            # Updated here - ignore updates to the scope if we
-            #   altered a parameter, or if the argument is a similarly named variable
-            temp_env[var_name] = value
-
-
     def __prepare_params(self, target_ast, call_ast, temp_env):
-        actual_args = call_ast.get("args")
+        actual_args = call_ast.args
         formal_args = target_ast.get("args")
         if len(actual_args) != len(formal_args):
             super().error(
@@ -180,24 +382,34 @@ class Interpreter(InterpreterBase):
                 f"Function {target_ast.get('name')} with {len(actual_args)} args not found",
             )
 
+        quickened = self.quickened
+        handlers = self.expr_handlers
         for formal_ast, actual_ast in zip(formal_args, actual_args):
-            if formal_ast.elem_type == InterpreterBase.REFARG_DEF:
-                result = self.__eval_expr(actual_ast)
+            if formal_ast.elem_type != InterpreterBase.REFARG_DEF:
+                eval_arg = quickened.get(actual_ast) or handlers[actual_ast.elem_type]
+                result = copy_value(eval_arg(actual_ast))
+            elif actual_ast.elem_type == InterpreterBase.VAR_DEF:
+                result = self.__eval_name(actual_ast, ref=True)
             else:
-                result = copy.deepcopy(self.__eval_expr(actual_ast))
-            arg_name = formal_ast.get("name")
+                # the parameter is the only variable holding the result
+                result = self.__eval_expr(actual_ast)
+                result = Value(result.t, result.v)
+            arg_name = formal_ast.name
             temp_env[arg_name] = result
 
     def __call_print(self, call_ast):
         output = ""
-        for arg in call_ast.get("args"):
-            result = self.__eval_expr(arg)  # result is a Value object
+        quickened = self.quickened
+        handlers = self.expr_handlers
+        for arg in call_ast.args:
+            # result is a Value object
+            result = (quickened.get(arg) or handlers[arg.elem_type])(arg)
             output = output + get_printable(result)
         super().output(output)
         return Interpreter.NIL_VALUE
 
     def __call_input(self, call_ast):
-        args = call_ast.get("args")
+        args = call_ast.args
         if args is not None and len(args) == 1:
             result = self.__eval_expr(args[0])
             super().output(get_printable(result))
@@ -206,18 +418,16 @@ class Interpreter(InterpreterBase):
                 ErrorType.NAME_ERROR, "No inputi() function that takes > 1 parameter"
             )
         inp = super().get_input()
-        if call_ast.get("name") == "inputi":
+        if call_ast.name == "inputi":
             return Value(Type.INT, int(inp))
-        if call_ast.get("name") == "inputs":
+        if call_ast.name == "inputs":
             return Value(Type.STRING, inp)
 
     def __assign(self, assign_ast):
-        var_name = assign_ast.get("name")
+        var_name = assign_ast.name
 
-        if len(var_name.split(".")) > 1:
-            split = var_name.split(".")
-            var_name, field = split[0], split[1]
-            target_value_obj = self.env.get(var_name)
+        if assign_ast.field is not None:
+            target_value_obj = self.__lookup(assign_ast, var_name)
             if target_value_obj is None:
                 super().error(
                     ErrorType.NAME_ERROR, f"Variable {var_name} not found"
@@ -226,55 +436,112 @@ class Interpreter(InterpreterBase):
                 super().error(
                     ErrorType.TYPE_ERROR, f"Variable {var_name} is not an object"
                 )
-            target_value_obj.v[field] = copy.copy(self.__eval_expr(assign_ast.get("expression")))
+            expr_ast = assign_ast.expression
+            eval_expr = self.quickened.get(expr_ast) or self.expr_handlers[expr_ast.elem_type]
+            src_value_obj = eval_expr(expr_ast)
+            self.__field_cache(assign_ast, assign_ast.field).set(
+                target_value_obj.v, Value(src_value_obj.t, src_value_obj.v)
+            )
 
             # print(target_value_obj.v)
             return
         
 
-        src_value_obj = copy.copy(self.__eval_expr(assign_ast.get("expression")))
-        target_value_obj = self.env.get(var_name)
+        expr_ast = assign_ast.expression
+        eval_expr = self.quickened.get(expr_ast) or self.expr_handlers[expr_ast.elem_type]
+        src_value_obj = eval_expr(expr_ast)
+        depth = self.addresses.get(assign_ast)
+        if depth == CREATE:
+            # known not to be bound anywhere, so there's nothing to search
+            self.env.create(var_name, Value(src_value_obj.t, src_value_obj.v))
+            return
+        if depth is None:
+            target_value_obj = self.env.get(var_name)
+        else:
+            target_value_obj = self.env.get_at(depth, var_name)
         if target_value_obj is None:
-            self.env.set(var_name, src_value_obj)
+            self.env.set(var_name, Value(src_value_obj.t, src_value_obj.v))
         else:
             # if a close is changed to another type such as int, we cannot make function calls on it any more 
             if target_value_obj.t == Type.CLOSURE and src_value_obj.t != Type.CLOSURE:
-                target_value_obj.v.type = src_value_obj.t
+                target_value_obj.v.retype(src_value_obj.t)
             target_value_obj.set(src_value_obj)
 
+    def __field_cache(self, node, name):
+        cache = self.field_caches.get(node)
+        if cache is None:
+            cache = self.field_caches[node] = FieldCache(name)
+        return cache
+
+    # Nodes are quickened: once a node has run, it is replaced with a version
+    # specialized for what it saw (the Value of a constant, the frame of a
+    # variable, the function a call reaches, the operand types of an
+    # operator), which checks that still holds and falls back to the generic
+    # code if it doesn't.  The ast can be shared with other interpreters
+    # through the parse cache, so the nodes aren't rewritten themselves:
+    # self.quickened maps each quickened node to its specialized version.
+    # Code that evaluates the operands of a node (operators, conditions,
+    # assignments, returns, arguments and print) looks up their specialized
+    # version or their handler itself, so that a call nested in it doesn't
+    # also use up a python frame for __eval_expr (see __run_function).
     def __eval_expr(self, expr_ast):
-        if expr_ast.elem_type == InterpreterBase.NIL_DEF:
-            return Interpreter.NIL_VALUE
-        if expr_ast.elem_type == InterpreterBase.INT_DEF:
-            return Value(Type.INT, expr_ast.get("val"))
-        if expr_ast.elem_type == InterpreterBase.STRING_DEF:
-            return Value(Type.STRING, expr_ast.get("val"))
-        if expr_ast.elem_type == InterpreterBase.BOOL_DEF:
-            return Value(Type.BOOL, expr_ast.get("val"))
-        if expr_ast.elem_type == InterpreterBase.VAR_DEF:
-            return self.__eval_name(expr_ast)
-        if expr_ast.elem_type == InterpreterBase.FCALL_DEF:
-            return self.__call_func(expr_ast)
-        if expr_ast.elem_type == InterpreterBase.MCALL_DEF:
-            return self.__call_method(expr_ast)
-        if expr_ast.elem_type in Interpreter.BIN_OPS:
-            return self.__eval_op(expr_ast)
-        if expr_ast.elem_type == Interpreter.NEG_DEF:
-            return self.__eval_unary(expr_ast, Type.INT, lambda x: -1 * x)
-        if expr_ast.elem_type == Interpreter.NOT_DEF:
-            return self.__eval_unary(expr_ast, Type.BOOL, lambda x: not x)
-        if expr_ast.elem_type == Interpreter.LAMBDA_DEF:
-            return Value(Type.CLOSURE, Closure(expr_ast, self.env))
-        if expr_ast.elem_type == Interpreter.OBJ_DEF:
-            return Value(Type.OBJECT, {})
-
-    def __eval_name(self, name_ast):
-        
-        var_name = name_ast.get("name")
-        if len(var_name.split(".")) > 1:
-            split = var_name.split(".")
-            var_name, field = split[0], split[1]
-            target_value_obj = self.env.get(var_name)
+        quickened = self.quickened.get(expr_ast)
+        if quickened is not None:
+            return quickened(expr_ast)
+        return self.expr_handlers[expr_ast.elem_type](expr_ast)
+
+    def __eval_var(self, var_ast):
+        self.quickened[var_ast] = self.__quicken_name(var_ast)
+        return self.__eval_name(var_ast)
+
+    def __eval_lambda(self, lambda_ast):
+        captures = self.captures.names(lambda_ast)
+        return Value(Type.CLOSURE, Closure(lambda_ast, self.env, captures))
+
+    # constants are never modified, so every evaluation can return one Value
+    def __quicken_constant(self, const_ast, value):
+        self.quickened[const_ast] = lambda const_ast: value
+        return value
+
+    def __quicken_name(self, name_ast):
+        var_name = name_ast.name
+        field = name_ast.field
+        if field is not None:
+            get_field = FieldCache(field).get
+
+            def eval_field(name_ast):
+                target_value_obj = self.__lookup(name_ast, var_name)
+                if target_value_obj is not None and target_value_obj.t is Type.OBJECT:
+                    val = get_field(target_value_obj.v)
+                    if val is not None:
+                        return val
+                return self.__eval_name(name_ast)  # reports the error
+            return eval_field
+
+        addresses = self.addresses
+        depth = addresses.get(name_ast)
+        if depth is None:
+            def eval_var(name_ast):
+                val = self.env.get(var_name)
+                if val is not None:
+                    return val
+                return self.__eval_name(name_ast)
+            return eval_var
+
+        # the frame is only known while running the function the node was
+        # resolved for (main resolves differently when it isn't the entry)
+        def eval_resolved_var(name_ast):
+            if self.addresses is addresses:
+                return self.env.get_at(depth, var_name)
+            return self.__eval_name(name_ast)
+        return eval_resolved_var
+
+    # ref is set when the Value is bound to a ref parameter
+    def __eval_name(self, name_ast, ref=False):
+        var_name = name_ast.name
+        field = name_ast.field
+        if field is not None:
+            target_value_obj = self.__lookup(name_ast, var_name)
             if target_value_obj is None:
                 super().error(
                     ErrorType.NAME_ERROR, f"Variable {var_name} not found"
@@ -283,12 +550,14 @@ class Interpreter(InterpreterBase):
                 super().error(
                     ErrorType.TYPE_ERROR, f"Variable {var_name} is not an object"
                 )
-            try:
-                val = target_value_obj.v[field]
-            except KeyError:
+            if ref:
+                val = target_value_obj.v.get_field_ref(field)
+            else:
+                val = target_value_obj.v.get_field(field)
+            if val is None:
                 super().error(ErrorType.NAME_ERROR, f"field not found")
             return val
-        val = self.env.get(var_name)
+        val = self.__lookup(name_ast, var_name)
         if val is not None:
             return val
         closure = self.__get_func_by_name(var_name, None)
@@ -300,50 +569,100 @@ class Interpreter(InterpreterBase):
 
     
 
-    def __eval_op(self, arith_ast):
-        left_value_obj = self.__eval_expr(arith_ast.get("op1"))
-        right_value_obj = self.__eval_expr(arith_ast.get("op2"))
+    # finds the variable used by a var/assign/fcall/mcall node, directly in its frame
+    # if the resolver worked out which frame that is
+    def __lookup(self, node, var_name):
+        depth = self.addresses.get(node)
+        if depth is None:
+            return self.env.get(var_name)
+        return self.env.get_at(depth, var_name)
 
-
-        left_value_obj, right_value_obj = self.__bin_op_promotion(
-            arith_ast.elem_type, left_value_obj, right_value_obj
-        )
-
-        if not self.__compatible_types(
-            arith_ast.elem_type, left_value_obj, right_value_obj
-        ):
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible types for {arith_ast.elem_type} operation",
-            )
-        if arith_ast.elem_type not in self.op_to_lambda[left_value_obj.type()]:
-            super().error(
-                ErrorType.TYPE_ERROR,
-                f"Incompatible operator {arith_ast.elem_type} for type {left_value_obj.type()}",
+    def __eval_op(self, arith_ast):
+        quickened = self.quickened
+        handlers = self.expr_handlers
+        op1 = arith_ast.op1
+        left_value_obj = (quickened.get(op1) or handlers[op1.elem_type])(op1)
+        op2 = arith_ast.op2
+        right_value_obj = (quickened.get(op2) or handlers[op2.elem_type])(op2)
+        f = self.bin_ops[(arith_ast.elem_type, left_value_obj.t, right_value_obj.t)]
+        if arith_ast not in self.quickened:
+            self.quickened[arith_ast] = self.__quicken_op(
+                left_value_obj.t, right_value_obj.t, f
             )
-        f = self.op_to_lambda[left_value_obj.type()][arith_ast.elem_type]
         return f(left_value_obj, right_value_obj)
 
+    # specializes an operator for the operand types it saw first; if it is used
+    # with other types, it goes back to looking them up for good
+    def __quicken_op(self, left_type, right_type, f):
+        quickened = self.quickened
+        handlers = self.expr_handlers
+
+        def eval_op(arith_ast):
+            op1 = arith_ast.op1
+            left_value_obj = (quickened.get(op1) or handlers[op1.elem_type])(op1)
+            op2 = arith_ast.op2
+            right_value_obj = (quickened.get(op2) or handlers[op2.elem_type])(op2)
+            if left_value_obj.t is left_type and right_value_obj.t is right_type:
+                return f(left_value_obj, right_value_obj)
+            self.quickened[arith_ast] = self.__eval_op
+            oper = arith_ast.elem_type
+            return self.bin_ops[(oper, left_value_obj.t, right_value_obj.t)](
+                left_value_obj, right_value_obj
+            )
+        return eval_op
+
+    # bin_ops maps (operator, left type, right type) to a function that takes
+    # the two operand Values and returns the result, with the promotion rules
+    # below already applied (or that reports the type error)
+    def __setup_bin_ops(self):
+        self.bin_ops = {}
+        for oper in Interpreter.BIN_OPS:
+            for left_type in Type:
+                for right_type in Type:
+                    self.bin_ops[(oper, left_type, right_type)] = self.__bin_op(
+                        oper, left_type, right_type
+                    )
+
     # bool and int, int and bool for and/or/==/!= -> coerce int to bool
     # bool and int, int and bool for arithmetic ops, coerce true to 1, false to 0
-    def __bin_op_promotion(self, operation, op1, op2):
-        if operation in self.op_to_lambda[Type.BOOL]:  # && or ||
-            
+    def __bin_op(self, oper, left_type, right_type):
+        types = [left_type, right_type]
+        conversions = [[], []]
+        if oper in self.op_to_lambda[Type.BOOL]:  # && or ||
             # If this operation is still allowed in the ints, then continue
-            if operation in self.op_to_lambda[Type.INT] and op1.type() == Type.INT \
-                and op2.type() == Type.INT:
-                pass
-            else:
-                if op1.type() == Type.INT:
-                    op1 = Interpreter.__int_to_bool(op1)
-                if op2.type() == Type.INT:
-                    op2 = Interpreter.__int_to_bool(op2)
-        if operation in self.op_to_lambda[Type.INT]:  # +, -, *, /
-            if op1.type() == Type.BOOL:
-                op1 = Interpreter.__bool_to_int(op1)
-            if op2.type() == Type.BOOL:
-                op2 = Interpreter.__bool_to_int(op2)
-        return (op1, op2)
+            if not (oper in self.op_to_lambda[Type.INT] and types == [Type.INT, Type.INT]):
+                for i in range(2):
+                    if types[i] == Type.INT:
+                        types[i] = Type.BOOL
+                        conversions[i].append(Interpreter.__int_to_bool)
+        if oper in self.op_to_lambda[Type.INT]:  # +, -, *, /
+            for i in range(2):
+                if types[i] == Type.BOOL:
+                    types[i] = Type.INT
+                    conversions[i].append(Interpreter.__bool_to_int)
+
+        # DOCUMENT: allow comparisons ==/!= of anything against anything
+        if oper not in ["==", "!="] and types[0] != types[1]:
+            return self.__bin_op_error(f"Incompatible types for {oper} operation")
+        f = self.op_to_lambda[types[0]].get(oper)
+        if f is None:
+            return self.__bin_op_error(f"Incompatible operator {oper} for type {types[0]}")
+        if not conversions[0] and not conversions[1]:
+            return f
+
+        def convert(value, conversions):
+            for conversion in conversions:
+                value = conversion(value)
+            return value
+
+        left_conversions, right_conversions = conversions
+        return lambda x, y: f(convert(x, left_conversions), convert(y, right_conversions))
+
+    def __bin_op_error(self, description):
+        def report(x, y):
+            self.error(ErrorType.TYPE_ERROR, description)
+
+        return report
 
     def __unary_op_promotion(self, operation, op1):
         if operation == "!" and op1.type() == Type.INT:
@@ -358,14 +677,9 @@ class Interpreter(InterpreterBase):
     def __bool_to_int(value):
         return Value(Type.INT, 1 if value.value() else 0)
 
-    def __compatible_types(self, oper, obj1, obj2):
-        # DOCUMENT: allow comparisons ==/!= of anything against anything
-        if oper in ["==", "!="]:
-            return True
-        return obj1.type() == obj2.type()
-
     def __eval_unary(self, arith_ast, t, f):
-        value_obj = self.__eval_expr(arith_ast.get("op1"))
+        op1 = arith_ast.op1
+        value_obj = (self.quickened.get(op1) or self.expr_handlers[op1.elem_type])(op1)
         value_obj = self.__unary_op_promotion(arith_ast.elem_type, value_obj)
 
         if value_obj.type() != t:
@@ -461,54 +775,70 @@ class Interpreter(InterpreterBase):
         self.op_to_lambda[Type.OBJECT]["!="] = lambda x, y: Value(
             Type.BOOL, x.value() != y.value()
         )
-    def __do_if(self, if_ast):
-        cond_ast = if_ast.get("condition")
-        result = self.__eval_expr(cond_ast)
-        if result.type() == Type.INT:
-            result = Interpreter.__int_to_bool(result)
-        if result.type() != Type.BOOL:
-            super().error(
-                ErrorType.TYPE_ERROR,
-                "Incompatible type for if condition",
-            )
-        if result.value():
-            statements = if_ast.get("statements")
-            status, return_val = self.__run_statements(statements)
-            return (status, return_val)
-        else:
-            else_statements = if_ast.get("else_statements")
-            if else_statements is not None:
-                status, return_val = self.__run_statements(else_statements)
-                return (status, return_val)
+        self.__setup_bin_ops()
 
-        return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
-
-    def __do_while(self, while_ast):
-        cond_ast = while_ast.get("condition")
-        run_while = Interpreter.TRUE_VALUE
-        while run_while.value():
-            run_while = self.__eval_expr(cond_ast)
-            if run_while.type() == Type.INT:
-                run_while = Interpreter.__int_to_bool(run_while)
-            if run_while.type() != Type.BOOL:
+    def __do_if(self, if_ast):
+        cond_ast = if_ast.condition
+        eval_cond = self.quickened.get(cond_ast) or self.expr_handlers[cond_ast.elem_type]
+        result = eval_cond(cond_ast)
+        if result.t is not Type.BOOL:
+            if result.t is not Type.INT:
                 super().error(
                     ErrorType.TYPE_ERROR,
-                    "Incompatible type for while condition",
+                    "Incompatible type for if condition",
                 )
-            if run_while.value():
-                statements = while_ast.get("statements")
-                status, return_val = self.__run_statements(statements)
-                if status == ExecStatus.RETURN:
-                    return status, return_val
+            result = Interpreter.__int_to_bool(result)
+        if result.v:
+            return self.__run_statements(if_ast.statements)
+        else_statements = if_ast.else_statements
+        if else_statements is not None:
+            return self.__run_statements(else_statements)
+        return None
 
-        return (ExecStatus.CONTINUE, Interpreter.NIL_VALUE)
+    def __do_while(self, while_ast):
+        cond_ast = while_ast.condition
+        statements = while_ast.statements
+        while True:
+            eval_cond = self.quickened.get(cond_ast) or self.expr_handlers[cond_ast.elem_type]
+            run_while = eval_cond(cond_ast)
+            if run_while.t is not Type.BOOL:
+                if run_while.t is not Type.INT:
+                    super().error(
+                        ErrorType.TYPE_ERROR,
+                        "Incompatible type for while condition",
+                    )
+                run_while = Interpreter.__int_to_bool(run_while)
+            if not run_while.v:
+                return None
+            return_val = self.__run_statements(statements)
+            if return_val is not None:
+                return return_val
 
     def __do_return(self, return_ast):
-        expr_ast = return_ast.get("expression")
+        expr_ast = return_ast.expression
         if expr_ast is None:
-            return (ExecStatus.RETURN, Interpreter.NIL_VALUE)
-        value_obj = copy.deepcopy(self.__eval_expr(expr_ast))
-        return (ExecStatus.RETURN, value_obj)
+            return Interpreter.NIL_VALUE
+        eval_expr = self.quickened.get(expr_ast) or self.expr_handlers[expr_ast.elem_type]
+        if (
+            expr_ast.elem_type == InterpreterBase.FCALL_DEF
+            or expr_ast.elem_type == InterpreterBase.MCALL_DEF
+        ):
+            # the function called is returned as a TailCall (unless it's
+            # print/inputi); what it returns is already a copy
+            self.tail_call = expr_ast
+            value_obj = eval_expr(expr_ast)
+            self.tail_call = None
+            if value_obj.__class__ is TailCall:
+                return value_obj
+        else:
+            value_obj = eval_expr(expr_ast)
+            # a variable's Value is updated in place by later assignments, so
+            # the caller gets its own copy of it
+            if expr_ast.elem_type == InterpreterBase.VAR_DEF:
+                return copy_value(value_obj)
+        if value_obj.t is Type.CLOSURE or value_obj.t is Type.OBJECT:
+            value_obj = copy_value(value_obj)
+        return value_obj
 
 def main():
     program = """
@@ -0,0 +1,515 @@
+from intbase import InterpreterBase, ErrorType
+from type_valuev4 import Type, Value
+
+
+# The NativeCompiler translates brewin functions into python source code and
+# compiles it with compile(), so simple functions (arithmetic, loops, print)
+# run as ordinary python functions instead of being interpreted.
+#
+# Primitives are represented by the python objects themselves: ints, bools,
+# strings and None for nil.  A function is only translated if it uses nothing
+# but those (no lambdas, objects, methods or calls to functions that can't be
+# translated); everything else keeps running on the tree-walking interpreter.
+#
+# Brewin scoping is dynamic, so which names are really local to a call is only
+# known when the function is called.  Each variable of a translated function is
+# one of:
+#   RAW   - a by-value parameter, held in a python local
+#   CELL  - a Value that already exists when the function is called (ref
+#           parameters, captured variables, variables of the callers); it is
+#           read and updated in place, just like the interpreter does
+#   LOCAL - a variable the call creates itself, held in a python local
+# A separate python function is generated for each combination of kinds that
+# a brewin function is called with.
+class NativeCompiler:
+    RAW = 0
+    CELL = 1
+    LOCAL = 2
+
+    PRIMITIVE_TYPES = {Type.INT, Type.BOOL, Type.STRING, Type.NIL}
+    MAX_EXPR_DEPTH = 40
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.env = interpreter.env
+        self.func_name_to_ast = interpreter.func_name_to_ast
+        self.runtime = _NativeRuntime(interpreter)
+        self.namespace = self.runtime.namespace()
+        # func/lambda Element -> _Translation, or None if it can't be translated
+        self.translations = {}
+        self.__translate_functions()
+
+    # runs func_ast natively if possible, with new_env holding the Value objects
+    # of its parameters and captured variables.  Returns the resulting Value, or
+    # None if the call has to be run by the interpreter instead.
+    def call(self, func_ast, new_env):
+        translation = self.translations.get(func_ast, False)
+        if translation is False:
+            translation = self.__analyze(func_ast)
+            if translation is not None and not self.__calls_supported(translation):
+                translation = None
+            self.translations[func_ast] = translation
+        if translation is None:
+            return None
+
+        kinds = []
+        args = []
+        for var_name in translation.names:
+            value_obj = new_env.get(var_name)
+            if value_obj is None:
+                value_obj = self.env.get(var_name)
+                if value_obj is None:
+                    kinds.append(NativeCompiler.LOCAL)
+                    continue
+            if value_obj.t not in NativeCompiler.PRIMITIVE_TYPES:
+                return None
+            if var_name in translation.value_params:
+                kinds.append(NativeCompiler.RAW)
+                args.append(value_obj.v)
+            else:
+                kinds.append(NativeCompiler.CELL)
+                args.append(value_obj)
+
+        kinds = tuple(kinds)
+        native_func = translation.variants.get(kinds)
+        if native_func is None:
+            native_func = self.__generate(translation, kinds)
+            if native_func is None:
+                self.translations[func_ast] = None
+                return None
+            translation.variants[kinds] = native_func
+        return self.runtime.to_value(native_func(*args))
+
+    # table functions whose variables are all by-value parameters can be
+    # called directly from other translated functions, since they can't see
+    # or change any variables of their callers
+    def __translate_functions(self):
+        candidates = {}
+        for name, funcs in self.func_name_to_ast.items():
+            for num_params, closure in funcs.items():
+                translation = self.__analyze(closure.func_ast)
+                if translation is not None:
+                    candidates[(name, num_params)] = translation
+
+        # a function python fails to compile can't be translated at all, and
+        # the direct calls are worked out again without it
+        while True:
+            failed = self.__generate_direct_calls(candidates)
+            if failed is None:
+                break
+            del candidates[failed]
+        for key, translation in candidates.items():
+            if self.__calls_supported(translation):
+                self.translations[translation.func_ast] = translation
+            else:
+                self.translations[translation.func_ast] = None
+
+    # generates the functions that can be called directly, and returns the key
+    # of the first one that doesn't compile, if any
+    def __generate_direct_calls(self, candidates):
+        self.direct_calls = {
+            key
+            for key, translation in candidates.items()
+            if set(translation.names) <= translation.value_params
+        }
+        # drop functions that call something that can't be called directly,
+        # until every remaining function only calls remaining functions
+        changed = True
+        while changed:
+            changed = False
+            for key in list(self.direct_calls):
+                if not candidates[key].calls <= self.direct_calls:
+                    self.direct_calls.discard(key)
+                    changed = True
+
+        for name, num_params in self.direct_calls:
+            native_name = _direct_call_name(name, num_params)
+            closure = self.func_name_to_ast[name][num_params]
+            translation = candidates[(name, num_params)]
+            kinds = (NativeCompiler.RAW,) * len(translation.names)
+            self.namespace["_cl" + native_name] = closure
+            self.namespace[native_name] = None  # filled in by __generate
+            native_func = self.__generate(translation, kinds, native_name)
+            if native_func is None:
+                return (name, num_params)
+            translation.variants[kinds] = native_func
+        return None
+
+    def __calls_supported(self, translation):
+        return translation.calls <= self.direct_calls
+
+    def __analyze(self, func_ast):
+        translation = _Translation(func_ast)
+        # parameters come first, in order, which is also the signature used for
+        # direct calls
+        for arg in func_ast.get("args"):
+            translation.add_name(arg.get("name"))
+            if arg.elem_type != InterpreterBase.REFARG_DEF:
+                translation.value_params.add(arg.get("name"))
+        try:
+            self.__analyze_statements(func_ast.get("statements"), translation)
+        except _Untranslatable:
+            return None
+        for var_name in translation.names:
+            if var_name in self.func_name_to_ast:
+                return None
+        return translation
+
+    def __analyze_statements(self, statements, translation):
+        for statement in statements:
+            elem_type = statement.elem_type
+            if elem_type == "=":
+                translation.add_name(statement.get("name"), statement.get("field"))
+                self.__analyze_expr(statement.get("expression"), translation)
+            elif elem_type == InterpreterBase.FCALL_DEF:
+                self.__analyze_expr(statement, translation)
+            elif elem_type == InterpreterBase.RETURN_DEF:
+                if statement.get("expression") is not None:
+                    self.__analyze_expr(statement.get("expression"), translation)
+            elif elem_type == InterpreterBase.IF_DEF:
+                self.__analyze_expr(statement.get("condition"), translation)
+                self.__analyze_statements(statement.get("statements"), translation)
+                if statement.get("else_statements") is not None:
+                    self.__analyze_statements(statement.get("else_statements"), translation)
+            elif elem_type == InterpreterBase.WHILE_DEF:
+                self.__analyze_expr(statement.get("condition"), translation)
+                self.__analyze_statements(statement.get("statements"), translation)
+            elif elem_type == InterpreterBase.MCALL_DEF:
+                raise _Untranslatable()
+            # other expression statements are never evaluated
+
+    # the generated code nests a few parentheses per operator, and python
+    # only parses up to 200 of them, so deeper expressions aren't translated
+    def __analyze_expr(self, expr_ast, translation, depth=0):
+        if depth > NativeCompiler.MAX_EXPR_DEPTH:
+            raise _Untranslatable()
+        depth += 1
+        elem_type = expr_ast.elem_type
+        if elem_type in _Codegen.CONSTANT_TYPES:
+            return
+        if elem_type == InterpreterBase.VAR_DEF:
+            translation.add_name(expr_ast.get("name"), expr_ast.get("field"))
+        elif elem_type in _Codegen.BINARY_OPS:
+            self.__analyze_expr(expr_ast.get("op1"), translation, depth)
+            self.__analyze_expr(expr_ast.get("op2"), translation, depth)
+        elif elem_type == InterpreterBase.NEG_DEF or elem_type == InterpreterBase.NOT_DEF:
+            self.__analyze_expr(expr_ast.get("op1"), translation, depth)
+        elif elem_type == InterpreterBase.FCALL_DEF:
+            args = expr_ast.get("args")
+            func_name = expr_ast.get("name")
+            if func_name == "inputi" and len(args) > 1:
+                raise _Untranslatable()
+            if func_name != "print" and func_name != "inputi":
+                if len(args) not in self.func_name_to_ast.get(func_name, {}):
+                    raise _Untranslatable()
+                translation.calls.add((func_name, len(args)))
+            for arg in args:
+                self.__analyze_expr(arg, translation, depth)
+        else:
+            raise _Untranslatable()
+
+    # returns the python function for one variant, or None if python can't
+    # compile it (e.g. its blocks are nested too deeply)
+    def __generate(self, translation, kinds, native_name=None):
+        codegen = _Codegen(translation, dict(zip(translation.names, kinds)))
+        source = codegen.generate(native_name or "_native")
+        try:
+            code = compile(source, f"<brewin {translation.func_ast.get('name')}>", "exec")
+        except (SyntaxError, RecursionError, MemoryError):
+            return None
+        local_namespace = {}
+        exec(code, self.namespace, local_namespace)
+        native_func = local_namespace[native_name or "_native"]
+        if native_name is not None:
+            self.namespace[native_name] = native_func
+        return native_func
+
+
+class _Untranslatable(Exception):
+    pass
+
+
+def _direct_call_name(func_name, num_params):
+    return f"_fn_{func_name}_{num_params}"
+
+
+# What the analysis learned about one func/lambda, plus its generated variants
+class _Translation:
+    def __init__(self, func_ast):
+        self.func_ast = func_ast
+        self.names = []  # every variable name used, in order of appearance
+        self.value_params = set()
+        self.calls = set()  # (name, # of args) of the user functions called
+        self.variants = {}  # tuple of kinds -> python function
+
+    # fields (var_name.field) aren't translated
+    def add_name(self, var_name, field=None):
+        if field is not None:
+            raise _Untranslatable()
+        if var_name not in self.names:
+            self.names.append(var_name)
+
+
+# Generates the python source for one variant of a translated function
+class _Codegen:
+    CONSTANT_TYPES = {
+        InterpreterBase.INT_DEF,
+        InterpreterBase.STRING_DEF,
+        InterpreterBase.BOOL_DEF,
+        InterpreterBase.NIL_DEF,
+    }
+    ARITH_OPS = {"+": "+", "-": "-", "*": "*", "/": "//", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+    BINARY_OPS = {"+", "-", "*", "/", "<", "<=", ">", ">=", "==", "!=", "&&", "||"}
+
+    def __init__(self, translation, kinds):
+        self.translation = translation
+        self.kinds = kinds
+        self.lines = []
+        self.indent = 1
+        self.num_temps = 0
+        # LOCAL variables that are guaranteed to exist at the current point
+        self.bound = set()
+
+    def generate(self, func_name):
+        params = [
+            ("v_" if kind == NativeCompiler.RAW else "c_") + var_name
+            for var_name, kind in self.kinds.items()
+            if kind != NativeCompiler.LOCAL
+        ]
+        self.__block(self.translation.func_ast.get("statements"))
+        self.__line("return None")
+        header = f"def {func_name}({', '.join(params)}):"
+        return "\n".join([header] + self.lines) + "\n"
+
+    def __line(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def __temp(self):
+        self.num_temps += 1
+        return f"_t{self.num_temps}"
+
+    # variables created inside a block disappear when the block ends
+    def __block(self, statements):
+        bound = set(self.bound)
+        self.__line("pass")
+        for statement in statements:
+            self.__statement(statement)
+        self.bound = bound
+
+    def __statement(self, statement):
+        elem_type = statement.elem_type
+        if elem_type == "=":
+            self.__assign(statement.get("name"), self.__expr(statement.get("expression")))
+        elif elem_type == InterpreterBase.FCALL_DEF:
+            if statement.get("name") == "print":
+                self.__print(statement.get("args"))
+            else:
+                self.__line(self.__expr(statement))
+        elif elem_type == InterpreterBase.RETURN_DEF:
+            expr_ast = statement.get("expression")
+            self.__line("return None" if expr_ast is None else f"return {self.__expr(expr_ast)}")
+        elif elem_type == InterpreterBase.IF_DEF:
+            self.__line(f"if {self.__condition(statement.get('condition'), '_if_cond')}:")
+            self.indent += 1
+            self.__block(statement.get("statements"))
+            self.indent -= 1
+            if statement.get("else_statements") is not None:
+                self.__line("else:")
+                self.indent += 1
+                self.__block(statement.get("else_statements"))
+                self.indent -= 1
+        elif elem_type == InterpreterBase.WHILE_DEF:
+            self.__line("while True:")
+            self.indent += 1
+            cond = self.__condition(statement.get("condition"), "_while_cond")
+            self.__line(f"if not ({cond}):")
+            self.__line("    break")
+            self.__block(statement.get("statements"))
+            self.indent -= 1
+
+    def __assign(self, var_name, expr):
+        kind = self.kinds[var_name]
+        if kind == NativeCompiler.CELL:
+            temp = self.__temp()
+            self.__line(f"{temp} = {expr}")
+            self.__line(f"c_{var_name}.t = _type_of[type({temp})]")
+            self.__line(f"c_{var_name}.v = {temp}")
+            return
+        self.__line(f"v_{var_name} = {expr}")
+        self.bound.add(var_name)
+
+    # print evaluates and appends its arguments one at a time
+    def __print(self, args):
+        temp = self.__temp()
+        self.__line(f"{temp} = ''")
+        for arg in args:
+            self.__line(f"{temp} = {temp} + _printable({self.__expr(arg)})")
+        self.__line(f"_output({temp})")
+
+    def __condition(self, cond_ast, check):
+        temp = self.__temp()
+        expr = self.__expr(cond_ast)
+        return f"({temp} := {expr}) is True or ({temp} is not False and {check}({temp}))"
+
+    def __expr(self, expr_ast):
+        elem_type = expr_ast.elem_type
+        if elem_type == InterpreterBase.INT_DEF or elem_type == InterpreterBase.STRING_DEF:
+            return repr(expr_ast.get("val"))
+        if elem_type == InterpreterBase.BOOL_DEF:
+            return "True" if expr_ast.get("val") else "False"
+        if elem_type == InterpreterBase.NIL_DEF:
+            return "None"
+        if elem_type == InterpreterBase.VAR_DEF:
+            return self.__name(expr_ast.get("name"))
+        if elem_type == InterpreterBase.NEG_DEF:
+            temp = self.__temp()
+            return f"(-{temp} if type({temp} := {self.__expr(expr_ast.get('op1'))}) is int else _neg({temp}))"
+        if elem_type == InterpreterBase.NOT_DEF:
+            temp = self.__temp()
+            return f"(not {temp} if type({temp} := {self.__expr(expr_ast.get('op1'))}) is bool else _not({temp}))"
+        if elem_type == InterpreterBase.FCALL_DEF:
+            return self.__call(expr_ast)
+        return self.__binary_op(expr_ast)
+
+    def __name(self, var_name):
+        kind = self.kinds[var_name]
+        if kind == NativeCompiler.CELL:
+            return f"c_{var_name}.v"
+        if kind == NativeCompiler.LOCAL and var_name not in self.bound:
+            return f"_name_error({var_name!r})"
+        return f"v_{var_name}"
+
+    # both operands are always evaluated (left first), then the int/int or
+    # bool/bool case is handled inline and everything else by a helper
+    def __binary_op(self, expr_ast):
+        oper = expr_ast.elem_type
+        left = self.__temp()
+        right = self.__temp()
+        op1 = self.__expr(expr_ast.get("op1"))
+        op2 = self.__expr(expr_ast.get("op2"))
+        if oper in _Codegen.ARITH_OPS:
+            fast, fast_type, helper = f"{left} {_Codegen.ARITH_OPS[oper]} {right}", "int", "_arith"
+        elif oper == "==":
+            fast, fast_type, helper = f"{left} == {right}", "int", "_eq"
+        elif oper == "!=":
+            fast, fast_type, helper = f"{left} != {right}", "int", "_ne"
+        elif oper == "&&":
+            fast, fast_type, helper = f"({left} and {right})", "bool", "_logic"
+        else:
+            fast, fast_type, helper = f"({left} or {right})", "bool", "_logic"
+        return (
+            f"({fast} if (type({left} := {op1}) is {fast_type})"
+            f" & (type({right} := {op2}) is {fast_type})"
+            f" else {helper}({oper!r}, {left}, {right}))"
+        )
+
+    def __call(self, call_ast):
+        func_name = call_ast.get("name")
+        args = [self.__expr(arg) for arg in call_ast.get("args")]
+        if func_name == "print":
+            return f"_print_expr(({''.join(arg + ', ' for arg in args)}))"
+        if func_name == "inputi":
+            return f"_inputi({', '.join(args)})"
+        native_name = _direct_call_name(func_name, len(args))
+        return (
+            f"({native_name}({', '.join(args)}) if _cl{native_name}.type is _CLOSURE"
+            f" else _retyped({func_name!r}))"
+        )
+
+
+# Helpers the generated code calls for the uncommon cases; they follow the
+# same coercion rules and report the same errors as the interpreter
+class _NativeRuntime:
+    TYPE_OF = {int: Type.INT, bool: Type.BOOL, str: Type.STRING, type(None): Type.NIL}
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+
+    def namespace(self):
+        return {
+            "_type_of": _NativeRuntime.TYPE_OF,
+            "_CLOSURE": Type.CLOSURE,
+            "_arith": self.binary_op,
+            "_eq": self.eq,
+            "_ne": self.ne,
+            "_logic": self.binary_op,
+            "_neg": self.neg,
+            "_not": self.logical_not,
+            "_if_cond": self.if_cond,
+            "_while_cond": self.while_cond,
+            "_name_error": self.name_error,
+            "_retyped": self.retyped,
+            "_printable": self.printable,
+            "_output": self.interpreter.output,
+            "_print_expr": self.print_expr,
+            "_inputi": self.inputi,
+        }
+
+    def to_value(self, val):
+        return Value(_NativeRuntime.TYPE_OF[type(val)], val)
+
+    # operands the generated code doesn't handle itself go through the
+    # interpreter's bin_ops
+    def binary_op(self, oper, x, y):
+        type_of = _NativeRuntime.TYPE_OF
+        f = self.interpreter.bin_ops[(oper, type_of[type(x)], type_of[type(y)])]
+        return f(self.to_value(x), self.to_value(y)).v
+
+    @staticmethod
+    def eq(oper, x, y):
+        if type(x) is not int or type(y) is not int:
+            if type(x) is int or type(x) is bool:
+                x = 1 if x else 0
+            if type(y) is int or type(y) is bool:
+                y = 1 if y else 0
+        return x == y
+
+    @staticmethod
+    def ne(oper, x, y):
+        return not _NativeRuntime.eq(oper, x, y)
+
+    def neg(self, x):
+        self.interpreter.error(ErrorType.TYPE_ERROR, "Incompatible type for neg operation")
+
+    def logical_not(self, x):
+        if type(x) is int:
+            return x == 0
+        self.interpreter.error(ErrorType.TYPE_ERROR, "Incompatible type for ! operation")
+
+    def if_cond(self, x):
+        if type(x) is int:
+            return x != 0
+        self.interpreter.error(ErrorType.TYPE_ERROR, "Incompatible type for if condition")
+
+    def while_cond(self, x):
+        if type(x) is int:
+            return x != 0
+        self.interpreter.error(ErrorType.TYPE_ERROR, "Incompatible type for while condition")
+
+    def name_error(self, var_name):
+        self.interpreter.error(ErrorType.NAME_ERROR, f"Variable/function {var_name} not found")
+
+    def retyped(self, func_name):
+        self.interpreter.error(
+            ErrorType.TYPE_ERROR, f"Function {func_name} is changed to non-function type."
+        )
+
+    @staticmethod
+    def printable(x):
+        if type(x) is bool:
+            return "true" if x else "false"
+        if type(x) is int:
+            return str(x)
+        return x
+
+    def print_expr(self, args):
+        output = ""
+        for arg in args:
+            output = output + _NativeRuntime.printable(arg)
+        self.interpreter.output(output)
+        return None
+
+    def inputi(self, *args):
+        if args:
+            self.interpreter.output(_NativeRuntime.printable(args[0]))
+        return int(self.interpreter.get_input())
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import pickle
+import stat
+import tempfile
+from collections import OrderedDict
+
+from brewparse import parse_program
+
+
+# The ParseCache remembers the ast produced by parse_program for each source
+# program, so resubmitting an identical program skips lexing and parsing.
+# Entries are keyed by a hash of the source and kept in two tiers:
+#   - an in-process LRU whose total size (measured as the size of the pickled
+#     ast) is capped at max_bytes
+#   - optionally, a directory of pickled asts shared by every process that
+#     uses the same cache_dir
+# The asts handed out are shared between callers, which is fine since the
+# interpreters never modify them.
+#
+# The files in cache_dir are unpickled, which runs whatever code they say to,
+# so only the user running the cache may be able to write there: cache_dir is
+# created readable and writable by its owner only, and an existing directory
+# owned by another user or writable by anyone else is refused.
+class ParseCache:
+    # bump whenever the shape of the ast changes, so stale files are ignored
+    FORMAT_VERSION = 3
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+            ParseCache.__check_private(cache_dir)
+        self.entries = OrderedDict()  # key -> (ast, size in bytes)
+        self.total_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+
+    def parse(self, program):
+        key = self.__key(program)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.memory_hits += 1
+            return entry[0]
+
+        data = self.__read_file(key)
+        if data is not None:
+            try:
+                ast = pickle.loads(data)
+            except Exception:
+                ast = None
+            if ast is not None:
+                self.disk_hits += 1
+                self.__remember(key, ast, len(data))
+                return ast
+
+        self.misses += 1
+        ast = parse_program(program)
+        try:
+            data = pickle.dumps(ast, protocol=pickle.HIGHEST_PROTOCOL)
+        except (RecursionError, pickle.PicklingError):
+            # pickle recurses once per level of nesting, so very deep asts
+            # that parse and run fine can't be stored; they just aren't cached
+            self.uncacheable += 1
+            return ast
+        self.__write_file(key, data)
+        self.__remember(key, ast, len(data))
+        return ast
+
+    def stats(self):
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "uncacheable": self.uncacheable,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+        }
+
+    # drops the in-memory tier; files on disk are kept
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    @staticmethod
+    def __check_private(cache_dir):
+        st = os.stat(cache_dir)
+        if hasattr(os, "getuid") and st.st_uid != os.getuid():
+            raise ValueError(f"{cache_dir} is owned by another user")
+        if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise ValueError(f"{cache_dir} is writable by other users")
+
+    def __key(self, program):
+        digest = hashlib.sha256(program.encode("utf-8")).hexdigest()
+        return f"v{ParseCache.FORMAT_VERSION}-{digest}"
+
+    def __remember(self, key, ast, size):
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (ast, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+
+    def __path(self, key):
+        return os.path.join(self.cache_dir, key + ".pickle")
+
+    def __read_file(self, key):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self.__path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    # write to a temporary file first, so concurrent readers never see a
+    # partially written entry
+    def __write_file(self, key, data):
+        if self.cache_dir is None:
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.__path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,352 @@
+import re
+
+from element import (
+    Arg,
+    Assign,
+    BinOp,
+    Call,
+    Element,
+    Func,
+    If,
+    Lambda,
+    Literal,
+    MethodCall,
+    NewObject,
+    Nil,
+    Program,
+    Return,
+    UnaryOp,
+    Var,
+    While,
+)
+from intbase import InterpreterBase
+
+# A hand-written recursive-descent parser for the grammar in brewparse.py.
+# It builds exactly the same Element trees as the PLY parser, but walks the
+# token list directly instead of going through the generic LR tables, and
+# expressions are parsed by operator precedence using the same precedence
+# table.  Unlike PLY it never tries to recover from a syntax error: the first
+# one is reported and SyntaxError is raised.
+
+# token kinds: NUMBER, NAME and STRING, each keyword spelled as in the source
+# (e.g. "func"), and each operator/punctuation spelled as in the source
+_END = "$end"
+
+_KEYWORDS = frozenset(
+    ("func", "if", "else", "while", "return", "true", "false", "nil", "lambda", "ref")
+)
+
+# same rules, in the same order of precedence, as the PLY lexer in brewlex.py;
+# each match also swallows the ignored characters in front of the token
+_TOKEN_RE = re.compile(
+    "[ \t]*(?:"
+    + "|".join(
+        (
+            r"(?P<NUMBER>\d+)",
+            r"(?P<NAME>[A-Za-z_][\w_]*)",
+            r"(?P<newline>\n+)",
+            r"(?P<comment>/\*(?:.|\n)*?\*/)",
+            r'(?P<STRING>".*?")',
+            r"(?P<OP>\|\||&&|==|!=|>=|<=|[-+*/<>=(){},.;@!])",
+            r"(?P<illegal>[\s\S])",
+        )
+    )
+    + "|$)"
+)
+
+_BINARY_PRECEDENCE = {
+    "||": 1,
+    "&&": 2,
+    "==": 3,
+    "!=": 3,
+    "<": 3,
+    "<=": 3,
+    ">": 3,
+    ">=": 3,
+    "+": 4,
+    "-": 4,
+    "*": 5,
+    "/": 5,
+}
+
+
+# tokens that can come before an operand, and what they push on the operator
+# stack (see _Parser.__expression)
+_PREFIXES = {
+    "!": InterpreterBase.NOT_DEF,
+    "-": InterpreterBase.NEG_DEF,
+    "(": "(",
+}
+
+
+def _reduce(operator, operands):
+    if operator in _BINARY_PRECEDENCE:
+        right = operands.pop()
+        operands[-1] = BinOp(operator, operands[-1], right)
+    else:
+        operands[-1] = UnaryOp(operator, operands[-1])
+
+
+# exported function
+# errors are reported the same way as by the PLY lexer and parser, through
+# report (print by default)
+def parse_program(program, report=print):
+    kinds, values = _tokenize(program, report)
+    return _Parser(kinds, values, report).program()
+
+
+def _tokenize(program, report):
+    kinds = []
+    values = []
+    add_kind = kinds.append
+    add_value = values.append
+    for match in _TOKEN_RE.finditer(program):
+        kind = match.lastgroup
+        if kind == "OP":
+            text = match.group(kind)
+            add_kind(text)
+            add_value(text)
+        elif kind == "NAME":
+            text = match.group(kind)
+            add_kind(text if text in _KEYWORDS else kind)
+            add_value(text)
+        elif kind == "NUMBER":
+            add_kind(kind)
+            add_value(int(match.group(kind)))
+        elif kind == "STRING":
+            add_kind(kind)
+            add_value(match.group(kind)[1:-1])
+        elif kind == "illegal":
+            text = match.group(kind)
+            if text == '"':  # an unterminated string is a literal " token
+                add_kind(text)
+                add_value(text)
+            else:
+                report(f"Illegal character {text}")
+    # padding, so the parser can look a few tokens ahead without bounds checks
+    kinds.extend((_END,) * 4)
+    values.extend((None,) * 4)
+    return kinds, values
+
+
+class _Parser:
+    def __init__(self, kinds, values, report):
+        self.kinds = kinds
+        self.values = values
+        self.report = report
+        self.pos = 0
+
+    def program(self):
+        functions = [self.__func()]
+        while self.kinds[self.pos] != _END:
+            functions.append(self.__func())
+        return Program(functions)
+
+    def __error(self):
+        if self.kinds[self.pos] == _END:
+            self.report("Syntax error at EOF")
+        else:
+            self.report(f"Syntax error at '{self.values[self.pos]}'")
+        raise SyntaxError("Syntax error")
+
+    def __expect(self, kind):
+        if self.kinds[self.pos] != kind:
+            self.__error()
+        value = self.values[self.pos]
+        self.pos += 1
+        return value
+
+    def __func(self):
+        self.__expect("func")
+        name = self.__expect("NAME")
+        args = self.__formal_args()
+        statements = self.__statements()
+        return Func(name, args, statements)
+
+    def __lambda(self):
+        self.__expect("lambda")
+        args = self.__formal_args()
+        statements = self.__statements()
+        return Lambda(args, statements)
+
+    def __formal_args(self):
+        self.__expect("(")
+        args = []
+        if self.kinds[self.pos] != ")":
+            args.append(self.__formal_arg())
+            while self.kinds[self.pos] == ",":
+                self.pos += 1
+                args.append(self.__formal_arg())
+        self.__expect(")")
+        return args
+
+    def __formal_arg(self):
+        if self.kinds[self.pos] == "ref":
+            self.pos += 1
+            return Arg(InterpreterBase.REFARG_DEF, self.__expect("NAME"))
+        return Arg(InterpreterBase.ARG_DEF, self.__expect("NAME"))
+
+    # a braced list of one or more statements
+    def __statements(self):
+        self.__expect("{")
+        statements = [self.__statement()]
+        while self.kinds[self.pos] != "}":
+            statements.append(self.__statement())
+        self.pos += 1
+        return statements
+
+    def __statement(self):
+        kinds = self.kinds
+        pos = self.pos
+        kind = kinds[pos]
+        if kind == "NAME":
+            if kinds[pos + 1] == "=":
+                self.pos += 2
+                return self.__assign(self.values[pos])
+            if kinds[pos + 1] == "." and kinds[pos + 2] == "NAME" and kinds[pos + 3] == "=":
+                self.pos += 4
+                return self.__assign(self.values[pos], self.values[pos + 2])
+        elif kind == "if":
+            return self.__if()
+        elif kind == "while":
+            self.pos += 1
+            condition = self.__condition()
+            statements = self.__statements()
+            return While(condition, statements)
+        elif kind == "return":
+            self.pos += 1
+            expression = None
+            if kinds[self.pos] != ";":
+                expression = self.__expression()
+            self.__expect(";")
+            return Return(expression)
+        expression = self.__expression()
+        self.__expect(";")
+        return expression
+
+    def __assign(self, name, field=None):
+        expression = self.__expression()
+        self.__expect(";")
+        return Assign(name, expression, field)
+
+    def __if(self):
+        self.pos += 1
+        condition = self.__condition()
+        statements = self.__statements()
+        else_statements = None
+        if self.kinds[self.pos] == "else":
+            self.pos += 1
+            else_statements = self.__statements()
+        return If(condition, statements, else_statements)
+
+    def __condition(self):
+        self.__expect("(")
+        condition = self.__expression()
+        self.__expect(")")
+        return condition
+
+    # Parentheses, unary operators and binary operators are parsed with
+    # explicit stacks rather than by recursion, so generated programs can
+    # nest them as deeply as PLY allows.  operators holds "(", the elem_type
+    # of unary operators (which bind tighter than any binary operator) and
+    # binary operators waiting for their right operand; all binary operators
+    # are left-associative.
+    def __expression(self):
+        kinds = self.kinds
+        operands = []
+        operators = []
+        while True:
+            kind = kinds[self.pos]
+            while kind in _PREFIXES:
+                operators.append(_PREFIXES[kind])
+                self.pos += 1
+                kind = kinds[self.pos]
+            operands.append(self.__primary())
+
+            while True:
+                op = kinds[self.pos]
+                prec = _BINARY_PRECEDENCE.get(op)
+                if prec is not None:
+                    while operators and operators[-1] != "(":
+                        top_prec = _BINARY_PRECEDENCE.get(operators[-1])
+                        if top_prec is not None and top_prec < prec:
+                            break
+                        _reduce(operators.pop(), operands)
+                    operators.append(op)
+                    self.pos += 1
+                    break
+                while operators and operators[-1] != "(":
+                    _reduce(operators.pop(), operands)
+                if not operators:
+                    return operands[0]
+                # the innermost parenthesized expression ends here
+                self.__expect(")")
+                operators.pop()
+
+    def __primary(self):
+        kinds = self.kinds
+        pos = self.pos
+        kind = kinds[pos]
+        if kind == "NAME":
+            name = self.values[pos]
+            if kinds[pos + 1] == "(":
+                self.pos += 1
+                return Call(name, self.__args())
+            if kinds[pos + 1] == ".":
+                self.pos += 2
+                field = self.__expect("NAME")
+                if kinds[self.pos] == "(":
+                    args = self.__args()
+                    return MethodCall(name, field, args)
+                return Var(name, field)
+            self.pos += 1
+            return Var(name)
+        if kind == "NUMBER":
+            self.pos += 1
+            return Literal(InterpreterBase.INT_DEF, self.values[pos])
+        if kind == "STRING":
+            self.pos += 1
+            return Literal(InterpreterBase.STRING_DEF, self.values[pos])
+        if kind == "true" or kind == "false":
+            self.pos += 1
+            return Literal(InterpreterBase.BOOL_DEF, kind == InterpreterBase.TRUE_DEF)
+        if kind == "nil":
+            self.pos += 1
+            return Nil()
+        if kind == "@":
+            self.pos += 1
+            return NewObject()
+        if kind == "lambda":
+            return self.__lambda()
+        self.__error()
+
+    def __args(self):
+        self.__expect("(")
+        args = []
+        if self.kinds[self.pos] != ")":
+            args.append(self.__expression())
+            while self.kinds[self.pos] == ",":
+                self.pos += 1
+                args.append(self.__expression())
+        self.__expect(")")
+        return args
+
+
+# structural comparison of two asts, used to check this parser against PLY;
+# the pairs of nodes left to compare are kept on a list, so deep asts don't
+# recurse
+def same_ast(a, b):
+    pending = [(a, b)]
+    while pending:
+        a, b = pending.pop()
+        if isinstance(a, Element):
+            if type(a) is not type(b) or a.elem_type != b.elem_type:
+                return False
+            pending.extend((getattr(a, key), getattr(b, key)) for key in a.fields)
+        elif isinstance(a, list):
+            if not isinstance(b, list) or len(a) != len(b):
+                return False
+            pending.extend(zip(a, b))
+        elif type(a) is not type(b) or a != b:
+            return False
+    return True
@@ -0,0 +1,223 @@
+from intbase import InterpreterBase
+
+# assign statements whose variable is known to be new, so it can be created in
+# the current block without searching the environment first
+CREATE = -1
+
+
+# Brewin is dynamically scoped: a function runs on top of its caller's frames,
+# so most names can only be found by searching the environment by name at run
+# time.  Some names are always found in a known frame of the running function
+# though:
+#   - parameters live in the function's own frame (the one holding its
+#     captured variables and parameters), since no block inside the function
+#     can create another variable with the same name
+#   - when main is the entry point, nothing runs below it, so a variable it
+#     assigns that isn't bound yet is created in the current block and stays
+#     there until that block ends
+# resolve() finds those names and returns a dict mapping each var, assign, fcall
+# and mcall node that uses one to the number of frames between the top of the
+# environment and the frame holding the variable (CREATE for assignments that
+# create a new variable).  Any node that isn't in the dict is looked up by
+# name as before.
+#
+# It also returns the set of the ids of the blocks (statement lists) that run
+# without a frame of their own.  A block can only create a variable by
+# assigning a name that isn't bound yet (variables created by the functions it
+# calls are in their own frames), so a block whose assignments all set names
+# that are known to be bound when it runs would always have an empty frame.
+# Names are known to be bound if they are parameters or have been assigned
+# earlier in an enclosing block, since nothing unbinds a variable before the
+# block it was found in ends.
+def resolve(func_ast, entry=False):
+    resolver = _Resolver(entry)
+    bound = {arg.name: 0 for arg in func_ast.get("args")}
+    resolver.block(func_ast.get("statements"), bound, set(), 0)
+    return resolver.addresses, resolver.unscoped
+
+
+class _Resolver:
+    def __init__(self, entry):
+        self.entry = entry
+        self.addresses = {}
+        self.unscoped = set()
+
+    # bound maps each name known to be bound to the level of the frame that
+    # holds it: 0 for the function's own frame, 1 for its outermost block, ...
+    # (blocks without a frame don't count); assigned holds the other names
+    # known to be bound, whose frame isn't known.  level is the level of the
+    # frame the block runs in if it doesn't get its own.
+    def block(self, statements, bound, assigned, level):
+        if all(
+            statement.elem_type != "="
+            or statement.field is not None
+            or statement.name in bound
+            or statement.name in assigned
+            for statement in statements
+        ):
+            self.unscoped.add(id(statements))
+        else:
+            level += 1
+        # variables created in this block go away with it
+        bound = dict(bound)
+        assigned = set(assigned)
+        for statement in statements:
+            elem_type = statement.elem_type
+            if elem_type == "=":
+                self.__assign(statement, bound, assigned, level)
+            elif elem_type == InterpreterBase.IF_DEF:
+                self.expression(statement.condition, bound, level)
+                self.block(statement.statements, bound, assigned, level)
+                if statement.else_statements is not None:
+                    self.block(statement.else_statements, bound, assigned, level)
+            elif elem_type == InterpreterBase.WHILE_DEF:
+                self.expression(statement.condition, bound, level)
+                self.block(statement.statements, bound, assigned, level)
+            elif elem_type == InterpreterBase.RETURN_DEF:
+                if statement.expression is not None:
+                    self.expression(statement.expression, bound, level)
+            else:
+                self.expression(statement, bound, level)
+
+    def __assign(self, assign_ast, bound, assigned, level):
+        name = assign_ast.name
+        if assign_ast.field is not None:
+            if name in bound:
+                self.addresses[assign_ast] = level - bound[name]
+            self.expression(assign_ast.expression, bound, level)
+            return
+        self.expression(assign_ast.expression, bound, level)
+        if name in bound:
+            self.addresses[assign_ast] = level - bound[name]
+        elif self.entry:
+            self.addresses[assign_ast] = CREATE
+            bound[name] = level
+        else:
+            assigned.add(name)
+
+    def expression(self, expr_ast, bound, level):
+        elem_type = expr_ast.elem_type
+        if elem_type == InterpreterBase.VAR_DEF:
+            if expr_ast.name in bound:
+                self.addresses[expr_ast] = level - bound[expr_ast.name]
+        elif elem_type == InterpreterBase.FCALL_DEF:
+            # only used if there is no function with the name
+            if expr_ast.name in bound:
+                self.addresses[expr_ast] = level - bound[expr_ast.name]
+            for arg in expr_ast.args:
+                self.expression(arg, bound, level)
+        elif elem_type == InterpreterBase.MCALL_DEF:
+            if expr_ast.objref in bound:
+                self.addresses[expr_ast] = level - bound[expr_ast.objref]
+            for arg in expr_ast.args:
+                self.expression(arg, bound, level)
+        elif expr_ast.get("op1") is not None:
+            self.expression(expr_ast.op1, bound, level)
+            if expr_ast.get("op2") is not None:
+                self.expression(expr_ast.op2, bound, level)
+        # lambdas are resolved separately, when they are called
+
+
+# Works out which variables a lambda has to capture when it is created.  A
+# lambda can only observe the captured variables it (or a lambda nested in
+# it) names, plus those named by the functions it calls, since they run on top
+# of its frame.  If it calls something that can't be known statically (a
+# closure stored in a variable, or a method), everything is captured.
+class CaptureAnalysis:
+    def __init__(self, functions):
+        self.functions = {}  # name -> func defs with that name
+        for func_def in functions:
+            self.functions.setdefault(func_def.name, []).append(func_def)
+        self.summaries = {}  # func/lambda ast -> (names, called functions, unknown call)
+        self.captures = {}  # lambda ast -> frozenset of names, or None for all
+
+    # returns the names a closure created from lambda_ast has to capture, or
+    # None if it has to capture all of them
+    def names(self, lambda_ast):
+        if lambda_ast in self.captures:
+            return self.captures[lambda_ast]
+        captures = self.__captures(lambda_ast)
+        self.captures[lambda_ast] = captures
+        return captures
+
+    def __captures(self, lambda_ast):
+        names, callees, unknown_call = self.__summary(lambda_ast)
+        if unknown_call:
+            return None
+        names = set(names)
+        seen = set()
+        while callees:
+            func_name = callees.pop()
+            if func_name in seen:
+                continue
+            seen.add(func_name)
+            for func_def in self.functions[func_name]:
+                func_names, func_callees, unknown_call = self.__summary(func_def)
+                if unknown_call:
+                    return None
+                names |= func_names
+                callees.extend(func_callees)
+        # parameters always get their value from the call
+        names.difference_update(arg.name for arg in lambda_ast.args)
+        return frozenset(names)
+
+    def __summary(self, func_ast):
+        summary = self.summaries.get(func_ast)
+        if summary is None:
+            summary = _Summary(self.functions)
+            summary.statements(func_ast.statements)
+            summary = (frozenset(summary.names), summary.callees, summary.unknown_call)
+            self.summaries[func_ast] = summary
+        return (summary[0], list(summary[1]), summary[2])
+
+
+# collects the variable names used in a function body (including the bodies of
+# its lambdas) and the functions it calls.  The nodes are visited from a work
+# list rather than recursively, so the stack evaluator can create closures for
+# arbitrarily deep code.
+class _Summary:
+    def __init__(self, functions):
+        self.functions = functions
+        self.names = set()
+        self.callees = []
+        self.unknown_call = False
+
+    def statements(self, statements):
+        nodes = list(statements)
+        while nodes:
+            node = nodes.pop()
+            elem_type = node.elem_type
+            if elem_type == "=":
+                self.names.add(node.name)
+                nodes.append(node.expression)
+            elif elem_type == InterpreterBase.IF_DEF:
+                nodes.append(node.condition)
+                nodes.extend(node.statements)
+                if node.else_statements is not None:
+                    nodes.extend(node.else_statements)
+            elif elem_type == InterpreterBase.WHILE_DEF:
+                nodes.append(node.condition)
+                nodes.extend(node.statements)
+            elif elem_type == InterpreterBase.RETURN_DEF:
+                if node.expression is not None:
+                    nodes.append(node.expression)
+            elif elem_type == InterpreterBase.VAR_DEF:
+                self.names.add(node.name)
+            elif elem_type == InterpreterBase.FCALL_DEF:
+                name = node.name
+                if name in self.functions:
+                    self.callees.append(name)
+                elif name != "print" and name != "inputi":
+                    self.names.add(name)
+                    self.unknown_call = True
+                nodes.extend(node.args)
+            elif elem_type == InterpreterBase.MCALL_DEF:
+                self.names.add(node.objref)
+                self.unknown_call = True
+                nodes.extend(node.args)
+            elif elem_type == InterpreterBase.LAMBDA_DEF:
+                nodes.extend(node.statements)
+            elif node.get("op1") is not None:
+                nodes.append(node.op1)
+                if node.get("op2") is not None:
+                    nodes.append(node.op2)
@@ -0,0 +1,531 @@
+from intbase import InterpreterBase, ErrorType
+from type_valuev4 import (
+    Closure,
+    FieldCache,
+    Object,
+    Type,
+    Value,
+    copy_value,
+    get_printable,
+)
+
+
+# The StackEvaluator walks the ast like the tree-walking interpreter, but
+# without recursing: the work left to do is kept on an explicit stack of
+# (function, argument) tasks, and the Values of evaluated expressions on a
+# value stack.  A node's task pushes the tasks for its children followed by
+# the task that finishes the node once their Values are on the value stack.
+# The depth of nesting and recursion is then only limited by memory, and
+# running a program can be stopped between any two tasks and resumed later
+# (see start() and resume()).
+#
+# Leaves (constants and names) don't get tasks of their own: their Values are
+# worked out by the task that needs them, at the point where a task for them
+# would have run, and a statement's expression is evaluated right away instead
+# of from a task of its own.
+# Nothing else is evaluated inline, so Python never recurses more than one
+# expression deep.
+#
+# A return drops the tasks left in the function by cutting the task stack back
+# to where it was when the call started.  Programs produce the same output and
+# errors as the tree-walking interpreter.
+class StackEvaluator:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.env = interpreter.env
+        self.func_name_to_ast = interpreter.func_name_to_ast
+        self.bin_ops = interpreter.bin_ops
+        self.trace_output = interpreter.trace_output
+        self.tasks = []  # (function, argument) pairs left to run, next one last
+        self.values = []
+        # (number of tasks, number of environment frames) when each of the
+        # calls being run started
+        self.calls = []
+        self.field_caches = {}  # ast of a field access or method call -> FieldCache
+        self.statement_handlers = {
+            InterpreterBase.FCALL_DEF: self.__run_call,
+            InterpreterBase.MCALL_DEF: self.__run_call,
+            "=": self.__run_assign,
+            InterpreterBase.RETURN_DEF: self.__run_return,
+            InterpreterBase.IF_DEF: self.__run_if,
+            InterpreterBase.WHILE_DEF: self.__run_while,
+        }
+        self.expr_handlers = {
+            InterpreterBase.NIL_DEF: self.__eval_nil,
+            InterpreterBase.INT_DEF: self.__eval_int,
+            InterpreterBase.STRING_DEF: self.__eval_string,
+            InterpreterBase.BOOL_DEF: self.__eval_bool,
+            InterpreterBase.VAR_DEF: self.__eval_name,
+            InterpreterBase.FCALL_DEF: self.__eval_call,
+            InterpreterBase.MCALL_DEF: self.__eval_method_call,
+            InterpreterBase.NEG_DEF: self.__eval_neg,
+            InterpreterBase.NOT_DEF: self.__eval_not,
+            InterpreterBase.LAMBDA_DEF: self.__eval_lambda,
+            InterpreterBase.OBJ_DEF: self.__eval_object,
+        }
+        for oper in interpreter.BIN_OPS:
+            self.expr_handlers[oper] = self.__eval_op
+        # the expressions whose Values are worked out without a task
+        self.leaf_values = {
+            InterpreterBase.NIL_DEF: self.__nil_value,
+            InterpreterBase.INT_DEF: self.__int_value,
+            InterpreterBase.STRING_DEF: self.__string_value,
+            InterpreterBase.BOOL_DEF: self.__bool_value,
+            InterpreterBase.VAR_DEF: self.__name_value,
+        }
+        # other expressions used as statements aren't evaluated; anything else
+        # isn't a statement, and fails with a KeyError
+        for expr_type in self.expr_handlers:
+            self.statement_handlers.setdefault(expr_type, self.__skip)
+
+    def run(self, main_func):
+        self.start(main_func)
+        self.resume()
+
+    # sets up running the statements of main() in the interpreter's current
+    # environment; resume() runs them
+    def start(self, main_func):
+        self.tasks.append((self.__end_call, None))
+        self.calls.append((len(self.tasks), self.env.depth()))
+        self.values.append(self.interpreter.NIL_VALUE)
+        self.__run_block(main_func.func_ast.statements)
+
+    # runs at most max_steps tasks (all of them if it's None) and returns
+    # whether the program has finished
+    def resume(self, max_steps=None):
+        tasks = self.tasks
+        if max_steps is None:
+            while tasks:
+                task, arg = tasks.pop()
+                task(arg)
+            return True
+        while tasks and max_steps > 0:
+            task, arg = tasks.pop()
+            task(arg)
+            max_steps -= 1
+        return not tasks
+
+    def __error(self, error_type, description):
+        self.interpreter.error(error_type, description)
+
+    def __push_expr(self, expr_ast):
+        self.tasks.append((self.expr_handlers[expr_ast.elem_type], expr_ast))
+
+    # statements
+
+    def __run_block(self, statements):
+        self.env.push()
+        tasks = self.tasks
+        tasks.append((self.__end_block, None))
+        if self.trace_output:
+            for statement in reversed(statements):
+                tasks.append((self.__trace_statement, statement))
+            return
+        statement_handlers = self.statement_handlers
+        for statement in reversed(statements):
+            tasks.append((statement_handlers[statement.elem_type], statement))
+
+    def __end_block(self, _):
+        self.env.pop()
+
+    def __trace_statement(self, statement):
+        print(statement)
+        self.statement_handlers[statement.elem_type](statement)
+
+    def __skip(self, statement):
+        pass
+
+    # calls whose result isn't used
+    def __run_call(self, call_ast):
+        self.tasks.append((self.__discard, None))
+        self.__push_expr(call_ast)
+
+    def __discard(self, _):
+        self.values.pop()
+
+    def __run_assign(self, assign_ast):
+        if assign_ast.field is not None:
+            # the object is looked up before the expression is evaluated
+            var_name = assign_ast.name
+            target_value_obj = self.env.get(var_name)
+            if target_value_obj is None:
+                self.__error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
+            if target_value_obj.t is not Type.OBJECT:
+                self.__error(ErrorType.TYPE_ERROR, f"Variable {var_name} is not an object")
+            cache = self.__field_cache(assign_ast, assign_ast.field)
+            expr_ast = assign_ast.expression
+            leaf = self.leaf_values.get(expr_ast.elem_type)
+            if leaf is not None:
+                src_value_obj = leaf(expr_ast)
+                cache.set(target_value_obj.v, Value(src_value_obj.t, src_value_obj.v))
+                return
+            self.tasks.append((self.__assign_field, (target_value_obj, cache)))
+            self.expr_handlers[expr_ast.elem_type](expr_ast)
+            return
+        expr_ast = assign_ast.expression
+        leaf = self.leaf_values.get(expr_ast.elem_type)
+        if leaf is not None:
+            self.__assign_value(assign_ast.name, leaf(expr_ast))
+            return
+        self.tasks.append((self.__assign, assign_ast.name))
+        self.expr_handlers[expr_ast.elem_type](expr_ast)
+
+    def __assign_field(self, target):
+        target_value_obj, cache = target
+        src_value_obj = self.values.pop()
+        cache.set(target_value_obj.v, Value(src_value_obj.t, src_value_obj.v))
+
+    def __assign(self, var_name):
+        self.__assign_value(var_name, self.values.pop())
+
+    def __assign_value(self, var_name, src_value_obj):
+        target_value_obj = self.env.get(var_name)
+        if target_value_obj is None:
+            self.env.set(var_name, Value(src_value_obj.t, src_value_obj.v))
+            return
+        # a closure assigned something else can't be called any more
+        if target_value_obj.t is Type.CLOSURE and src_value_obj.t is not Type.CLOSURE:
+            target_value_obj.v.retype(src_value_obj.t)
+        target_value_obj.set(src_value_obj)
+
+    def __run_return(self, return_ast):
+        if return_ast.expression is None:
+            self.__return(self.interpreter.NIL_VALUE)
+            return
+        expr_ast = return_ast.expression
+        leaf = self.leaf_values.get(expr_ast.elem_type)
+        if leaf is not None:
+            self.__return_value(leaf(expr_ast), expr_ast.elem_type)
+            return
+        self.tasks.append((self.__finish_return, expr_ast.elem_type))
+        self.expr_handlers[expr_ast.elem_type](expr_ast)
+
+    def __finish_return(self, elem_type):
+        self.__return_value(self.values.pop(), elem_type)
+
+    def __return_value(self, value_obj, elem_type):
+        # a variable's Value is updated in place by later assignments, so the
+        # caller gets its own copy of it
+        if (
+            elem_type == InterpreterBase.VAR_DEF
+            or value_obj.t is Type.CLOSURE
+            or value_obj.t is Type.OBJECT
+        ):
+            value_obj = copy_value(value_obj)
+        self.__return(value_obj)
+
+    # the rest of the function's tasks are dropped, up to its __end_call,
+    # which pops its environment frames
+    def __return(self, value_obj):
+        del self.tasks[self.calls[-1][0]:]
+        self.values[-1] = value_obj
+
+    def __condition(self, description):
+        result = self.values.pop()
+        if result.t is Type.BOOL:
+            return result.v
+        if result.t is Type.INT:
+            return result.v != 0
+        self.__error(ErrorType.TYPE_ERROR, description)
+
+    def __run_if(self, if_ast):
+        self.tasks.append((self.__finish_if, if_ast))
+        condition = if_ast.condition
+        self.expr_handlers[condition.elem_type](condition)
+
+    def __finish_if(self, if_ast):
+        if self.__condition("Incompatible type for if condition"):
+            self.__run_block(if_ast.statements)
+        elif if_ast.else_statements is not None:
+            self.__run_block(if_ast.else_statements)
+
+    def __run_while(self, while_ast):
+        self.tasks.append((self.__finish_while, while_ast))
+        condition = while_ast.condition
+        self.expr_handlers[condition.elem_type](condition)
+
+    # runs the body, then checks the condition again
+    def __finish_while(self, while_ast):
+        if self.__condition("Incompatible type for while condition"):
+            self.tasks.append((self.__run_while, while_ast))
+            self.__run_block(while_ast.statements)
+
+    # expressions
+
+    def __eval_nil(self, nil_ast):
+        self.values.append(self.interpreter.NIL_VALUE)
+
+    def __eval_int(self, int_ast):
+        self.values.append(Value(Type.INT, int_ast.val))
+
+    def __eval_string(self, string_ast):
+        self.values.append(Value(Type.STRING, string_ast.val))
+
+    def __eval_bool(self, bool_ast):
+        self.values.append(Value(Type.BOOL, bool_ast.val))
+
+    def __nil_value(self, nil_ast):
+        return self.interpreter.NIL_VALUE
+
+    def __int_value(self, int_ast):
+        return Value(Type.INT, int_ast.val)
+
+    def __string_value(self, string_ast):
+        return Value(Type.STRING, string_ast.val)
+
+    def __bool_value(self, bool_ast):
+        return Value(Type.BOOL, bool_ast.val)
+
+    def __eval_lambda(self, lambda_ast):
+        captures = self.interpreter.captures.names(lambda_ast)
+        self.values.append(Value(Type.CLOSURE, Closure(lambda_ast, self.env, captures)))
+
+    def __eval_object(self, obj_ast):
+        self.values.append(Value(Type.OBJECT, Object()))
+
+    def __eval_name(self, name_ast):
+        self.values.append(self.__lookup_name(name_ast))
+
+    def __field_cache(self, node, name):
+        cache = self.field_caches.get(node)
+        if cache is None:
+            cache = self.field_caches[node] = FieldCache(name)
+        return cache
+
+    def __name_value(self, name_ast):
+        if name_ast.field is None:
+            val = self.env.get(name_ast.name)
+            if val is not None:
+                return val
+        return self.__lookup_name(name_ast)
+
+    # ref is set when the Value is bound to a ref parameter
+    def __lookup_name(self, name_ast, ref=False):
+        var_name = name_ast.name
+        field = name_ast.field
+        if field is not None:
+            target_value_obj = self.env.get(var_name)
+            if target_value_obj is None:
+                self.__error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
+            if target_value_obj.t is not Type.OBJECT:
+                self.__error(ErrorType.TYPE_ERROR, f"Variable {var_name} is not an object")
+            if ref:
+                val = target_value_obj.v.get_field_ref(field)
+            else:
+                val = self.__field_cache(name_ast, field).get(target_value_obj.v)
+            if val is None:
+                self.__error(ErrorType.NAME_ERROR, "field not found")
+            return val
+        val = self.env.get(var_name)
+        if val is not None:
+            return val
+        candidate_funcs = self.func_name_to_ast.get(var_name)
+        if candidate_funcs is None:
+            self.__error(ErrorType.NAME_ERROR, f"Variable/function {var_name} not found")
+        if len(candidate_funcs) > 1:
+            self.__error(
+                ErrorType.NAME_ERROR,
+                f"Function {var_name} has multiple overloaded versions",
+            )
+        return Value(Type.CLOSURE, next(iter(candidate_funcs.values())))
+
+    # a leaf operand is evaluated where its task would have run: op1 right
+    # away, op2 once op1's Value is on the value stack
+    def __eval_op(self, arith_ast):
+        op1 = arith_ast.op1
+        op2 = arith_ast.op2
+        leaf_values = self.leaf_values
+        left = leaf_values.get(op1.elem_type)
+        right = leaf_values.get(op2.elem_type)
+        if left is None:
+            if right is None:
+                self.tasks.append((self.__finish_op, arith_ast.elem_type))
+                self.__push_expr(op2)
+            else:
+                self.tasks.append((self.__finish_leaf_op, arith_ast))
+            self.__push_expr(op1)
+            return
+        left_value_obj = left(op1)
+        if right is None:
+            self.values.append(left_value_obj)
+            self.tasks.append((self.__finish_op, arith_ast.elem_type))
+            self.__push_expr(op2)
+            return
+        right_value_obj = right(op2)
+        f = self.bin_ops[(arith_ast.elem_type, left_value_obj.t, right_value_obj.t)]
+        self.values.append(f(left_value_obj, right_value_obj))
+
+    def __finish_op(self, oper):
+        values = self.values
+        right_value_obj = values.pop()
+        left_value_obj = values[-1]
+        f = self.bin_ops[(oper, left_value_obj.t, right_value_obj.t)]
+        values[-1] = f(left_value_obj, right_value_obj)
+
+    def __finish_leaf_op(self, arith_ast):
+        values = self.values
+        left_value_obj = values[-1]
+        op2 = arith_ast.op2
+        right_value_obj = self.leaf_values[op2.elem_type](op2)
+        f = self.bin_ops[(arith_ast.elem_type, left_value_obj.t, right_value_obj.t)]
+        values[-1] = f(left_value_obj, right_value_obj)
+
+    def __eval_neg(self, arith_ast):
+        self.tasks.append((self.__finish_neg, None))
+        self.__push_expr(arith_ast.op1)
+
+    def __finish_neg(self, _):
+        value_obj = self.values[-1]
+        if value_obj.t is not Type.INT:
+            self.__error(ErrorType.TYPE_ERROR, "Incompatible type for neg operation")
+        self.values[-1] = Value(Type.INT, -1 * value_obj.v)
+
+    def __eval_not(self, arith_ast):
+        self.tasks.append((self.__finish_not, None))
+        self.__push_expr(arith_ast.op1)
+
+    def __finish_not(self, _):
+        value_obj = self.values[-1]
+        if value_obj.t is Type.INT:
+            self.values[-1] = Value(Type.BOOL, value_obj.v == 0)
+            return
+        if value_obj.t is not Type.BOOL:
+            self.__error(ErrorType.TYPE_ERROR, "Incompatible type for ! operation")
+        self.values[-1] = Value(Type.BOOL, not value_obj.v)
+
+    # calls
+
+    def __eval_call(self, call_ast):
+        func_name = call_ast.name
+        if func_name == "print":
+            # the output is built up on the value stack: each argument is
+            # added to it as soon as it's evaluated, before the next one can
+            # assign the variable it read or (if this one can't be printed)
+            # run at all
+            tasks = self.tasks
+            tasks.append((self.__finish_print, None))
+            for arg in reversed(call_ast.args):
+                tasks.append((self.__add_printable, None))
+                self.__push_expr(arg)
+            self.values.append("")
+            return
+        if func_name == "inputi":
+            # like the tree-walking interpreter, the arguments aren't
+            # evaluated if there are too many of them
+            if len(call_ast.args) > 1:
+                self.__error(
+                    ErrorType.NAME_ERROR, "No inputi() function that takes > 1 parameter"
+                )
+            self.tasks.append((self.__finish_input, len(call_ast.args)))
+            for arg in reversed(call_ast.args):
+                self.__push_expr(arg)
+            return
+
+        num_args = len(call_ast.args)
+        candidate_funcs = self.func_name_to_ast.get(func_name)
+        if candidate_funcs is not None:
+            target_closure = candidate_funcs.get(num_args)
+            if target_closure is None:
+                self.__error(
+                    ErrorType.NAME_ERROR,
+                    f"Function {func_name} taking {num_args} params not found",
+                )
+        else:
+            closure_val_obj = self.env.get(func_name)
+            if closure_val_obj is None:
+                self.__error(ErrorType.NAME_ERROR, f"Function {func_name} not found")
+            if closure_val_obj.t is not Type.CLOSURE:
+                self.__error(ErrorType.TYPE_ERROR, "Trying to call function with non-closure")
+            target_closure = closure_val_obj.v
+            if len(target_closure.func_ast.args) != num_args:
+                self.__error(ErrorType.TYPE_ERROR, "Invalid # of args to lambda")
+        if target_closure.type is not Type.CLOSURE:
+            self.__error(
+                ErrorType.TYPE_ERROR,
+                f"Function {func_name} is changed to non-function type.",
+            )
+        self.__call(target_closure, call_ast, {})
+
+    def __eval_method_call(self, call_ast):
+        var_obj = self.env.get(call_ast.objref)
+        if var_obj is None:
+            self.__error(ErrorType.NAME_ERROR, "Variable not found")
+        elif var_obj.t is not Type.OBJECT:
+            self.__error(ErrorType.TYPE_ERROR, "Variable is not an object")
+        method_obj = self.__field_cache(call_ast, call_ast.name).get(var_obj.v)
+        if method_obj is None:
+            self.__error(ErrorType.NAME_ERROR, "Method not found")
+        if method_obj.t is not Type.CLOSURE:
+            self.__error(ErrorType.TYPE_ERROR, "Method is changed to non-function type.")
+        target_closure = method_obj.v
+        if target_closure.type is not Type.CLOSURE:
+            self.__error(ErrorType.TYPE_ERROR, "Function is changed to non-function type.")
+        self.__call(target_closure, call_ast, {"this": var_obj})
+
+    # binds the arguments one at a time, in order, then runs the closure with
+    # new_env (already holding "this" for method calls) as its top-level scope
+    def __call(self, target_closure, call_ast, new_env):
+        target_ast = target_closure.func_ast
+        new_env.update(target_closure.captured_vars)
+        formal_args = target_ast.args
+        actual_args = call_ast.args
+        if len(actual_args) != len(formal_args):
+            self.__error(
+                ErrorType.NAME_ERROR,
+                f"Function {target_ast.get('name')} with {len(actual_args)} args not found",
+            )
+        tasks = self.tasks
+        tasks.append((self.__enter_call, (target_ast, new_env)))
+        for formal_ast, actual_ast in reversed(list(zip(formal_args, actual_args))):
+            if formal_ast.elem_type != InterpreterBase.REFARG_DEF:
+                tasks.append((self.__bind_copy, (formal_ast.name, new_env)))
+            elif actual_ast.elem_type == InterpreterBase.VAR_DEF:
+                tasks.append((self.__bind_name, (formal_ast.name, actual_ast, new_env)))
+                continue
+            else:
+                tasks.append((self.__bind_result, (formal_ast.name, new_env)))
+            self.__push_expr(actual_ast)
+
+    def __bind_copy(self, param):
+        arg_name, new_env = param
+        new_env[arg_name] = copy_value(self.values.pop())
+
+    # a ref parameter shares the variable (or field) passed to it
+    def __bind_name(self, param):
+        arg_name, name_ast, new_env = param
+        new_env[arg_name] = self.__lookup_name(name_ast, ref=True)
+
+    # the parameter is the only variable holding the result
+    def __bind_result(self, param):
+        arg_name, new_env = param
+        value_obj = self.values.pop()
+        new_env[arg_name] = Value(value_obj.t, value_obj.v)
+
+    # the call evaluates to nil unless a return replaces it (see __return)
+    def __enter_call(self, call):
+        func_ast, new_env = call
+        self.tasks.append((self.__end_call, None))
+        self.calls.append((len(self.tasks), self.env.depth()))
+        self.values.append(self.interpreter.NIL_VALUE)
+        self.env.push(new_env)
+        self.__run_block(func_ast.statements)
+
+    def __end_call(self, _):
+        _, depth = self.calls.pop()
+        self.env.truncate(depth)
+
+    # fails the same way as the tree-walking interpreter when the argument
+    # can't be printed (get_printable returns None)
+    def __add_printable(self, _):
+        values = self.values
+        value_obj = values.pop()
+        values[-1] = values[-1] + get_printable(value_obj)
+
+    def __finish_print(self, _):
+        self.interpreter.output(self.values[-1])
+        self.values[-1] = self.interpreter.NIL_VALUE
+
+    def __finish_input(self, num_args):
+        if num_args == 1:
+            self.interpreter.output(get_printable(self.values.pop()))
+        self.values.append(Value(Type.INT, int(self.interpreter.get_input())))
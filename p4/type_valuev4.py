@@ -1,5 +1,4 @@
-import copy
-
+import weakref
 from enum import Enum
 from intbase import InterpreterBase
 
@@ -13,20 +12,310 @@ class Type(Enum):
     NIL = 5
     OBJECT = 6
 
+    # members are singletons, so they can be hashed by identity, which is
+    # much cheaper than Enum's hash of the member name (types are used in
+    # dict keys on every operation)
+    __hash__ = object.__hash__
+
 
+# captures is the set of variable names the closure needs (see
+# resolverv4.CaptureAnalysis), or None to capture every variable in env
 class Closure:
-    def __init__(self, func_ast, env):
-        # deepcopy only the primitive types (int, bool, string, etc.)
-        self.captured_env = copy.deepcopy(env)
-        for idx, cur_env in enumerate(self.captured_env.environment):
-            for var_name, value in cur_env.items():
-                if value.t == Type.CLOSURE or value.t == Type.OBJECT:
-                    cur_env[var_name] = env.environment[idx][var_name]
+    # weak references to the closures with captured variables
+    stateful = set()
+
+    def __init__(self, func_ast, env, captures=None):
+        self.captured_vars = Closure.__capture(env, captures)
         self.func_ast = func_ast
         self.type = Type.CLOSURE
+        if self.captured_vars:
+            Closure.stateful.add(weakref.ref(self, Closure.stateful.discard))
+
+    # builds the name -> Value mapping every call of the closure starts from,
+    # with inner variables already shadowing outer ones.  Primitives are
+    # copied (a Value bound to several names is still shared by the copies),
+    # closures and objects are captured by reference.
+    @staticmethod
+    def __capture(env, captures):
+        captured_vars = {}
+        copies = {}
+        if captures is None:
+            visible = iter(env)
+        else:
+            visible = ((var_name, env.get(var_name)) for var_name in captures)
+        for var_name, value in visible:
+            if value is None:
+                continue
+            if value.t != Type.CLOSURE and value.t != Type.OBJECT:
+                copied = copies.get(id(value))
+                if copied is None:
+                    copied = copies[id(value)] = Value(value.t, value.v)
+                value = copied
+            captured_vars[var_name] = value
+        return captured_vars
+
+    # the copy passing a closure by value makes: its captured variables are
+    # copied, the code is shared
+    def copy(self, memo=None):
+        if memo is None:
+            memo = new_memo()
+        copied = copied_before(memo, self)
+        if copied is None:
+            copied = Closure.__new__(Closure)
+            memo[id(self)] = weakref.ref(copied)
+            copied.func_ast = self.func_ast
+            copied.type = self.type
+            copied.captured_vars = {
+                var_name: copy_value(value, memo)
+                for var_name, value in self.captured_vars.items()
+            }
+            if copied.captured_vars:
+                Closure.stateful.add(weakref.ref(copied, Closure.stateful.discard))
+        return copied
+
+    # a variable holding the closure was assigned a value of type t, so it can
+    # no longer be called
+    def retype(self, t):
+        Object.flush()  # pending copies may still copy it with its old type
+        self.type = t
+
+
+# The layout shared by all objects that were given the same fields in the same
+# order: slots maps each field name to its index in an object's values, and
+# transitions maps a field name to the shape an object moves to when that
+# field is added to it.  Every object starts out with Shape.EMPTY.
+class Shape:
+    def __init__(self, slots):
+        self.slots = slots
+        self.transitions = {}
+
+    def add(self, name):
+        shape = self.transitions.get(name)
+        if shape is None:
+            slots = dict(self.slots)
+            slots[name] = len(slots)
+            shape = self.transitions[name] = Shape(slots)
+        return shape
+
+
+Shape.EMPTY = Shape({})
+
+
+# The fields of an @ object: the Values of its fields, in the slots its shape
+# gives them.  Since objects with the same shape keep a field in the same
+# slot, code accessing fields can remember the slot it found a field in for a
+# shape and go straight to it when it sees that shape again (see FieldCache).
+#
+# Passing an object by value (or returning it) copies it, lazily: the copy
+# starts out pending, reading its fields from the original (its source), and
+# only gets Values of its own when it's written to.  The objects and closures
+# in its fields are copied the same way, when they're first read from it.
+#
+# A pending copy has to keep seeing the fields its source had when it was
+# made, so writing to any object that existed when the last copy was made
+# first materializes every pending copy (see flush).  Nothing else can change
+# what a pending copy reads, except:
+# - a ref parameter bound to a field (see get_field_ref), which updates the
+#   field's Value directly: a pinned object is always copied right away, and
+#   while one exists, so are the objects reachable from a copied object
+# - assignments to the variables a closure captured: while a closure has
+#   captured variables, objects reachable from a copied object are copied
+#   right away as well (objects holding only primitives can't reach one)
+class Object:
+    PRIMITIVES = {Type.INT, Type.BOOL, Type.STRING, Type.NIL}
+
+    epoch = 0  # bumped every time objects start being copied
+    barrier = 0  # objects born before it may be read by pending copies
+    pending = []  # weak references to the pending copies (and dead ones)
+    pending_limit = 64  # dead references are dropped once there are this many
+    pinned_objects = {}  # weak references to the pinned objects, by id
+
+    __slots__ = (
+        "shape",
+        "values",
+        "refs",
+        "pinned",
+        "born",
+        "source",
+        "memo",
+        "own",
+        "__weakref__",
+    )
+
+    def __init__(self, shape=Shape.EMPTY, values=None):
+        self.shape = shape
+        self.values = [] if values is None else values
+        self.refs = 0  # number of fields holding closures or objects
+        self.pinned = False
+        self.born = Object.epoch
+        # while pending: the object the copy reads its fields from, the memo
+        # it copies them with, and the copies it made of its closure and
+        # object fields (by slot), otherwise None
+        self.source = None
+        self.memo = None
+        self.own = None
+
+    def get_field(self, name):
+        index = self.shape.slots.get(name)
+        if index is None:
+            return None
+        if self.source is not None:
+            return self.__read(index)
+        return self.values[index]
+
+    def set_field(self, name, value):
+        self.__write()
+        index = self.shape.slots.get(name)
+        if index is not None:
+            self.set_slot(index, value)
+            return
+        self.shape = self.shape.add(name)
+        self.values.append(value)
+        if value.t not in Object.PRIMITIVES:
+            self.refs += 1
+
+    # sets the field in the given slot of an object that isn't pending
+    def set_slot(self, index, value):
+        if self.born < Object.barrier:
+            Object.flush()
+        if self.values[index].t not in Object.PRIMITIVES:
+            self.refs -= 1
+        if value.t not in Object.PRIMITIVES:
+            self.refs += 1
+        self.values[index] = value
+
+    # the Value of the field can be updated through a ref parameter
+    def get_field_ref(self, name):
+        self.__write()
+        if not self.pinned:
+            self.pinned = True
+            key = id(self)
+            Object.pinned_objects[key] = weakref.ref(
+                self, lambda _: Object.pinned_objects.pop(key)
+            )
+        return self.get_field(name)
 
+    def copy(self, memo=None):
+        if memo is None:
+            memo = new_memo()
+        copied = copied_before(memo, self)
+        if copied is not None:
+            return copied
+        if self.source is not None:
+            # its fields may already have been copied, and changed since
+            self.__materialize()
+        if not self.pinned and (self.refs == 0 or type(memo) is LazyMemo):
+            copied = Object(self.shape, ())
+            memo[id(self)] = weakref.ref(copied)
+            copied.source = self
+            if self.refs:
+                copied.memo = memo
+            pending = Object.pending
+            pending.append(weakref.ref(copied))
+            if len(pending) >= Object.pending_limit:
+                pending[:] = [ref for ref in pending if ref() is not None]
+                Object.pending_limit = max(64, 2 * len(pending))
+            return copied
+        copied = Object(self.shape)
+        memo[id(self)] = weakref.ref(copied)
+        copied.values = [copy_value(value, memo) for value in self.values]
+        copied.refs = self.refs
+        return copied
 
-# Represents a value, which has a type and its value
+    # materializes every pending copy, before an object they may be reading
+    # from changes
+    @staticmethod
+    def flush():
+        pending = Object.pending
+        while pending:
+            copied = pending.pop()()
+            if copied is not None and copied.source is not None:
+                copied.__materialize()
+        Object.barrier = 0
+
+    def __read(self, index):
+        value = self.source.values[index]
+        if value.t in Object.PRIMITIVES:
+            return value
+        if self.own is None:
+            self.own = {}
+        copied = self.own.get(index)
+        if copied is None:
+            copied = self.own[index] = copy_value(value, self.memo)
+        return copied
+
+    def __write(self):
+        if self.born < Object.barrier:
+            Object.flush()
+        if self.source is not None:
+            self.__materialize()
+
+    def __materialize(self):
+        own = self.own or {}
+        values = []
+        for index, value in enumerate(self.source.values):
+            if value.t in Object.PRIMITIVES:
+                values.append(Value(value.t, value.v))
+            else:
+                copied = own.get(index)
+                if copied is None:
+                    copied = copy_value(value, self.memo)
+                values.append(copied)
+        self.values = values
+        self.refs = self.source.refs
+        self.source = self.memo = self.own = None
+
+    # objects compare equal if they hold the very same field Values
+    def __eq__(self, other):
+        if not isinstance(other, Object):
+            return NotImplemented
+        if self is other:
+            return True
+        if self.source is not None or other.source is not None:
+            # no other object holds the Values of a pending copy's fields
+            return not self.shape.slots and not other.shape.slots
+        return dict(zip(self.shape.slots, self.values)) == dict(
+            zip(other.shape.slots, other.values)
+        )
+
+
+# The inline cache of one place in a program that reads or writes the field
+# name: the slot the field was in for the shape of the last object it saw.
+# Objects with that shape have the field in the same slot, so the next one
+# can go straight to it (unless it's a pending copy).
+class FieldCache:
+    __slots__ = ("name", "shape", "index")
+
+    def __init__(self, name):
+        self.name = name
+        self.shape = None
+        self.index = 0
+
+    # returns the field's Value, or None if obj has no such field
+    def get(self, obj):
+        if obj.shape is self.shape and obj.source is None:
+            return obj.values[self.index]
+        value = obj.get_field(self.name)
+        if value is not None:
+            self.shape = obj.shape
+            self.index = obj.shape.slots[self.name]
+        return value
+
+    def set(self, obj, value):
+        if obj.shape is self.shape and obj.source is None:
+            obj.set_slot(self.index, value)
+            return
+        obj.set_field(self.name, value)
+        self.shape = obj.shape
+        self.index = obj.shape.slots[self.name]
+
+
+# Represents a value, which has a type and its value.  The Value a variable,
+# field or parameter is bound to is where that variable is stored: assignments
+# update it in place, and ref parameters and closures share it.  Any other Value
+# (a constant, or the result of an expression or call) is never modified, so
+# the same one can be handed out many times; binding one to a new variable
+# always makes a new Value.
 class Value:
     def __init__(self, t, v=None):
         self.t = t
@@ -42,6 +331,47 @@ class Value:
         self.t = other.t
         self.v = other.v
 
+
+# copies a Value for passing it by value or returning it, like copy.deepcopy
+# would (memo maps the ids of what was copied already to weak references to
+# their copies, see new_memo)
+def copy_value(value, memo=None):
+    if memo is None:
+        if value.t is not Type.OBJECT and value.t is not Type.CLOSURE:
+            return Value(value.t, value.v)
+        memo = new_memo()
+    copied = copied_before(memo, value)
+    if copied is None:
+        copied = Value(value.t, value.v)
+        memo[id(value)] = weakref.ref(copied)
+        if value.t is Type.OBJECT or value.t is Type.CLOSURE:
+            copied.v = value.v.copy(memo)
+    return copied
+
+
+# the memo a copy of the objects reachable from objects that are copied lazily
+# is made with
+class LazyMemo(dict):
+    pass
+
+
+# the memo for copying a Value.  Pending copies keep it for copying the rest
+# of the object graph later, so it only refers to the copies weakly (a pending
+# copy keeps the copies it handed out in own; one nothing refers to any more
+# can just be made again).
+def new_memo():
+    Object.epoch += 1
+    Object.barrier = Object.epoch
+    if Closure.stateful or Object.pinned_objects:
+        return {}
+    return LazyMemo()
+
+
+def copied_before(memo, original):
+    ref = memo.get(id(original))
+    return None if ref is None else ref()
+
+
 def create_value(val):
     if val == InterpreterBase.TRUE_DEF:
         return Value(Type.BOOL, True)
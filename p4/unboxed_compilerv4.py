@@ -0,0 +1,646 @@
+from intbase import InterpreterBase, ErrorType
+from type_valuev4 import Closure, FieldCache, Object, Type, Value, copy_value
+
+
+# The UnboxedCompiler compiles functions into python closures like the
+# ClosureCompiler does, but the compiled expressions evaluate to the python
+# objects a Value holds instead of the Value itself: ints, bools, strings,
+# None for nil, and the Closure or Object for closures and objects.  Arithmetic
+# and comparisons then work on plain python values and check types with
+# type(x) is int, without allocating a Value for every intermediate result.
+#
+# Variables are still stored as Value objects in the interpreter's environment
+# (ref parameters and closures share them), so a Value is only created when a
+# result is bound to a variable, parameter or field.
+class UnboxedCompiler:
+    LOGIC_OPS = {"&&", "||"}
+    EQUALITY_OPS = {"==", "!="}
+
+    TYPE_OF = {
+        int: Type.INT,
+        bool: Type.BOOL,
+        str: Type.STRING,
+        type(None): Type.NIL,
+        Closure: Type.CLOSURE,
+        Object: Type.OBJECT,
+    }
+
+    INT_OPS = {
+        "+": lambda x, y: x + y,
+        "-": lambda x, y: x - y,
+        "*": lambda x, y: x * y,
+        "/": lambda x, y: x // y,
+        "<": lambda x, y: x < y,
+        "<=": lambda x, y: x <= y,
+        ">": lambda x, y: x > y,
+        ">=": lambda x, y: x >= y,
+    }
+
+    # returned by statements (and blocks) that didn't execute a return, since
+    # None is nil
+    NEXT = object()
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.env = interpreter.env
+        self.func_name_to_ast = interpreter.func_name_to_ast
+        # maps a func/lambda Element to its (formal args, compiled body) pair
+        self.compiled_funcs = {}
+
+    # run the statements of main() in the interpreter's current environment
+    def run(self, main_func):
+        self.__compile_block(main_func.func_ast.get("statements"))()
+
+    def __error(self, error_type, description):
+        self.interpreter.error(error_type, description)
+
+    def __get_compiled_func(self, func_ast):
+        compiled = self.compiled_funcs.get(func_ast)
+        if compiled is None:
+            formal_args = [
+                (arg.get("name"), arg.elem_type == InterpreterBase.REFARG_DEF)
+                for arg in func_ast.get("args")
+            ]
+            body = self.__compile_block(func_ast.get("statements"))
+            compiled = (formal_args, body)
+            self.compiled_funcs[func_ast] = compiled
+        return compiled
+
+    # the Value a variable is bound to when it's assigned val
+    @staticmethod
+    def __box(val):
+        return Value(UnboxedCompiler.TYPE_OF[type(val)], val)
+
+    # the copy passing val by value (or returning it) makes
+    @staticmethod
+    def __copy(val):
+        if type(val) is Closure or type(val) is Object:
+            return val.copy()
+        return val
+
+    def __compile_block(self, statements):
+        compiled = tuple(self.__compile_statement(s) for s in statements)
+        push = self.env.push
+        pop = self.env.pop
+        NEXT = UnboxedCompiler.NEXT
+
+        def run_block():
+            push()
+            for statement in compiled:
+                return_val = statement()
+                if return_val is not NEXT:
+                    pop()
+                    return return_val
+            pop()
+            return NEXT
+
+        return run_block
+
+    def __compile_statement(self, statement):
+        elem_type = statement.elem_type
+        NEXT = UnboxedCompiler.NEXT
+        if elem_type == InterpreterBase.FCALL_DEF or elem_type == InterpreterBase.MCALL_DEF:
+            call = self.__compile_expr(statement)
+
+            def run_statement():
+                call()
+                return NEXT
+
+        elif elem_type == "=":
+            run_statement = self.__compile_assign(statement)
+        elif elem_type == InterpreterBase.RETURN_DEF:
+            run_statement = self.__compile_return(statement)
+        elif elem_type == InterpreterBase.IF_DEF:
+            run_statement = self.__compile_if(statement)
+        elif elem_type == InterpreterBase.WHILE_DEF:
+            run_statement = self.__compile_while(statement)
+        else:
+            # other expression statements are never evaluated
+
+            def run_statement():
+                return NEXT
+
+        if self.interpreter.trace_output:
+            untraced = run_statement
+
+            def run_statement():
+                print(statement)
+                return untraced()
+
+        return run_statement
+
+    def __compile_assign(self, assign_ast):
+        var_name = assign_ast.get("name")
+        expr = self.__compile_expr(assign_ast.get("expression"))
+        env_get = self.env.get
+        error = self.__error
+        type_of = UnboxedCompiler.TYPE_OF
+        NEXT = UnboxedCompiler.NEXT
+
+        field = assign_ast.get("field")
+        if field is not None:
+            set_field = FieldCache(field).set
+
+            def assign_field():
+                target_value_obj = env_get(var_name)
+                if target_value_obj is None:
+                    error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
+                if target_value_obj.t is not Type.OBJECT:
+                    error(ErrorType.TYPE_ERROR, f"Variable {var_name} is not an object")
+                val = expr()
+                set_field(target_value_obj.v, Value(type_of[type(val)], val))
+                return NEXT
+
+            return assign_field
+
+        env_set = self.env.set
+
+        def assign():
+            val = expr()
+            t = type_of[type(val)]
+            target_value_obj = env_get(var_name)
+            if target_value_obj is None:
+                env_set(var_name, Value(t, val))
+                return NEXT
+            # a closure changed to another type can no longer be called
+            if target_value_obj.t is Type.CLOSURE and t is not Type.CLOSURE:
+                target_value_obj.v.retype(t)
+            target_value_obj.t = t
+            target_value_obj.v = val
+            return NEXT
+
+        return assign
+
+    def __compile_return(self, return_ast):
+        expr_ast = return_ast.get("expression")
+        if expr_ast is None:
+            return lambda: None
+
+        expr = self.__compile_expr(expr_ast)
+        copy = UnboxedCompiler.__copy
+
+        def return_value():
+            return copy(expr())
+
+        return return_value
+
+    def __compile_condition(self, cond_ast, description):
+        cond = self.__compile_expr(cond_ast)
+        error = self.__error
+
+        def eval_condition():
+            result = cond()
+            if type(result) is bool:
+                return result
+            if type(result) is int:
+                return result != 0
+            error(ErrorType.TYPE_ERROR, description)
+
+        return eval_condition
+
+    def __compile_if(self, if_ast):
+        cond = self.__compile_condition(
+            if_ast.get("condition"), "Incompatible type for if condition"
+        )
+        statements = self.__compile_block(if_ast.get("statements"))
+        else_ast = if_ast.get("else_statements")
+        NEXT = UnboxedCompiler.NEXT
+        if else_ast is None:
+
+            def run_if():
+                if cond():
+                    return statements()
+                return NEXT
+
+            return run_if
+
+        else_statements = self.__compile_block(else_ast)
+
+        def run_if_else():
+            if cond():
+                return statements()
+            return else_statements()
+
+        return run_if_else
+
+    def __compile_while(self, while_ast):
+        cond = self.__compile_condition(
+            while_ast.get("condition"), "Incompatible type for while condition"
+        )
+        statements = self.__compile_block(while_ast.get("statements"))
+        NEXT = UnboxedCompiler.NEXT
+
+        def run_while():
+            while cond():
+                return_val = statements()
+                if return_val is not NEXT:
+                    return return_val
+            return NEXT
+
+        return run_while
+
+    def __compile_expr(self, expr_ast):
+        elem_type = expr_ast.elem_type
+        if elem_type == InterpreterBase.NIL_DEF:
+            return lambda: None
+        if (
+            elem_type == InterpreterBase.INT_DEF
+            or elem_type == InterpreterBase.STRING_DEF
+            or elem_type == InterpreterBase.BOOL_DEF
+        ):
+            val = expr_ast.get("val")
+            return lambda: val
+        if elem_type == InterpreterBase.VAR_DEF:
+            return self.__compile_name(expr_ast)
+        if elem_type == InterpreterBase.FCALL_DEF:
+            return self.__compile_call(expr_ast)
+        if elem_type == InterpreterBase.MCALL_DEF:
+            return self.__compile_method_call(expr_ast)
+        if elem_type in self.interpreter.BIN_OPS:
+            return self.__compile_op(expr_ast)
+        if elem_type == InterpreterBase.NEG_DEF:
+            return self.__compile_neg(expr_ast)
+        if elem_type == InterpreterBase.NOT_DEF:
+            return self.__compile_not(expr_ast)
+        if elem_type == InterpreterBase.LAMBDA_DEF:
+            env = self.env
+            captures = self.interpreter.captures.names(expr_ast)
+            return lambda: Closure(expr_ast, env, captures)
+        if elem_type == InterpreterBase.OBJ_DEF:
+            return Object
+        return lambda: None
+
+    # evaluates to the Value of the variable or field itself rather than what
+    # it holds; ref is set when it is passed as an argument, since the Value
+    # of a field can then be bound to a ref parameter
+    def __compile_value(self, name_ast, ref=True):
+        var_name = name_ast.get("name")
+        env_get = self.env.get
+        error = self.__error
+
+        field = name_ast.get("field")
+        if field is not None:
+            get_field = FieldCache(field).get
+
+            def eval_field():
+                target_value_obj = env_get(var_name)
+                if target_value_obj is None:
+                    error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
+                if target_value_obj.t is not Type.OBJECT:
+                    error(ErrorType.TYPE_ERROR, f"Variable {var_name} is not an object")
+                obj = target_value_obj.v
+                val = obj.get_field_ref(field) if ref else get_field(obj)
+                if val is None:
+                    error(ErrorType.NAME_ERROR, "field not found")
+                return val
+
+            return eval_field
+
+        # the function table never changes while a program runs, so the
+        # fallback for names that aren't variables is resolved up front
+        candidate_funcs = self.func_name_to_ast.get(var_name)
+
+        def eval_name():
+            val = env_get(var_name)
+            if val is not None:
+                return val
+            if candidate_funcs is None:
+                error(ErrorType.NAME_ERROR, f"Variable/function {var_name} not found")
+            if len(candidate_funcs) > 1:
+                error(
+                    ErrorType.NAME_ERROR,
+                    f"Function {var_name} has multiple overloaded versions",
+                )
+            return Value(Type.CLOSURE, next(iter(candidate_funcs.values())))
+
+        return eval_name
+
+    def __compile_name(self, name_ast):
+        var_name = name_ast.get("name")
+        env_get = self.env.get
+        error = self.__error
+
+        field = name_ast.get("field")
+        if field is not None:
+            get_field = FieldCache(field).get
+
+            def eval_field():
+                target_value_obj = env_get(var_name)
+                if target_value_obj is None:
+                    error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
+                if target_value_obj.t is not Type.OBJECT:
+                    error(ErrorType.TYPE_ERROR, f"Variable {var_name} is not an object")
+                val = get_field(target_value_obj.v)
+                if val is None:
+                    error(ErrorType.NAME_ERROR, "field not found")
+                return val.v
+
+            return eval_field
+
+        candidate_funcs = self.func_name_to_ast.get(var_name)
+
+        def eval_name():
+            val = env_get(var_name)
+            if val is not None:
+                return val.v
+            if candidate_funcs is None:
+                error(ErrorType.NAME_ERROR, f"Variable/function {var_name} not found")
+            if len(candidate_funcs) > 1:
+                error(
+                    ErrorType.NAME_ERROR,
+                    f"Function {var_name} has multiple overloaded versions",
+                )
+            return next(iter(candidate_funcs.values()))
+
+        return eval_name
+
+    def __compile_op(self, arith_ast):
+        oper = arith_ast.elem_type
+        right = self.__compile_expr(arith_ast.get("op2"))
+        bin_ops = self.interpreter.bin_ops
+        type_of = UnboxedCompiler.TYPE_OF
+
+        # the uncommon cases go through the interpreter's bin_ops, which works
+        # on Values
+        def generic(x, y):
+            t = type_of[type(x)]
+            u = type_of[type(y)]
+            return bin_ops[(oper, t, u)](Value(t, x), Value(u, y)).v
+
+        if oper in UnboxedCompiler.EQUALITY_OPS:
+            equal = oper == "=="
+
+            # unless both operands are ints, ints and bools are compared as 0/1
+            def apply(x, y):
+                if type(x) is not int or type(y) is not int:
+                    if type(x) is int or type(x) is bool:
+                        x = 1 if x else 0
+                    if type(y) is int or type(y) is bool:
+                        y = 1 if y else 0
+                return (x == y) is equal
+
+        elif oper in UnboxedCompiler.LOGIC_OPS:
+            is_and = oper == "&&"
+
+            def apply(x, y):
+                if type(x) is bool and type(y) is bool:
+                    return (x and y) if is_and else (x or y)
+                return generic(x, y)
+
+        else:
+            int_op = UnboxedCompiler.INT_OPS[oper]
+
+            def apply(x, y):
+                if type(x) is int and type(y) is int:
+                    return int_op(x, y)
+                return generic(x, y)
+
+        op1_ast = arith_ast.get("op1")
+        if op1_ast.elem_type == InterpreterBase.VAR_DEF and self.__has_call(
+            arith_ast.get("op2")
+        ):
+            # the call can assign the variable or field on the left (through
+            # dynamic scoping or a ref parameter), and like the other modes
+            # the operator must see the assigned value, so the Value is held
+            # and only unboxed once the right operand has been evaluated
+            left_value = self.__compile_value(op1_ast, ref=False)
+
+            def eval_op_around_call():
+                left_value_obj = left_value()
+                y = right()
+                return apply(left_value_obj.v, y)
+
+            return eval_op_around_call
+
+        left = self.__compile_expr(op1_ast)
+
+        # the most common operand types are handled inline
+        if oper in UnboxedCompiler.EQUALITY_OPS:
+
+            def eval_equality():
+                x = left()
+                y = right()
+                if type(x) is int and type(y) is int:
+                    return (x == y) is equal
+                return apply(x, y)
+
+            return eval_equality
+
+        if oper in UnboxedCompiler.LOGIC_OPS:
+
+            def eval_logic():
+                x = left()
+                y = right()
+                if type(x) is bool and type(y) is bool:
+                    return (x and y) if is_and else (x or y)
+                return generic(x, y)
+
+            return eval_logic
+
+        def eval_arith():
+            x = left()
+            y = right()
+            if type(x) is int and type(y) is int:
+                return int_op(x, y)
+            return generic(x, y)
+
+        return eval_arith
+
+    # whether evaluating the expression can run a call (the body of a lambda
+    # isn't run by evaluating it)
+    def __has_call(self, expr_ast):
+        pending = [expr_ast]
+        while pending:
+            expr_ast = pending.pop()
+            elem_type = expr_ast.elem_type
+            if elem_type == InterpreterBase.FCALL_DEF or elem_type == InterpreterBase.MCALL_DEF:
+                return True
+            if elem_type in self.interpreter.BIN_OPS:
+                pending.append(expr_ast.get("op1"))
+                pending.append(expr_ast.get("op2"))
+            elif elem_type == InterpreterBase.NEG_DEF or elem_type == InterpreterBase.NOT_DEF:
+                pending.append(expr_ast.get("op1"))
+        return False
+
+    def __compile_neg(self, arith_ast):
+        operand = self.__compile_expr(arith_ast.get("op1"))
+        error = self.__error
+
+        def eval_neg():
+            val = operand()
+            if type(val) is not int:
+                error(ErrorType.TYPE_ERROR, "Incompatible type for neg operation")
+            return -1 * val
+
+        return eval_neg
+
+    def __compile_not(self, arith_ast):
+        operand = self.__compile_expr(arith_ast.get("op1"))
+        error = self.__error
+
+        def eval_not():
+            val = operand()
+            if type(val) is int:
+                return val == 0
+            if type(val) is not bool:
+                error(ErrorType.TYPE_ERROR, "Incompatible type for ! operation")
+            return not val
+
+        return eval_not
+
+    def __compile_call(self, call_ast):
+        func_name = call_ast.get("name")
+        if func_name == "print":
+            return self.__compile_print(call_ast)
+        if func_name == "inputi":
+            return self.__compile_input(call_ast)
+
+        args = self.__compile_args(call_ast)
+        num_args = len(args)
+        env_get = self.env.get
+        error = self.__error
+        invoke = self.__invoke
+        candidate_funcs = self.func_name_to_ast.get(func_name)
+
+        if candidate_funcs is not None:
+            # named functions can't be reassigned, so the overload is picked now
+            target_closure = candidate_funcs.get(num_args)
+
+            def call_func():
+                if target_closure is None:
+                    error(
+                        ErrorType.NAME_ERROR,
+                        f"Function {func_name} taking {num_args} params not found",
+                    )
+                if target_closure.type is not Type.CLOSURE:
+                    error(
+                        ErrorType.TYPE_ERROR,
+                        f"Function {func_name} is changed to non-function type.",
+                    )
+                return invoke(target_closure, args, {})
+
+            return call_func
+
+        def call_lambda():
+            closure_val_obj = env_get(func_name)
+            if closure_val_obj is None:
+                error(ErrorType.NAME_ERROR, f"Function {func_name} not found")
+            if closure_val_obj.t is not Type.CLOSURE:
+                error(ErrorType.TYPE_ERROR, "Trying to call function with non-closure")
+            target_closure = closure_val_obj.v
+            if len(target_closure.func_ast.get("args")) != num_args:
+                error(ErrorType.TYPE_ERROR, "Invalid # of args to lambda")
+            if target_closure.type is not Type.CLOSURE:
+                error(
+                    ErrorType.TYPE_ERROR,
+                    f"Function {func_name} is changed to non-function type.",
+                )
+            return invoke(target_closure, args, {})
+
+        return call_lambda
+
+    def __compile_method_call(self, call_ast):
+        objref = call_ast.get("objref")
+        method_name = call_ast.get("name")
+        args = self.__compile_args(call_ast)
+        env_get = self.env.get
+        error = self.__error
+        invoke = self.__invoke
+        get_method = FieldCache(method_name).get
+
+        def call_method():
+            var_obj = env_get(objref)
+            if var_obj is None:
+                error(ErrorType.NAME_ERROR, "Variable not found")
+            elif var_obj.t is not Type.OBJECT:
+                error(ErrorType.TYPE_ERROR, "Variable is not an object")
+            method_obj = get_method(var_obj.v)
+            if method_obj is None:
+                error(ErrorType.NAME_ERROR, "Method not found")
+            if method_obj.t is not Type.CLOSURE:
+                error(ErrorType.TYPE_ERROR, "Method is changed to non-function type.")
+            target_closure = method_obj.v
+            if target_closure.type is not Type.CLOSURE:
+                error(ErrorType.TYPE_ERROR, "Function is changed to non-function type.")
+            return invoke(target_closure, args, {"this": var_obj})
+
+        return call_method
+
+    # returns (compiled arg, whether it is a variable or field) pairs.
+    # Variables and fields evaluate to their Value, other args to the result
+    def __compile_args(self, call_ast):
+        return tuple(
+            (self.__compile_value(arg), True)
+            if arg.elem_type == InterpreterBase.VAR_DEF
+            else (self.__compile_expr(arg), False)
+            for arg in call_ast.get("args")
+        )
+
+    # runs the closure with new_env (already holding "this" for method calls)
+    # as its top-level scope, and returns what the call evaluates to
+    def __invoke(self, target_closure, args, new_env):
+        target_ast = target_closure.func_ast
+        formal_args, body = self.__get_compiled_func(target_ast)
+        new_env.update(target_closure.captured_vars)
+        if len(args) != len(formal_args):
+            self.__error(
+                ErrorType.NAME_ERROR,
+                f"Function {target_ast.get('name')} with {len(args)} args not found",
+            )
+        box = UnboxedCompiler.__box
+        for (arg_name, is_ref), (arg, is_name) in zip(formal_args, args):
+            if is_name:
+                value_obj = arg()
+                new_env[arg_name] = value_obj if is_ref else copy_value(value_obj)
+            elif is_ref:
+                # the parameter is the only variable holding the result
+                new_env[arg_name] = box(arg())
+            else:
+                new_env[arg_name] = box(UnboxedCompiler.__copy(arg()))
+        self.env.push(new_env)
+        return_val = body()
+        self.env.pop()
+        if return_val is UnboxedCompiler.NEXT:
+            return None
+        return return_val
+
+    def __compile_print(self, call_ast):
+        args = tuple(self.__compile_expr(arg) for arg in call_ast.get("args"))
+        interpreter = self.interpreter
+
+        printable = UnboxedCompiler.__printable
+
+        def call_print():
+            output = ""
+            for arg in args:
+                output = output + printable(arg())
+            interpreter.output(output)
+            return None
+
+        return call_print
+
+    def __compile_input(self, call_ast):
+        args = tuple(self.__compile_expr(arg) for arg in call_ast.get("args"))
+        interpreter = self.interpreter
+        error = self.__error
+        printable = UnboxedCompiler.__printable
+
+        def call_input():
+            if len(args) == 1:
+                interpreter.output(printable(args[0]()))
+            elif len(args) > 1:
+                error(ErrorType.NAME_ERROR, "No inputi() function that takes > 1 parameter")
+            return int(interpreter.get_input())
+
+        return call_input
+
+    # get_printable for what a Value holds
+    @staticmethod
+    def __printable(val):
+        if type(val) is str:
+            return val
+        if type(val) is int:
+            return str(val)
+        if type(val) is bool:
+            return "true" if val else "false"
+        return None
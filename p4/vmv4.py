@@ -0,0 +1,421 @@
+import operator
+
+from bytecodev4 import OPERATORS, Opcode
+from env_v4 import new_environment
+from intbase import ErrorType
+from type_valuev4 import (
+    Closure,
+    FieldCache,
+    Object,
+    Type,
+    Value,
+    copy_value,
+    get_printable,
+)
+
+
+# The VirtualMachine runs a BytecodeProgram with an explicit value stack and
+# call stack, so neither nested expressions nor brewin calls recurse in python.
+# Variables still live in the interpreter's EnvironmentManager, which keeps the
+# scoping and closure semantics identical to the tree-walking interpreter.
+class VirtualMachine:
+    # the first ten OPERATORS on two ints, and the types of their results
+    INT_OPS = (
+        operator.add,
+        operator.sub,
+        operator.mul,
+        operator.floordiv,
+        operator.lt,
+        operator.le,
+        operator.gt,
+        operator.ge,
+        operator.eq,
+        operator.ne,
+    )
+    INT_OP_TYPES = (Type.INT,) * 4 + (Type.BOOL,) * 6
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.env = interpreter.env
+
+    def run(self, program):
+        self.func_table = {}
+        empty_env = new_environment()
+        for code in program.functions:
+            if code.name not in self.func_table:
+                self.func_table[code.name] = {}
+            self.func_table[code.name][len(code.args)] = Closure(code, empty_env)
+        candidate_funcs = self.func_table.get("main")
+        if candidate_funcs is None:
+            self.__error(ErrorType.NAME_ERROR, "Function not found")
+        if 0 not in candidate_funcs:
+            self.__error(ErrorType.NAME_ERROR, "Function main taking 0 params not found")
+        self.__execute(candidate_funcs[0].func_ast)
+
+    def __error(self, error_type, description):
+        self.interpreter.error(error_type, description)
+
+    def __execute(self, main_code):
+        interpreter = self.interpreter
+        error = self.__error
+        env = self.env
+        env_get = env.get
+        env_set = env.set
+        env_push = env.push
+        env_pop = env.pop
+        func_table = self.func_table
+        bin_ops = interpreter.bin_ops
+        int_ops = VirtualMachine.INT_OPS
+        int_op_types = VirtualMachine.INT_OP_TYPES
+        nil_value = interpreter.NIL_VALUE
+        INT = Type.INT
+        BOOL = Type.BOOL
+        STRING = Type.STRING
+        CLOSURE = Type.CLOSURE
+        OBJECT = Type.OBJECT
+
+        LOAD_NIL = Opcode.LOAD_NIL
+        LOAD_INT = Opcode.LOAD_INT
+        LOAD_STRING = Opcode.LOAD_STRING
+        LOAD_BOOL = Opcode.LOAD_BOOL
+        LOAD_NAME = Opcode.LOAD_NAME
+        STORE_NAME = Opcode.STORE_NAME
+        LOAD_OBJECT = Opcode.LOAD_OBJECT
+        GET_FIELD = Opcode.GET_FIELD
+        GET_FIELD_REF = Opcode.GET_FIELD_REF
+        STORE_FIELD = Opcode.STORE_FIELD
+        BINARY_OP = Opcode.BINARY_OP
+        NEG = Opcode.NEG
+        NOT = Opcode.NOT
+        MAKE_CLOSURE = Opcode.MAKE_CLOSURE
+        NEW_OBJECT = Opcode.NEW_OBJECT
+        RESOLVE_FUNC = Opcode.RESOLVE_FUNC
+        RESOLVE_METHOD = Opcode.RESOLVE_METHOD
+        PASS_ARG = Opcode.PASS_ARG
+        PASS_RESULT_ARG = Opcode.PASS_RESULT_ARG
+        CALL = Opcode.CALL
+        PRINT_BEGIN = Opcode.PRINT_BEGIN
+        PRINT_ARG = Opcode.PRINT_ARG
+        PRINT_END = Opcode.PRINT_END
+        INPUTI = Opcode.INPUTI
+        POP = Opcode.POP
+        JUMP = Opcode.JUMP
+        JUMP_IF_FALSE = Opcode.JUMP_IF_FALSE
+        LOOP_IF_FALSE = Opcode.LOOP_IF_FALSE
+        PUSH_BLOCK = Opcode.PUSH_BLOCK
+        POP_BLOCK = Opcode.POP_BLOCK
+        RETURN_VALUE = Opcode.RETURN_VALUE
+        RETURN_NIL = Opcode.RETURN_NIL
+        RETURN_VARIABLE = Opcode.RETURN_VARIABLE
+        ERROR = Opcode.ERROR
+
+        # the FieldCache of each field and method instruction of a code
+        # object, by the pc after the instruction
+        field_caches = {}
+
+        def caches_of(code_obj):
+            caches = field_caches.get(code_obj)
+            if caches is None:
+                caches = field_caches[code_obj] = [None] * (len(code_obj.code) + 2)
+            return caches
+
+        # the int and string consts of each code object as Values; constants
+        # are never modified (everything that binds a Value copies it), so
+        # every load can push the same one, like the tree walker does
+        boxed_consts = {}
+
+        def values_of(code_obj):
+            values = boxed_consts.get(code_obj)
+            if values is None:
+                values = boxed_consts[code_obj] = [
+                    Value(INT, c)
+                    if c.__class__ is int
+                    else Value(STRING, c)
+                    if c.__class__ is str
+                    else None
+                    for c in code_obj.consts
+                ]
+            return values
+
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        # caller state saved by CALL: (code object, its caches, its const
+        # Values, pc)
+        frames = []
+        cur = main_code
+        code = cur.code
+        consts = cur.consts
+        names = cur.names
+        caches = caches_of(cur)
+        const_values = values_of(cur)
+        pc = 0
+
+        while True:
+            op = code[pc]
+            arg = code[pc + 1]
+            pc += 2
+
+            if op == LOAD_NAME:
+                var_name = names[arg]
+                val = env_get(var_name)
+                if val is None:
+                    candidate_funcs = func_table.get(var_name)
+                    if candidate_funcs is None:
+                        error(
+                            ErrorType.NAME_ERROR,
+                            f"Variable/function {var_name} not found",
+                        )
+                    if len(candidate_funcs) > 1:
+                        error(
+                            ErrorType.NAME_ERROR,
+                            f"Function {var_name} has multiple overloaded versions",
+                        )
+                    val = Value(CLOSURE, next(iter(candidate_funcs.values())))
+                push(val)
+
+            elif op == LOAD_INT:
+                push(const_values[arg])
+
+            elif op == BINARY_OP:
+                right = pop()
+                left = stack[-1]
+                if left.t is INT and right.t is INT and arg < 10:
+                    stack[-1] = Value(int_op_types[arg], int_ops[arg](left.v, right.v))
+                else:
+                    stack[-1] = bin_ops[(OPERATORS[arg], left.t, right.t)](left, right)
+
+            elif op == STORE_NAME:
+                var_name = names[arg]
+                src_value_obj = pop()
+                target_value_obj = env_get(var_name)
+                if target_value_obj is None:
+                    env_set(var_name, Value(src_value_obj.t, src_value_obj.v))
+                else:
+                    # a closure changed to another type can no longer be called
+                    if target_value_obj.t is CLOSURE and src_value_obj.t is not CLOSURE:
+                        target_value_obj.v.retype(src_value_obj.t)
+                    target_value_obj.t = src_value_obj.t
+                    target_value_obj.v = src_value_obj.v
+
+            elif op == JUMP_IF_FALSE or op == LOOP_IF_FALSE:
+                result = pop()
+                if result.t is BOOL:
+                    if not result.v:
+                        pc = arg
+                elif result.t is INT:
+                    if result.v == 0:
+                        pc = arg
+                elif op == JUMP_IF_FALSE:
+                    error(ErrorType.TYPE_ERROR, "Incompatible type for if condition")
+                else:
+                    error(ErrorType.TYPE_ERROR, "Incompatible type for while condition")
+
+            elif op == JUMP:
+                pc = arg
+
+            elif op == PUSH_BLOCK:
+                env_push()
+
+            elif op == POP_BLOCK:
+                env_pop()
+
+            elif op == POP:
+                pop()
+
+            elif op == RESOLVE_FUNC:
+                func_name, num_args = consts[arg]
+                candidate_funcs = func_table.get(func_name)
+                if candidate_funcs is not None:
+                    target_closure = candidate_funcs.get(num_args)
+                    if target_closure is None:
+                        error(
+                            ErrorType.NAME_ERROR,
+                            f"Function {func_name} taking {num_args} params not found",
+                        )
+                else:
+                    closure_val_obj = env_get(func_name)
+                    if closure_val_obj is None:
+                        error(ErrorType.NAME_ERROR, f"Function {func_name} not found")
+                    if closure_val_obj.t is not CLOSURE:
+                        error(
+                            ErrorType.TYPE_ERROR,
+                            "Trying to call function with non-closure",
+                        )
+                    target_closure = closure_val_obj.v
+                    if len(target_closure.func_ast.args) != num_args:
+                        error(ErrorType.TYPE_ERROR, "Invalid # of args to lambda")
+                if target_closure.type is not CLOSURE:
+                    error(
+                        ErrorType.TYPE_ERROR,
+                        f"Function {func_name} is changed to non-function type.",
+                    )
+                push(target_closure)
+                push(None)
+
+            elif op == PASS_ARG or op == PASS_RESULT_ARG:
+                # stack: ..., closure, this, arg 0, ..., arg <arg>
+                if not stack[-arg - 3].func_ast.args[arg][1]:
+                    stack[-1] = copy_value(stack[-1])
+                elif op == PASS_RESULT_ARG:
+                    # the ref parameter is the only variable holding the result
+                    value_obj = stack[-1]
+                    stack[-1] = Value(value_obj.t, value_obj.v)
+
+            elif op == CALL:
+                if arg:
+                    args = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    args = ()
+                this = pop()
+                target_closure = pop()
+                if this is None:
+                    new_env = dict(target_closure.captured_vars)
+                else:
+                    new_env = {"this": this}
+                    new_env.update(target_closure.captured_vars)
+                callee = target_closure.func_ast
+                for (arg_name, _), value in zip(callee.args, args):
+                    new_env[arg_name] = value
+                env_push(new_env)
+                # only the frame keeps the arguments alive: a pending copy
+                # passed as one is materialized when its source is written to
+                # if it's still around (see type_valuev4.Object)
+                args = new_env = value = None
+                frames.append((cur, caches, const_values, pc))
+                cur = callee
+                code = cur.code
+                consts = cur.consts
+                names = cur.names
+                caches = caches_of(cur)
+                const_values = values_of(cur)
+                pc = 0
+
+            elif op == RETURN_VALUE or op == RETURN_VARIABLE or op == RETURN_NIL:
+                if op == RETURN_VALUE:
+                    return_val = pop()
+                    if return_val.t is OBJECT or return_val.t is CLOSURE:
+                        return_val = copy_value(return_val)
+                elif op == RETURN_VARIABLE:
+                    # a variable's Value is updated in place by later
+                    # assignments, so the caller gets its own copy
+                    return_val = copy_value(pop())
+                else:
+                    return_val = nil_value
+                for _ in range(arg):
+                    env_pop()
+                if not frames:
+                    return
+                env_pop()  # the scope holding the call's parameters
+                cur, caches, const_values, pc = frames.pop()
+                code = cur.code
+                consts = cur.consts
+                names = cur.names
+                push(return_val)
+
+            elif op == LOAD_STRING:
+                push(const_values[arg])
+
+            elif op == LOAD_BOOL:
+                push(Value(BOOL, arg == 1))
+
+            elif op == LOAD_NIL:
+                push(nil_value)
+
+            elif op == LOAD_OBJECT:
+                var_name = names[arg]
+                target_value_obj = env_get(var_name)
+                if target_value_obj is None:
+                    error(ErrorType.NAME_ERROR, f"Variable {var_name} not found")
+                if target_value_obj.t is not OBJECT:
+                    error(ErrorType.TYPE_ERROR, f"Variable {var_name} is not an object")
+                push(target_value_obj)
+
+            elif op == GET_FIELD or op == GET_FIELD_REF:
+                if op == GET_FIELD:
+                    cache = caches[pc]
+                    if cache is None:
+                        cache = caches[pc] = FieldCache(names[arg])
+                    val = cache.get(stack[-1].v)
+                else:
+                    val = stack[-1].v.get_field_ref(names[arg])
+                if val is None:
+                    error(ErrorType.NAME_ERROR, "field not found")
+                stack[-1] = val
+
+            elif op == STORE_FIELD:
+                src_value_obj = pop()
+                cache = caches[pc]
+                if cache is None:
+                    cache = caches[pc] = FieldCache(names[arg])
+                cache.set(pop().v, Value(src_value_obj.t, src_value_obj.v))
+
+            elif op == RESOLVE_METHOD:
+                objref, method_name, num_args = consts[arg]
+                var_obj = env_get(objref)
+                if var_obj is None:
+                    error(ErrorType.NAME_ERROR, "Variable not found")
+                elif var_obj.t is not OBJECT:
+                    error(ErrorType.TYPE_ERROR, "Variable is not an object")
+                cache = caches[pc]
+                if cache is None:
+                    cache = caches[pc] = FieldCache(method_name)
+                method_obj = cache.get(var_obj.v)
+                if method_obj is None:
+                    error(ErrorType.NAME_ERROR, "Method not found")
+                if method_obj.t is not CLOSURE:
+                    error(ErrorType.TYPE_ERROR, "Method is changed to non-function type.")
+                target_closure = method_obj.v
+                if target_closure.type is not CLOSURE:
+                    error(ErrorType.TYPE_ERROR, "Function is changed to non-function type.")
+                callee = target_closure.func_ast
+                if len(callee.args) != num_args:
+                    error(
+                        ErrorType.NAME_ERROR,
+                        f"Function {callee.name} with {num_args} args not found",
+                    )
+                push(target_closure)
+                push(var_obj)
+
+            elif op == NEG:
+                value_obj = stack[-1]
+                if value_obj.t is not INT:
+                    error(ErrorType.TYPE_ERROR, "Incompatible type for neg operation")
+                stack[-1] = Value(INT, -1 * value_obj.v)
+
+            elif op == NOT:
+                value_obj = stack[-1]
+                if value_obj.t is INT:
+                    stack[-1] = Value(BOOL, value_obj.v == 0)
+                elif value_obj.t is BOOL:
+                    stack[-1] = Value(BOOL, not value_obj.v)
+                else:
+                    error(ErrorType.TYPE_ERROR, "Incompatible type for ! operation")
+
+            elif op == MAKE_CLOSURE:
+                lambda_code = cur.functions[arg]
+                push(Value(CLOSURE, Closure(lambda_code, env, lambda_code.captures)))
+
+            elif op == NEW_OBJECT:
+                push(Value(OBJECT, Object()))
+
+            elif op == PRINT_BEGIN:
+                push("")
+
+            elif op == PRINT_ARG:
+                value_obj = pop()
+                stack[-1] = stack[-1] + get_printable(value_obj)
+
+            elif op == PRINT_END:
+                interpreter.output(pop())
+                push(nil_value)
+
+            elif op == INPUTI:
+                if arg == 1:
+                    interpreter.output(get_printable(pop()))
+                push(Value(INT, int(interpreter.get_input())))
+
+            elif op == ERROR:
+                error_type, description = consts[arg]
+                error(ErrorType(error_type), description)
@@ -0,0 +1,109 @@
+import marshal
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "p4"))
+
+from brewparse import parse_program  # noqa: E402
+from bytecodev4 import BytecodeProgram, Opcode, compile_program  # noqa: E402
+from interpreterv4 import Interpreter  # noqa: E402
+from test_modes import ERRORS, PROGRAMS, run  # noqa: E402
+
+
+# runs a program from the bytes BytecodeProgram.dumps() returned for it, like
+# a worker that got it from a cache would
+def run_dumped(data):
+    interpreter = Interpreter(console_output=False, inp=["5", "7"])
+    try:
+        interpreter.run_bytecode(BytecodeProgram.loads(data))
+        error = None
+    except Exception as e:
+        error = (interpreter.get_error_type_and_line()[0], str(e))
+    return interpreter.get_output(), error
+
+
+class BytecodeFormatTest(unittest.TestCase):
+    def test_round_trip(self):
+        programs = dict(PROGRAMS)
+        programs.update((name, program) for name, (program, _) in ERRORS.items())
+        for name, program in programs.items():
+            with self.subTest(name):
+                data = compile_program(parse_program(program)).dumps()
+                # marshal may share strings differently, so the bytes can differ
+                reloaded = BytecodeProgram.loads(data).dumps()
+                self.assertEqual(marshal.loads(reloaded), marshal.loads(data))
+                self.assertEqual(run_dumped(data), run(program, Interpreter.TREE_MODE))
+
+    def test_other_format_rejected(self):
+        data = compile_program(parse_program("func main() { print(1); }")).dumps()
+        magic, version, functions = marshal.loads(data)
+        for other in (
+            (magic, version + 1, functions),
+            (magic, version - 1, functions),
+            ("other", version, functions),
+        ):
+            with self.subTest(other[:2]):
+                with self.assertRaises(ValueError):
+                    BytecodeProgram.loads(marshal.dumps(other))
+
+
+class ReturnTest(unittest.TestCase):
+    # only a variable's (or field's) Value can change after it's returned, so
+    # only those returns copy primitives
+    def test_return_opcodes(self):
+        program = compile_program(
+            parse_program(
+                """
+func variable(x) { return x; }
+func field(o) { return o.f; }
+func value(x) { return x + 1; }
+func none() { return; }
+func main() { print(1); }
+"""
+            )
+        )
+        return_ops = {Opcode.RETURN_VALUE, Opcode.RETURN_VARIABLE, Opcode.RETURN_NIL}
+        # the first return of each function is the one in its body
+        returns = {
+            code_obj.name: next(op for op in code_obj.code[::2] if op in return_ops)
+            for code_obj in program.functions
+        }
+        self.assertEqual(
+            returns,
+            {
+                "variable": Opcode.RETURN_VARIABLE,
+                "field": Opcode.RETURN_VARIABLE,
+                "value": Opcode.RETURN_VALUE,
+                "none": Opcode.RETURN_NIL,
+                "main": Opcode.RETURN_NIL,
+            },
+        )
+
+
+
+class BlockTest(unittest.TestCase):
+    # only blocks that can create a variable get a scope of their own, and
+    # returns only discard those
+    def test_unscoped_blocks(self):
+        program = compile_program(
+            parse_program(
+                """
+func count(n) { while (n > 0) { if (n == 5) { return n; } n = n - 1; } return n; }
+func local(n) { if (n > 0) { m = n; return m; } return 0; }
+func main() { print(count(9), local(2)); }
+"""
+            )
+        )
+        functions = {code_obj.name: code_obj for code_obj in program.functions}
+        self.assertNotIn(Opcode.PUSH_BLOCK, functions["count"].code[::2])
+        code = functions["local"].code
+        ops = list(code[::2])
+        self.assertEqual(ops.count(Opcode.PUSH_BLOCK), 1)
+        # the return inside the if discards its block
+        self.assertEqual(code[2 * ops.index(Opcode.RETURN_VARIABLE) + 1], 1)
+        self.assertEqual(run_dumped(program.dumps())[0], ["52"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+P3 = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "p3")
+
+PROGRAMS = {
+    "ref parameters": """
+func inc(ref k) { k = k + 1; }
+func set_twice(ref a, b) { a = b; b = b + 1; inc(a); }
+func swap(ref a, ref b) { t = a; a = b; b = t; }
+func main() {
+  x = 1;
+  inc(x);
+  print(x);
+  y = 5;
+  set_twice(x, y);
+  print(x, " ", y);
+  p = "p"; q = "q";
+  swap(p, q);
+  print(p, q);
+  if (true) { x = 10; inc(x); w = 1; inc(w); print(w); }
+  print(x);
+}
+""",
+    "ref parameter named like the argument": """
+func bump(x) { x = x + 100; }
+func inc(ref x) { x = x + 1; bump(x); }
+func main() {
+  x = 1;
+  inc(x);
+  print(x);
+  if (true) { x = 5; y = 2; inc(x); inc(y); print(x, " ", y); }
+  print(x);
+}
+""",
+    "dynamic scoping": """
+func show() { print("x is ", x); }
+func bump() { x = x + 10; return 1; }
+func shadow() { x = 100; if (true) { x = x + 1; y = 1; } print(x); }
+func main() {
+  x = 1;
+  show();
+  print(x + bump());
+  if (x > 0) { x = 5; z = 3; print(z); }
+  show();
+  shadow();
+  show();
+  i = 0;
+  while (i < 3) { w = i; i = i + 1; }
+  print(i);
+}
+""",
+    "variable of a returned call": """
+func f() { y = 1; print(y); }
+func main() { f(); print(y); }
+""",
+    "functions": """
+func fact(n) { if (n <= 1) { return 1; } return n * fact(n - 1); }
+func apply(f, v) { return f(v); }
+func main() {
+  f = lambda(a) { return a * 2; };
+  print(apply(f, 21), " ", fact(10));
+  g = fact;
+  print(g(5));
+}
+""",
+}
+
+# runs a program on the p3 interpreter with the given environment and prints
+# its output and error as json; p3 is run in its own process, since its
+# modules have the same names as p4's
+RUN_PROGRAM = """
+import json
+import sys
+from interpreterv3 import Interpreter
+
+interpreter = Interpreter(console_output=False, environment=sys.argv[1])
+try:
+    interpreter.run(sys.stdin.read())
+    error = None
+except Exception as e:
+    error = str(e)
+print(json.dumps([interpreter.get_output(), error]))
+"""
+
+
+def run(program, environment):
+    result = subprocess.run(
+        [sys.executable, "-c", RUN_PROGRAM, environment],
+        cwd=P3,
+        input=program,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise AssertionError(result.stderr)
+    return json.loads(result.stdout)
+
+
+class StackEnvironmentTest(unittest.TestCase):
+    def test_programs(self):
+        for name, program in PROGRAMS.items():
+            with self.subTest(name):
+                self.assertEqual(run(program, "stacks"), run(program, "frames"))
+
+
+if __name__ == "__main__":
+    unittest.main()
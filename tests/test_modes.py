@@ -0,0 +1,380 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "p4"))
+
+from env_v4 import StackEnvironmentManager  # noqa: E402
+from interpreterv4 import Interpreter  # noqa: E402
+from intbase import ErrorType  # noqa: E402
+
+PROGRAMS = {
+    "dynamic scoping": """
+func show() { print("x is ", x); }
+func bump() { x = x + 10; return 1; }
+func shadow() { x = "inner"; if (true) { x = x + "!"; y = 1; } print(x); }
+func main() {
+  x = 1;
+  show();
+  print(x + bump());
+  print(x);
+  if (x > 0) { x = 5; z = 3; print(z); }
+  show();
+  shadow();
+  show();
+}
+""",
+    "ref parameters": """
+func inc(ref k) { k = k + 1; return 0; }
+func set_twice(ref a, b) { a = b; b = b + 1; inc(a); }
+func swap(ref a, ref b) { t = a; a = b; b = t; }
+func main() {
+  x = 1;
+  inc(x);
+  print(x);
+  y = 5;
+  set_twice(x, y);
+  print(x, " ", y);
+  p = "p"; q = "q";
+  swap(p, q);
+  print(p, q);
+  o = @;
+  o.q = 5;
+  o.q = o.q + inc(o.q);
+  inc(o.q);
+  print(o.q);
+  inc(3 + 4);
+  print(x + inc(x));
+}
+""",
+    "objects": """
+func fill(o) { o.a = 100; return o; }
+func fill_ref(ref o) { o.a = 200; }
+func main() {
+  o = @;
+  o.a = 1;
+  o.b = "two";
+  inner = @;
+  o.c = inner;
+  p = fill(o);
+  print(o.a, " ", p.a);
+  fill_ref(o);
+  print(o.a);
+  q = o;
+  q.a = 3;
+  print(o.a, " ", q.a, " ", o == q, " ", o == o);
+  r = @;
+  print(r == @, " ", r != nil, " ", o.b + "!");
+  inner.x = 5;
+  inner = o.c;
+  print(inner.x);
+}
+""",
+    "methods": """
+func main() {
+  counter = @;
+  counter.n = 0;
+  counter.add = lambda(k) { this.n = this.n + k; return this.n; };
+  counter.twice = lambda(k) { this.add(k); return this.add(k); };
+  print(counter.add(2));
+  print(counter.twice(3));
+  other = @;
+  other.n = 100;
+  other.add = counter.add;
+  print(other.add(1), " ", counter.n);
+  counter.add = lambda(k) { return k * 1000; };
+  print(counter.twice(1));
+}
+""",
+    "closures": """
+func make_counter() {
+  c = 0;
+  return lambda() { c = c + 1; return c; };
+}
+func apply(f, x) { return f(x); }
+func main() {
+  f = make_counter();
+  g = make_counter();
+  print(f(), f(), g(), f() + f());
+  base = 10;
+  add = lambda(x) { return x + base; };
+  base = 20;
+  print(add(1), " ", apply(add, 2));
+  o = @;
+  o.v = 1;
+  peek = lambda() { return o.v; };
+  o.v = 2;
+  print(peek());
+  h = lambda(n) { if (n == 0) { return 0; } return n + h(n - 1); };
+  print(h(10));
+  k = make_counter;
+  f2 = k();
+  print(f2(), f2());
+  same = f;
+  print(same == f, " ", f == g);
+}
+""",
+    "operators": """
+func main() {
+  print(3 + 4 * 2 - 10 / 3, " ", -5, " ", !true, " ", !0);
+  print(true + 1, " ", 1 && 0, " ", 0 || 2, " ", true == 1, " ", 2 == true);
+  print("a" + "b", " ", "a" == "a", " ", "a" != "b", " ", nil == nil, " ", nil != 1);
+  print(1 < 2, 2 <= 2, 3 > 4, 4 >= 5, " ", 7 / 2, " ", -7 / 2);
+  x = 5;
+  while (x > 0) { x = x - 2; if (x == 1) { print("one"); } else { print(x); } }
+}
+""",
+    "expression statements": """
+func main() {
+  x = 1;
+  x;
+  y;
+  1 + "s";
+  -x;
+  !x;
+  lambda() { print("never"); };
+  @;
+  nil;
+  print(x);
+}
+""",
+    "calls": """
+func f() { return 0; }
+func f(a) { return a; }
+func f(a, b) { return a + b; }
+func fib(n) { if (n < 2) { return n; } return fib(n - 1) + fib(n - 2); }
+func count(n, total) { if (n == 0) { return total; } return count(n - 1, total + n); }
+func nothing() { return; }
+func main() {
+  print(f(), f(1), f(1, 2));
+  print(fib(15), " ", count(100, 0));
+  print(nothing() == nil);
+  x = inputi("number: ");
+  y = inputi();
+  print(x + y);
+  g = fib;
+  print(g(10));
+}
+""",
+}
+
+# programs that fail, with the error they fail with; the output printed
+# before the error has to match too
+ERRORS = {
+    "type error": (
+        """
+func main() { print("before"); print(1 + "s"); print("after"); }
+""",
+        ErrorType.TYPE_ERROR,
+    ),
+    "type error in condition": (
+        """
+func main() { x = "s"; if (x) { print(1); } }
+""",
+        ErrorType.TYPE_ERROR,
+    ),
+    "negation of a string": (
+        """
+func main() { print(-"s"); }
+""",
+        ErrorType.TYPE_ERROR,
+    ),
+    "unknown variable": (
+        """
+func main() { print(1); print(y); }
+""",
+        ErrorType.NAME_ERROR,
+    ),
+    "variable of a returned call": (
+        """
+func f() { y = 1; print(y); }
+func main() { f(); print(y); }
+""",
+        ErrorType.NAME_ERROR,
+    ),
+    "unknown function": (
+        """
+func main() { print(1); g(1, 2); }
+""",
+        ErrorType.NAME_ERROR,
+    ),
+    "wrong arity": (
+        """
+func f(a) { return a; }
+func main() { print(f(1)); print(f(1, 2)); }
+""",
+        ErrorType.NAME_ERROR,
+    ),
+    "call of a non-function": (
+        """
+func main() { f = 5; f(); }
+""",
+        ErrorType.TYPE_ERROR,
+    ),
+    "function changed to a value": (
+        """
+func f() { return 1; }
+func main() { g = f; print(g()); g = 1; g(); }
+""",
+        ErrorType.TYPE_ERROR,
+    ),
+    "lambda arity": (
+        """
+func main() { f = lambda(a) { return a; }; print(f(1)); f(1, 2); }
+""",
+        ErrorType.TYPE_ERROR,
+    ),
+    "field of a non-object": (
+        """
+func main() { x = 5; print(x.f); }
+""",
+        ErrorType.TYPE_ERROR,
+    ),
+    "missing field": (
+        """
+func main() { o = @; o.a = 1; print(o.a); print(o.b); }
+""",
+        ErrorType.NAME_ERROR,
+    ),
+    "missing method": (
+        """
+func main() { o = @; o.a = 1; o.m(); }
+""",
+        ErrorType.NAME_ERROR,
+    ),
+    "method changed to a value": (
+        """
+func main() { o = @; o.m = lambda() { return 1; }; print(o.m()); o.m = 5; o.m(); }
+""",
+        ErrorType.TYPE_ERROR,
+    ),
+    "method of nil": (
+        """
+func main() { o = nil; print(1); o.m(); }
+""",
+        ErrorType.TYPE_ERROR,
+    ),
+}
+
+
+def run(program, mode, environment=Interpreter.FRAMES_ENV):
+    interpreter = Interpreter(
+        console_output=False, inp=["5", "7"], mode=mode, environment=environment
+    )
+    try:
+        interpreter.run(program)
+        error = None
+    except Exception as e:
+        error = (interpreter.get_error_type_and_line()[0], str(e))
+    return interpreter.get_output(), error
+
+
+# runs every program in the mode and environment of the subclass and in the
+# tree-walking interpreter with the default environment, which the others have
+# to match exactly
+class DifferentialTest:
+    mode = None
+    environment = Interpreter.FRAMES_ENV
+
+    def test_programs(self):
+        for name, program in PROGRAMS.items():
+            with self.subTest(name):
+                expected = run(program, Interpreter.TREE_MODE)
+                self.assertIsNone(expected[1])
+                self.assertEqual(run(program, self.mode, self.environment), expected)
+
+    def test_errors(self):
+        for name, (program, error_type) in ERRORS.items():
+            with self.subTest(name):
+                expected = run(program, Interpreter.TREE_MODE)
+                self.assertEqual(expected[1][0], error_type)
+                self.assertEqual(run(program, self.mode, self.environment), expected)
+
+
+class ClosureModeTest(DifferentialTest, unittest.TestCase):
+    mode = Interpreter.CLOSURE_MODE
+
+
+class BytecodeModeTest(DifferentialTest, unittest.TestCase):
+    mode = Interpreter.BYTECODE_MODE
+
+
+class NativeModeTest(DifferentialTest, unittest.TestCase):
+    mode = Interpreter.NATIVE_MODE
+
+    # functions python can't compile once translated run on the tree walker
+    def test_untranslatable_programs(self):
+        programs = {
+            "long expression": "func main() { print(%s); }" % "+".join(["1"] * 100),
+            "long expression in a direct call": """
+func g(n) { return %s; }
+func f(n) { return g(n) + 1; }
+func main() { print(f(1)); }
+"""
+            % "+".join(["n"] * 100),
+            "nested loops": "func main() { x = 0; %s x = x + 1; %s print(x); }"
+            % ("while (x < 1) { " * 25, "} " * 25),
+        }
+        for name, program in programs.items():
+            with self.subTest(name):
+                expected = run(program, Interpreter.TREE_MODE)
+                self.assertIsNone(expected[1])
+                self.assertEqual(run(program, self.mode, self.environment), expected)
+
+
+class UnboxedModeTest(DifferentialTest, unittest.TestCase):
+    mode = Interpreter.UNBOXED_MODE
+
+
+class StackModeTest(DifferentialTest, unittest.TestCase):
+    mode = Interpreter.STACK_MODE
+
+
+class StackEnvironmentTest(DifferentialTest, unittest.TestCase):
+    mode = Interpreter.TREE_MODE
+    environment = Interpreter.STACKS_ENV
+
+    # get_at relies on the depths the resolver gives: the environment that
+    # many levels below the top binds the symbol, and none above it does
+    def test_resolved_depths(self):
+        get_at = StackEnvironmentManager.get_at
+        depths = []
+
+        def checked_get_at(env, depth, symbol):
+            scopes = env.scopes
+            self.assertIn(symbol, scopes[-1 - depth])
+            for scope in scopes[len(scopes) - depth :]:
+                self.assertNotIn(symbol, scope)
+            depths.append(depth)
+            return get_at(env, depth, symbol)
+
+        with mock.patch.object(StackEnvironmentManager, "get_at", checked_get_at):
+            self.test_programs()
+            self.test_errors()
+        self.assertTrue(any(depths))
+
+    # the variables main creates without searching for them aren't bound
+    # anywhere yet, so creating them can't hide another binding
+    def test_created_variables(self):
+        create = StackEnvironmentManager.create
+        created = []
+
+        def checked_create(env, symbol, value):
+            self.assertIsNone(env.get(symbol))
+            created.append(symbol)
+            create(env, symbol, value)
+
+        with mock.patch.object(StackEnvironmentManager, "create", checked_create):
+            self.test_programs()
+            self.test_errors()
+        self.assertTrue(created)
+
+
+class StackModeStackEnvironmentTest(DifferentialTest, unittest.TestCase):
+    mode = Interpreter.STACK_MODE
+    environment = Interpreter.STACKS_ENV
+
+
+if __name__ == "__main__":
+    unittest.main()
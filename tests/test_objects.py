@@ -0,0 +1,146 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "p4"))
+
+from test_returns import MODES, ModeMatrixTest, run  # noqa: E402
+from type_valuev4 import Object  # noqa: E402
+
+FIELDS = 500
+
+# main passes an object with FIELDS fields and a method to use() by value,
+# and then to write(), which assigns one of its fields
+LARGE_OBJECT = (
+    "func use(o) { return o.m() + o.f7; }\n"
+    "func write(o) { o.f3 = 0; return o.m(); }\n"
+    "func main() {\n"
+    "  o = @;\n"
+    + "".join(f"  o.f{i} = {i};\n" for i in range(FIELDS))
+    + "  o.m = lambda() { return this.f1 + this.f2; };\n"
+    "  print(use(o));\n"
+    "  print(write(o));\n"
+    "  print(o.f3);\n"
+    "}\n"
+)
+
+
+# copies of objects are made lazily; they have to behave like copies that
+# were made right away
+class LazyCopyTest(ModeMatrixTest):
+    def test_no_copy_until_written(self):
+        materialize = Object._Object__materialize
+        for mode in MODES:
+            with self.subTest(mode=mode):
+                materialized = []
+
+                def record(obj):
+                    materialized.append(len(obj.source.values))
+                    materialize(obj)
+
+                with mock.patch.object(Object, "_Object__materialize", record):
+                    self.assertEqual(run(LARGE_OBJECT, mode), ["10", "3", "3"])
+                # only write()'s copy got Values of its own
+                self.assertEqual(materialized, [FIELDS + 1])
+
+    def test_nested_object_changed_after_copy(self):
+        self.check(
+            """
+func keep(o) { return o; }
+func main() {
+  o = @; o.a = 1; i = @; i.v = 1; o.i = i;
+  k = keep(o);
+  i.v = 2;
+  o.a = 5;
+  ki = k.i; oi = o.i; print(k.a, " ", ki.v, " ", oi.v);
+  ki.v = 9;
+  print(i.v, " ", ki.v);
+}
+""",
+            ["1 1 2", "2 9"],
+        )
+
+    def test_cycle(self):
+        self.check(
+            """
+func id(o) { return o; }
+func main() {
+  o = @; o.self = o; o.x = 1;
+  c = id(o);
+  cs = c.self; css = cs.self;
+  print(cs == c, " ", css == c, " ", c == o);
+  o.x = 2;
+  print(cs.x, " ", c.x);
+  cs.x = 7;
+  print(c.x, " ", o.x);
+}
+""",
+            ["true true false", "1 1", "7 2"],
+        )
+
+    def test_shared_field(self):
+        self.check(
+            """
+func id(o) { return o; }
+func main() {
+  s = @; s.v = 1;
+  o = @; o.a = s; o.b = s;
+  c = id(o);
+  x = c.a;
+  cb = c.b; cb.v = 5; ca = c.a;
+  print(x.v, " ", ca.v, " ", s.v, " ", ca == cb);
+}
+""",
+            ["5 5 1 true"],
+        )
+
+    def test_copy_of_copy(self):
+        self.check(
+            """
+func id(o) { return o; }
+func main() {
+  i = @; i.v = 1; o = @; o.i = i; o.p = 1;
+  c = id(o);
+  j = c.i; j.v = 5;
+  d = id(c);
+  di = d.i; ci = c.i; oi = o.i; print(di.v, " ", ci.v, " ", oi.v);
+  c.p = 2;
+  print(d.p, c.p, o.p);
+}
+""",
+            ["5 5 1", "121"],
+        )
+
+    def test_field_bound_to_ref_parameter(self):
+        self.check(
+            """
+func id(o) { return o; }
+func g(ref x, ref o) { c = id(o); x = 42; ci = c.i; print(ci.v); return c; }
+func main() {
+  i = @; i.v = 1; o = @; o.i = i;
+  c = g(i.v, o);
+  ci = c.i; print(ci.v, " ", i.v);
+}
+""",
+            ["1", "1 42"],
+        )
+
+    def test_method_retyped(self):
+        self.check(
+            """
+func id(o) { return o; }
+func main() {
+  o = @; o.m = lambda() { return 1; };
+  c = id(o);
+  q = o.m;
+  q = 5;
+  print(c.m());
+}
+""",
+            ["1"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import os
+import stat
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "p4"))
+
+from interpreterv4 import Interpreter  # noqa: E402
+from parse_cache import ParseCache  # noqa: E402
+
+
+def run(program, parse_cache=None):
+    interpreter = Interpreter(console_output=False, parse_cache=parse_cache)
+    interpreter.run(program)
+    return interpreter.get_output()
+
+
+class ParseCacheTest(unittest.TestCase):
+    def test_hit(self):
+        cache = ParseCache()
+        program = "func main() { print(1 + 2); }"
+        self.assertEqual(run(program, cache), ["3"])
+        self.assertEqual(run(program, cache), ["3"])
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(cache.stats()["memory_hits"], 1)
+
+    # 1+1+...+1 nests one BinOp per term, deeper than pickle can go; the
+    # program runs as it does without a cache, it just isn't stored
+    def test_deep_left_associative_expression(self):
+        program = "func main() { print(" + "+".join(["1"] * 400) + "); }"
+        self.assertEqual(run(program), ["400"])
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for cache in (ParseCache(), ParseCache(cache_dir=cache_dir)):
+                self.assertEqual(run(program, cache), ["400"])
+                self.assertEqual(run(program, cache), ["400"])
+                self.assertEqual(cache.stats()["uncacheable"], 2)
+                self.assertEqual(cache.stats()["entries"], 0)
+            self.assertEqual(os.listdir(cache_dir), [])
+
+
+    # the least recently used entries are dropped once the pickled asts add up
+    # to more than max_bytes
+    def test_eviction(self):
+        programs = [f"func main() {{ print({n}); }}" for n in range(3)]
+        probe = ParseCache()
+        probe.parse(programs[0])
+        size = probe.stats()["bytes"]
+
+        cache = ParseCache(max_bytes=2 * size)
+        cache.parse(programs[0])
+        cache.parse(programs[1])
+        cache.parse(programs[0])  # now programs[1] is the least recently used
+        cache.parse(programs[2])
+        self.assertEqual(cache.stats()["entries"], 2)
+        self.assertEqual(cache.stats()["bytes"], 2 * size)
+        cache.parse(programs[0])
+        self.assertEqual(cache.stats()["memory_hits"], 2)
+        cache.parse(programs[1])
+        self.assertEqual(cache.stats()["misses"], 4)
+
+        # an ast bigger than the whole cache isn't kept at all
+        small = ParseCache(max_bytes=size - 1)
+        small.parse(programs[0])
+        self.assertEqual(small.stats()["entries"], 0)
+
+    def test_disk_hit_from_new_cache(self):
+        program = "func main() { print(1 + 2); }"
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self.assertEqual(run(program, ParseCache(cache_dir=cache_dir)), ["3"])
+            cache = ParseCache(cache_dir=cache_dir)
+            self.assertEqual(run(program, cache), ["3"])
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+            self.assertEqual(cache.stats()["misses"], 0)
+            # the file is only read once, then the entry is in memory
+            self.assertEqual(run(program, cache), ["3"])
+            self.assertEqual(cache.stats()["memory_hits"], 1)
+
+    # a file that can't be unpickled is a miss, and is written again
+    def test_corrupt_file(self):
+        program = "func main() { print(1 + 2); }"
+        with tempfile.TemporaryDirectory() as cache_dir:
+            ParseCache(cache_dir=cache_dir).parse(program)
+            [name] = os.listdir(cache_dir)
+            path = os.path.join(cache_dir, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            for damaged in (data[: len(data) // 2], b"", b"not a pickle"):
+                with self.subTest(damaged=damaged[:12]):
+                    with open(path, "wb") as f:
+                        f.write(damaged)
+                    cache = ParseCache(cache_dir=cache_dir)
+                    self.assertEqual(run(program, cache), ["3"])
+                    self.assertEqual(cache.stats()["disk_hits"], 0)
+                    self.assertEqual(cache.stats()["misses"], 1)
+                    with open(path, "rb") as f:
+                        self.assertEqual(f.read(), data)
+
+    # files written for another FORMAT_VERSION are never read
+    def test_format_version(self):
+        program = "func main() { print(1 + 2); }"
+        with tempfile.TemporaryDirectory() as cache_dir:
+            ParseCache(cache_dir=cache_dir).parse(program)
+            with mock.patch.object(
+                ParseCache, "FORMAT_VERSION", ParseCache.FORMAT_VERSION + 1
+            ):
+                cache = ParseCache(cache_dir=cache_dir)
+                self.assertEqual(run(program, cache), ["3"])
+                self.assertEqual(cache.stats()["disk_hits"], 0)
+                self.assertEqual(cache.stats()["misses"], 1)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+    # anyone who can write to cache_dir can make the cache unpickle anything
+    def test_private_directory(self):
+        with tempfile.TemporaryDirectory() as parent:
+            cache_dir = os.path.join(parent, "asts")
+            ParseCache(cache_dir=cache_dir)
+            self.assertEqual(stat.S_IMODE(os.stat(cache_dir).st_mode) & 0o077, 0)
+            os.chmod(cache_dir, 0o777)
+            with self.assertRaises(ValueError):
+                ParseCache(cache_dir=cache_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import contextlib
+import io
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "p4"))
+
+import brewparse  # noqa: E402
+from rdparse import same_ast  # noqa: E402
+
+THREADS = 8
+PARSES = 20
+
+
+# a multi-line program that's different for every n
+def program(n):
+    return f"""
+func f{n}(a, ref b) {{
+  if (a > {n}) {{
+    b = a * {n};
+  }} else {{
+    while (a < {n}) {{ a = a + 1; }}
+  }}
+  return a;
+}}
+func main() {{
+  o = @;
+  o.m = lambda(x) {{ return x + {n}; }};
+  print(f{n}({n}, o.v), " ", o.m({n}));
+}}
+"""
+
+
+class ThreadTest(unittest.TestCase):
+    # every thread parses with its own parser and lexer, so parsing in
+    # several threads at once gives the same asts as parsing one at a time
+    def test_parse_in_threads(self):
+        programs = [program(n) for n in range(THREADS)]
+        expected = [brewparse.parse_program(p) for p in programs]
+        results = [[] for _ in programs]
+        errors = []
+        start = threading.Barrier(THREADS)
+
+        def parse(n):
+            try:
+                start.wait()
+                for _ in range(PARSES):
+                    results[n].append(brewparse.parse_program(programs[n]))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=parse, args=(n,)) for n in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        for n, asts in enumerate(results):
+            self.assertEqual(len(asts), PARSES)
+            for ast in asts:
+                self.assertTrue(same_ast(expected[n], ast))
+
+
+class LineNumberTest(unittest.TestCase):
+    # the line a syntax error is found on is counted from the start of the
+    # program being parsed, not from where the last one left off
+    def test_error_line_after_long_program(self):
+        long_program = "".join(program(n) for n in range(50))
+        brewparse._ply_parse(long_program)
+        parser = brewparse._thread_parsers.parser
+        lines = []
+
+        def record(token):
+            lines.append(token.lineno)
+
+        with mock.patch.object(parser.lr_parser, "errorfunc", record):
+            with contextlib.redirect_stdout(io.StringIO()):
+                with contextlib.suppress(SyntaxError):
+                    brewparse._ply_parse("func main() {\n  x = 1;\n  y = ;\n}\n")
+        self.assertEqual(lines[:1], [3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "p4"))
+
+import brewparse  # noqa: E402
+import rdparse  # noqa: E402
+from brewparse import ConformanceError, check_conformance  # noqa: E402
+from element import Literal, Program  # noqa: E402
+from intbase import InterpreterBase  # noqa: E402
+
+PROGRAMS = (
+    "func main() { print(1 + 2 * 3 - 4 / 2); }",
+    "func main() { x = -a.b + !c || d && e == f != g < h <= i > j >= k; }",
+    "func f(a, ref b) { if (a) { return; } else { b = a; } while (a > 0) { a = a - 1; } }"
+    " func main() { o = @; o.f = lambda(x) { return x; }; o.f(1); f(1, o.f); }",
+    'func main() { print("s", nil, true, false, ((1)), - -1, !!true); }',
+)
+
+
+def parse_quietly(parse, program):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return parse(program)
+
+
+class ConformanceTest(unittest.TestCase):
+    def test_same_asts(self):
+        for program in PROGRAMS:
+            with self.subTest(program=program):
+                expected = brewparse._ply_parse(program)
+                self.assertTrue(rdparse.same_ast(expected, rdparse.parse_program(program)))
+                self.assertTrue(rdparse.same_ast(expected, check_conformance(program)))
+
+    # parentheses and operators are parsed without recursion, and asts are
+    # compared without recursion, so nesting far deeper than python's
+    # recursion limit works
+    def test_deep_nesting(self):
+        for expression in (
+            "+".join(["1"] * 2000),
+            "(" * 2000 + "1" + ")" * 2000,
+            "-" * 2000 + "1",
+            "(!-(" * 1000 + "x" + "))" * 1000,
+        ):
+            with self.subTest(expression=expression[:12]):
+                program = "func main() { print(" + expression + "); }"
+                expected = brewparse._ply_parse(program)
+                self.assertTrue(rdparse.same_ast(expected, rdparse.parse_program(program)))
+                check_conformance(program)
+
+    def test_syntax_error(self):
+        for program in ("func main() { print((1); }", "func main() { x = 1 +; }"):
+            with self.subTest(program=program):
+                with self.assertRaises(SyntaxError):
+                    parse_quietly(rdparse.parse_program, program)
+                with self.assertRaises(SyntaxError):
+                    parse_quietly(check_conformance, program)
+
+    def test_different_asts(self):
+        program = "func main() { print(1); }"
+        original = rdparse.parse_program
+        rdparse.parse_program = lambda program, report: Program([])
+        try:
+            with self.assertRaises(ConformanceError):
+                check_conformance(program)
+        finally:
+            rdparse.parse_program = original
+
+    def test_rejected_by_rdparse_only(self):
+        def reject(program, report):
+            raise SyntaxError("Syntax error")
+
+        original = rdparse.parse_program
+        rdparse.parse_program = reject
+        try:
+            with self.assertRaises(ConformanceError):
+                check_conformance("func main() { print(1); }")
+        finally:
+            rdparse.parse_program = original
+
+    def test_same_ast_compares_values(self):
+        one = Literal(InterpreterBase.INT_DEF, 1)
+        self.assertTrue(rdparse.same_ast(one, Literal(InterpreterBase.INT_DEF, 1)))
+        self.assertFalse(rdparse.same_ast(one, Literal(InterpreterBase.INT_DEF, 2)))
+        self.assertFalse(rdparse.same_ast(one, Literal(InterpreterBase.BOOL_DEF, True)))
+
+
+if __name__ == "__main__":
+    unittest.main()
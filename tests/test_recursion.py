@@ -0,0 +1,112 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "p4"))
+
+from interpreterv4 import Interpreter  # noqa: E402
+
+# the python frames each brewin call may use in the tree-walking interpreter
+# (as many as before calls were quickened), and those run() and main may use
+FRAMES_PER_CALL = 6
+FRAMES_TO_MAIN = 30
+DEPTH = 300
+
+RECURSIVE_PROGRAMS = (
+    """
+func sum(n) { if (n == 0) { return 0; } return n + sum(n - 1); }
+func main() { print(sum(%d)); }
+""",
+    """
+func main() {
+  sum = lambda(n) { if (n == 0) { return 0; } return n + sum(n - 1); };
+  print(sum(%d));
+}
+""",
+    """
+func main() {
+  o = @;
+  o.sum = lambda(n) { if (n == 0) { return 0; } return n + this.sum(n - 1); };
+  print(o.sum(%d));
+}
+""",
+    """
+func sum(n) { while (n > 0) { s = sum(n - 1); return n + s; } return 0; }
+func main() { print(sum(%d)); }
+""",
+)
+
+
+def stack_depth():
+    depth = 0
+    frame = sys._getframe(1)
+    while frame is not None:
+        depth += 1
+        frame = frame.f_back
+    return depth
+
+
+def run(program):
+    interpreter = Interpreter(console_output=False)
+    interpreter.run(program)
+    return interpreter.get_output()
+
+
+class RecursionDepthTest(unittest.TestCase):
+    def setUp(self):
+        self.recursion_limit = sys.getrecursionlimit()
+
+    def tearDown(self):
+        sys.setrecursionlimit(self.recursion_limit)
+
+    # calls that aren't in tail position recurse in python, so the depth they
+    # can reach depends on the python frames each call uses
+    def test_frames_per_call(self):
+        for program in RECURSIVE_PROGRAMS:
+            with self.subTest(program=program):
+                limit = stack_depth() + FRAMES_TO_MAIN + FRAMES_PER_CALL * DEPTH
+                sys.setrecursionlimit(limit)
+                try:
+                    output = run(program % DEPTH)
+                finally:
+                    sys.setrecursionlimit(self.recursion_limit)
+                self.assertEqual(output, [str(DEPTH * (DEPTH + 1) // 2)])
+
+
+# calls in tail position are run from a loop, so tail recursion is only
+# limited by memory
+class TailCallTest(unittest.TestCase):
+    def test_tail_recursion(self):
+        for program, expected in (
+            (
+                """
+func count(n, total) { if (n == 0) { return total; } return count(n - 1, total + n); }
+func main() { print(count(20000, 0)); }
+""",
+                ["200010000"],
+            ),
+            (
+                """
+func even(n) { if (n == 0) { return true; } return odd(n - 1); }
+func odd(n) { if (n == 0) { return false; } return even(n - 1); }
+func main() { print(even(20001)); }
+""",
+                ["false"],
+            ),
+            (
+                """
+func main() {
+  o = @;
+  o.count = lambda(n) { if (n == 0) { return "done"; } return this.count(n - 1); };
+  print(o.count(20000));
+}
+""",
+                ["done"],
+            ),
+        ):
+            with self.subTest(program=program):
+                self.assertEqual(run(program), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
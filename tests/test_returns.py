@@ -0,0 +1,92 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "p4"))
+
+from interpreterv4 import Interpreter  # noqa: E402
+
+MODES = (
+    Interpreter.TREE_MODE,
+    Interpreter.CLOSURE_MODE,
+    Interpreter.BYTECODE_MODE,
+    Interpreter.NATIVE_MODE,
+    Interpreter.UNBOXED_MODE,
+    Interpreter.STACK_MODE,
+)
+
+
+def run(program, mode):
+    interpreter = Interpreter(console_output=False, mode=mode)
+    interpreter.run(program)
+    return interpreter.get_output()
+
+
+class ModeMatrixTest(unittest.TestCase):
+    def check(self, program, expected):
+        for mode in MODES:
+            with self.subTest(mode=mode):
+                self.assertEqual(run(program, mode), expected)
+
+
+# a returned variable is a copy: assignments made after the return (here by
+# the right operand of +) don't change the result
+class ReturnedVariableTest(ModeMatrixTest):
+    def test_variable(self):
+        self.check(
+            """
+func f() { return x; }
+func g() { x = x + 10; return 1; }
+func main() { x = 1; print(f() + g()); }
+""",
+            ["2"],
+        )
+
+    def test_ref_parameter(self):
+        self.check(
+            """
+func id(ref a) { return a; }
+func inc(ref a) { a = a + 100; return 0; }
+func main() { x = 1; print(id(x) + inc(x)); }
+""",
+            ["1"],
+        )
+
+    def test_captured_variable(self):
+        self.check(
+            """
+func main() {
+  c = 0;
+  f = lambda() { c = c + 1; return c; };
+  print(f() + f());
+}
+""",
+            ["3"],
+        )
+
+
+# an operator sees the value a variable or field has once both of its
+# operands have been evaluated, so assignments made by a call on the right
+# change the left operand
+class OperandTest(ModeMatrixTest):
+    def test_variable_assigned_by_callee(self):
+        self.check(
+            """
+func g() { x = x + 10; return 1; }
+func main() { x = 1; print(x + g()); }
+""",
+            ["12"],
+        )
+
+    def test_field_assigned_through_ref_parameter(self):
+        self.check(
+            """
+func inc(ref k) { k = k + 1; return 0; }
+func main() { o = @; o.q = 5; o.q = o.q + inc(o.q); print(o.q); }
+""",
+            ["6"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
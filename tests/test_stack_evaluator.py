@@ -0,0 +1,116 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "p4"))
+
+from interpreterv4 import Interpreter  # noqa: E402
+
+
+def run(program, mode=Interpreter.STACK_MODE):
+    interpreter = Interpreter(console_output=False, mode=mode)
+    interpreter.run(program)
+    return interpreter.get_output()
+
+
+class StackEvaluatorTest(unittest.TestCase):
+    def test_deep_recursion(self):
+        program = """
+func sum(n) { if (n == 0) { return 0; } return n + sum(n - 1); }
+func main() { print(sum(30000)); }
+"""
+        self.assertEqual(run(program), ["450015000"])
+
+    # nothing recurses in python on the way to running the program either
+    def test_deep_nesting(self):
+        depth = 1200
+        for program, expected in (
+            ("func main() { print(%s); }" % "+".join(["1"] * depth), str(depth)),
+            (
+                "func main() { x = 2; f = lambda() { return %s; }; print(f()); }"
+                % "+".join(["x"] * depth),
+                str(2 * depth),
+            ),
+            ("func main() { print(%s1%s); }" % ("(-" * depth, ")" * depth), "1"),
+            (
+                "func main() { x = 0; %s x = x + 1; %s print(x); }"
+                % ("if (true) { " * depth, "} " * depth),
+                "1",
+            ),
+        ):
+            with self.subTest(program=program[:40]):
+                self.assertEqual(run(program), [expected])
+
+    # print shows each argument as it was when it was evaluated
+    def test_print_argument_order(self):
+        program = """
+func g() { x = x + 10; return 1; }
+func main() { x = 1; print(x, g()); }
+"""
+        self.assertEqual(run(program), run(program, Interpreter.TREE_MODE))
+        self.assertEqual(run(program), ["11"])
+
+    # operands that are names are looked up when their turn comes, not when
+    # the operator is reached
+    def test_operand_order(self):
+        program = """
+func g() { x = x + 10; return 1; }
+func main() {
+  x = 1;
+  print(g() + x, " ", x + g(), " ", x * 2 - g(), " ", -x + x);
+  y = x; y = g() + y; print(y);
+  o = @; o.f = 2; o.f = o.f + g(); print(o.f);
+}
+"""
+        self.assertEqual(run(program), run(program, Interpreter.TREE_MODE))
+        self.assertEqual(run(program), ["12 22 41 0", "32", "3"])
+
+    # print stops at the first argument it can't print, and inputi rejects
+    # too many arguments before evaluating any of them, so the side effects
+    # of the arguments after them never happen
+    def test_errors_before_later_arguments(self):
+        side_effect = 'func f() { print("side effect"); return 1; }\n'
+        for main, expected in (
+            ("func main() { print(nil, f()); }", []),
+            ("func main() { print(1, lambda() { return; }, f()); }", []),
+            ("func main() { o = @; print(f(), o, f()); }", ["side effect"]),
+            ("func main() { x = inputi(f(), f()); }", []),
+        ):
+            with self.subTest(main=main):
+                results = []
+                for mode in (Interpreter.TREE_MODE, Interpreter.STACK_MODE):
+                    interpreter = Interpreter(console_output=False, mode=mode)
+                    try:
+                        interpreter.run(side_effect + main)
+                        error = None
+                    except Exception as e:
+                        error = (type(e), str(e))
+                    results.append((interpreter.get_output(), error))
+                self.assertEqual(results[1], results[0])
+                self.assertEqual(results[0][0], expected)
+                self.assertIsNotNone(results[0][1])
+
+    def test_resume_in_slices(self):
+        program = """
+func fib(n) { if (n < 2) { return n; } return fib(n - 1) + fib(n - 2); }
+func main() { print(fib(10)); }
+"""
+        interpreter = Interpreter(console_output=False)
+        evaluator = interpreter.start(program)
+        self.assertEqual(interpreter.get_output(), [])
+        slices = 1
+        while not evaluator.resume(5):
+            slices += 1
+        self.assertGreater(slices, 1)
+        self.assertEqual(interpreter.get_output(), ["55"])
+        self.assertTrue(evaluator.resume(5))
+
+    def test_resume_all(self):
+        interpreter = Interpreter(console_output=False)
+        evaluator = interpreter.start("func main() { print(1); print(2); }")
+        self.assertTrue(evaluator.resume())
+        self.assertEqual(interpreter.get_output(), ["1", "2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,160 @@
+import importlib
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+P4 = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "p4")
+sys.path.insert(0, P4)
+
+import brewlex  # noqa: E402
+import brewparse  # noqa: E402
+import lextab  # noqa: E402
+import parsetab  # noqa: E402
+from ply import lex, yacc  # noqa: E402
+
+# the number of modules importing brewparse may add to those python starts
+# with; it fails if startup starts pulling in more of the standard library
+MODULE_BUDGET = 60
+
+# importing brewparse may take at most this many times as long as importing
+# ply.yacc, which it needs anyway, on its own.  It takes about 1.5 times as
+# long; regenerating the parser tables at import time takes it over 3 times.
+# Each is the best of IMPORT_RUNS runs, and comparing the two keeps the budget
+# from depending on how fast (or how busy) the machine is
+IMPORT_TIME_RATIO = 2.5
+IMPORT_RUNS = 5
+
+# imports brewparse in a new interpreter, failing if the parser tables are
+# generated instead of read from parsetab.py (or, with BREWIN_FAST_STARTUP=1,
+# if the rules are inspected at all), and prints the modules it imported
+IMPORT_BREWPARSE = """
+import os
+import sys
+from ply import lex, yacc
+
+def fail(message):
+    def fail(*args, **kwargs):
+        raise AssertionError(message)
+    return fail
+
+yacc.LRGeneratedTable = fail("the parser tables were generated")
+if os.environ.get("BREWIN_FAST_STARTUP") == "1":
+    lex.LexerReflect = fail("the token rules were inspected")
+    yacc.ParserReflect = fail("the grammar rules were inspected")
+before = set(sys.modules)
+import brewparse
+brewparse.parse_program("func main() { print(1 + 2 * -x); }")
+print(" ".join(sorted(set(sys.modules) - before)))
+"""
+
+
+def import_brewparse(**env):
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_BREWPARSE],
+        cwd=P4,
+        env=dict(os.environ, **env),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise AssertionError(result.stderr)
+    return set(result.stdout.split())
+
+
+# the best cumulative time to import module in a new interpreter, in
+# microseconds, as reported by python -X importtime
+def import_time(module, **env):
+    best = None
+    for _ in range(IMPORT_RUNS):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import " + module],
+            cwd=P4,
+            env=dict(os.environ, **env),
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise AssertionError(result.stderr)
+        for line in result.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == module:
+                cumulative = int(fields[1])
+                best = cumulative if best is None else min(best, cumulative)
+    return best
+
+
+class StartupTest(unittest.TestCase):
+    # yacc only reads the tables while their signature matches the grammar;
+    # regenerate them with python brewparse.py from p4/ if this fails
+    def test_tables_match_grammar(self):
+        grammar = yacc.ParserReflect(vars(brewparse), log=yacc.NullLogger())
+        grammar.get_all()
+        self.assertEqual(grammar.signature(), parsetab._lr_signature)
+
+    # lextab.py is only read with BREWIN_FAST_STARTUP=1, which doesn't check
+    # it; regenerate it with python brewparse.py from p4/ if this fails
+    def test_lexer_tables_match_rules(self):
+        with tempfile.TemporaryDirectory() as outputdir:
+            lex.lex(module=brewlex, optimize=True, lextab="lextab_check", outputdir=outputdir)
+            sys.path.insert(0, outputdir)
+            try:
+                fresh = importlib.import_module("lextab_check")
+            finally:
+                sys.path.remove(outputdir)
+                sys.modules.pop("lextab_check", None)
+        for name in vars(fresh):
+            if name.startswith("_lex") or name == "_tabversion":
+                self.assertEqual(getattr(lextab, name), getattr(fresh, name), name)
+
+    def test_import_reads_tables(self):
+        for fast_startup in ("0", "1"):
+            with self.subTest(fast_startup=fast_startup):
+                files = set(os.listdir(P4))
+                modules = import_brewparse(
+                    BREWIN_PARSER="ply", BREWIN_FAST_STARTUP=fast_startup
+                )
+                self.assertIn("parsetab", modules)
+                self.assertLessEqual(len(modules), MODULE_BUDGET)
+                # nothing (such as parser.out) is written next to the sources
+                self.assertEqual(
+                    set(os.listdir(P4)) - {"__pycache__"}, files - {"__pycache__"}
+                )
+
+    def test_import_time_budget(self):
+        baseline = import_time("ply.yacc")
+        for fast_startup in ("0", "1"):
+            with self.subTest(fast_startup=fast_startup):
+                elapsed = import_time(
+                    "brewparse", BREWIN_PARSER="ply", BREWIN_FAST_STARTUP=fast_startup
+                )
+                self.assertLessEqual(elapsed, IMPORT_TIME_RATIO * baseline)
+
+    # both ways of building the parser parse programs the same way
+    def test_fast_startup_parses_the_same(self):
+        program = """
+func f(ref a, b) { a.x = b; return lambda(c) { return -c * (a.x + 1) / 2; }; }
+func main() { o = @; g = f(o, 3); if (!(o.x >= 3) || 1 != 2) { print(g(4)); } }
+"""
+        script = "import brewparse; print(brewparse.parse_program(%r))" % program
+        results = []
+        for fast_startup in ("0", "1"):
+            result = subprocess.run(
+                [sys.executable, "-c", script],
+                cwd=P4,
+                env=dict(os.environ, BREWIN_PARSER="ply", BREWIN_FAST_STARTUP=fast_startup),
+                capture_output=True,
+                text=True,
+            )
+            self.assertEqual(result.returncode, 0, result.stderr)
+            results.append(result.stdout)
+        self.assertEqual(results[0], results[1])
+
+    # the hand-written parser is only imported when it is selected
+    def test_rdparse_not_imported_by_default(self):
+        self.assertNotIn("rdparse", import_brewparse(BREWIN_PARSER="ply"))
+
+
+if __name__ == "__main__":
+    unittest.main()